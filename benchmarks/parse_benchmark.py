@@ -0,0 +1,208 @@
+"""Benchmark of the parser targets and thread grouping of read_corpora
+against the string concatenating versions they replaced, on a long phpBB
+post, a long MEDLINE citation and a long thread.
+
+usage: python parse_benchmark.py [size]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from bsddb import db
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import read_corpora
+from indexers import phpBB_parser, XML_parser
+
+DEFAULT_SIZE = 20000
+REPEATS = 3
+LINE = 'the quick brown fox jumps over the lazy dog'
+POST_DELIMITER = '^$~'
+
+class LegacyPostGetter(phpBB_parser.PostGetter):
+    """PostGetter accumulating its title and posts by concatenation.
+    """
+    def clear_fields(self):
+        self.title = ''
+        self.in_title = False
+        self.span_count = 0
+        self.post = ''
+        self.all_posts = []
+        self.in_post = False
+
+    def end(self, tag):
+        if self.in_post and tag == 'span':
+            self.span_count -= 1
+            if self.span_count <= 0:
+                self.all_posts.append(self.post.strip())
+                self.post = ''
+                self.in_post = False
+        elif self.in_title and tag == 'a':
+            self.title = self.title.strip()
+            self.in_title = False
+
+    def data(self, data):
+        if self.in_post:
+            self.post += data
+        elif self.in_title:
+            self.title += data
+
+    def close(self):
+        all_posts = self.all_posts
+        title = self.title
+        self.clear_fields()
+        return title, all_posts
+
+class LegacyTextGetter(XML_parser.TextGetter):
+    """TextGetter accumulating its groups by concatenation.
+    """
+    def clear_fields(self):
+        self.title = ''
+        self.heading = ''
+        self.text = ''
+        self.text_list = []
+        self.in_tag = None
+
+    def end(self, tag):
+        if tag == self.tag_list.title:
+            self.in_tag = None
+            self.title += ' '
+        if tag == self.tag_list.heading:
+            self.in_tag = None
+            self.heading += ' '
+        elif tag == self.tag_list.delimiator:
+            self.in_tag = None
+            group = (self.title.strip(), self.heading.strip(),
+                    self.text.strip())
+            self.text_list.append(group)
+            self.text = ''
+            self.title = ''
+            self.heading = ''
+        elif tag in self.tag_list.tags:
+            self.in_tag = None
+            self.text += ' '
+
+    def data(self, text):
+        if self.in_tag == self.tag_list.title:
+            self.title += text
+        elif self.in_tag == self.tag_list.heading:
+            self.heading += text
+        elif self.in_tag:
+            self.text += text
+
+def legacy_write_posts(title, posts, out_DB):
+    """write_posts rewriting the whole thread whenever its title repeats.
+    """
+    if title and posts:
+        posts = reduce(lambda post1, post2:
+                post1 + POST_DELIMITER + post2, posts)
+        title = title.encode(read_corpora.DEF_LOCALE)
+        posts = posts.encode(read_corpora.DEF_LOCALE)
+        old_posts = out_DB.get(title)
+        if old_posts == None:
+            out_DB.put(title, posts)
+        else:
+            out_DB.put(title, old_posts + POST_DELIMITER + posts)
+
+def legacy_group_thread(pages, temp_dir):
+    """Collapse pages into threads through a temporary hash DB, and read
+    the threads back.
+    """
+    out_DB = db.DB()
+    out_DB.open(os.path.join(temp_dir, 'posts.db'), None, db.DB_HASH,
+            db.DB_CREATE | db.DB_TRUNCATE)
+    for title, posts in pages:
+        legacy_write_posts(title, posts, out_DB)
+    threads = []
+    cursor = out_DB.cursor()
+    record = cursor.first()
+    while record:
+        title, posts = record
+        threads.append((title.decode(read_corpora.DEF_LOCALE),
+            posts.decode(read_corpora.DEF_LOCALE).split(POST_DELIMITER)))
+        record = cursor.next()
+    out_DB.close()
+    return threads
+
+def group_thread(pages, temp_dir):
+    return list(read_corpora.iter_threads(pages,
+        os.path.join(temp_dir, 'posts.runs')))
+
+class BenchmarkTags:
+    """The tag list of a MEDLINE citation, without needing a tag file.
+    """
+    title = 'ArticleTitle'
+    heading = 'MeshHeading'
+    delimiator = 'MedlineCitation'
+    tags = {'ArticleTitle': None, 'MeshHeading': None, 'AbstractText': None}
+
+def make_page(size):
+    """A phpBB page holding one post of @size lines.
+    """
+    return ('<html><body><a class="maintitle">a long thread</a>'
+            '<span class="postbody">%s</span></body></html>'
+            % '<br />'.join([LINE] * size))
+
+def make_citation(size):
+    """A MEDLINE citation with an abstract of @size sections.
+    """
+    return ('<Set><MedlineCitation><ArticleTitle>a long abstract'
+            '</ArticleTitle><MeshHeading>heading</MeshHeading>%s'
+            '</MedlineCitation></Set>'
+            % ''.join(['<AbstractText>%s</AbstractText>' % LINE] * size))
+
+def time_parse(document, parse, target):
+    return min(timeit.Timer(lambda: parse(document, target)).repeat(
+        REPEATS, 1))
+
+def parse_page(page, target):
+    return etree.HTML(page, etree.HTMLParser(target = target))
+
+def parse_citation(citation, target):
+    return etree.XML(citation, etree.XMLParser(target = target))
+
+def time_thread(size, group):
+    """Time collapsing @size pages of a thread into one thread.
+    """
+    pages = [(u'a long thread', [unicode(LINE)] * 10)] * size
+    temp_dir = tempfile.mkdtemp()
+    try:
+        return min(timeit.Timer(lambda: group(pages, temp_dir)).repeat(
+            REPEATS, 1))
+    finally:
+        shutil.rmtree(temp_dir)
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE
+    page = make_page(size)
+    citation = make_citation(size)
+    if parse_page(page, LegacyPostGetter()) != \
+            parse_page(page, phpBB_parser.PostGetter()) or \
+            parse_citation(citation, LegacyTextGetter(BenchmarkTags)) != \
+            parse_citation(citation, XML_parser.TextGetter(BenchmarkTags)):
+        raise ValueError ("parser targets disagree")
+
+    results = [
+        ('phpBB post', time_parse(page, parse_page, LegacyPostGetter()),
+            time_parse(page, parse_page, phpBB_parser.PostGetter())),
+        ('MEDLINE abstract', time_parse(citation, parse_citation,
+                LegacyTextGetter(BenchmarkTags)),
+            time_parse(citation, parse_citation,
+                XML_parser.TextGetter(BenchmarkTags))),
+        ('phpBB thread', time_thread(size // 10, legacy_group_thread),
+            time_thread(size // 10, group_thread)),
+        ]
+
+    print("size %d" % size)
+    print("%-18s %12s %12s %8s" % ('', 'legacy (s)', 'chunks (s)', 'speedup'))
+    for name, legacy, current in results:
+        print("%-18s %12.3f %12.3f %7.2fx" % (name, legacy, current,
+            legacy / current))
+
+if __name__ == '__main__':
+    main()
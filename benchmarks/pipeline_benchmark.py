@@ -0,0 +1,233 @@
+"""Benchmark of every stage of the pipeline, run by an Experimenter on
+synthetic corpora of several sizes: indexing each corpus, then counting
+cooccurrences, calculating PMIs and relations and writing features for
+each target list and window.  The time, throughput and growth in peak
+memory of each stage, as logged by the Experimenter, are saved as JSON,
+and two saved runs can be compared to flag the stages which got slower.
+
+usage: python pipeline_benchmark.py run results.json [options]
+       python pipeline_benchmark.py compare old.json new.json [options]
+"""
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import experimenter
+import stage_stats
+import synthetic_corpus
+
+DEFAULT_SIZES = '200,1000'
+DEFAULT_WINDOWS = '5,50'
+DEFAULT_TARGET_COUNTS = '10,50'
+DEFAULT_CORPUS_TYPES = 'phpBB,xml'
+DEFAULT_REPEATS = 1
+DEFAULT_SYNCH_FREQ = 10000
+# a stage has regressed once it takes this fraction longer than it did
+DEFAULT_THRESHOLD = 0.2
+# and at least this many seconds longer, so that noise in stages taking
+# a few milliseconds isn't flagged
+MIN_REGRESSION_SECONDS = 0.05
+TRUTH_FUNCTION = '5_way'
+# the fields which identify the result of a stage in a run
+RESULT_KEY = ('corpus_type', 'docs', 'targets', 'window', 'stage')
+
+def parse_list(value, parse=int):
+    return [parse(item) for item in value.split(',') if item]
+
+def parse_window(value):
+    if value == 'inf':
+        return float('inf')
+    return int(value)
+
+def get_stage_results(log_file, start, **info):
+    """Return the records of a stage log from the @start'th on, with the
+    records of the same stage summed into one and given the items of
+    @info.
+    """
+    results = {}
+    for record in stage_stats.read_log(log_file)[start:]:
+        result = results.get(record['stage'])
+        if result is None:
+            result = results[record['stage']] = dict(info,
+                    stage=record['stage'], wall_seconds=0.0,
+                    cpu_seconds=0.0, peak_rss_growth_kb=0, counters={})
+        result['wall_seconds'] += record['wall_seconds']
+        result['cpu_seconds'] += record['cpu_seconds']
+        result['peak_rss_growth_kb'] = max(result['peak_rss_growth_kb'],
+                record['peak_rss_growth_kb'])
+        for counter, value in record['counters'].iteritems():
+            result['counters'][counter] = \
+                    result['counters'].get(counter, 0) + value
+    return results.values()
+
+def run_corpus(work_dir, generator, corpus_type, docs, options):
+    """Index a synthetic corpus of @docs documents, then perform an
+    experiment on it for each target list and window, returning the
+    results of every stage.
+    """
+    corpus_dir = os.path.join(work_dir, '%s_%d' % (corpus_type, docs))
+    generator.write_corpus(corpus_type, corpus_dir, docs)
+    stop_file = os.path.join(work_dir, 'stop_words.txt')
+    tag_file = os.path.join(work_dir, 'tags.txt')
+    truth_file = os.path.join(work_dir, 'truth.db')
+    generator.write_stop_words(stop_file)
+    generator.write_tag_file(tag_file)
+    generator.write_truth_db(truth_file)
+
+    experiment = experimenter.Experimenter(os.path.join(work_dir,
+        'experiment_%s_%d' % (corpus_type, docs)))
+    log_file = os.path.join(experiment.directory, experimenter.STAGE_LOG_FILE)
+    experiment.add_to_index(corpus_dir, corpus_type, stop_file, tag_file,
+            options.synch_freq, options.workers)
+    results = get_stage_results(log_file, 0, corpus_type=corpus_type,
+            docs=docs, targets=None, window=None)
+
+    for target_count in parse_list(options.targets):
+        target_file = os.path.join(work_dir, 'targets_%d.txt' % target_count)
+        generator.write_targets(target_file, target_count)
+        for window in parse_list(options.windows, parse_window):
+            start = len(stage_stats.read_log(log_file))
+            experiment.perform_experiment(target_file, window=window,
+                    truth_db=truth_file, truth_function=TRUTH_FUNCTION,
+                    workers=options.workers)
+            results.extend(get_stage_results(log_file, start,
+                corpus_type=corpus_type, docs=docs, targets=target_count,
+                window=window))
+    return results
+
+def run_benchmark(options):
+    """Return the results of every stage on every corpus, keeping the
+    fastest of the repeats of each stage.
+    """
+    generator = synthetic_corpus.CorpusGenerator(options.seed,
+            options.vocabulary_size, options.zipf_exponent,
+            max(parse_list(options.targets)), options.target_density,
+            options.doc_length)
+    fastest = {}
+    for _ in xrange(options.repeats):
+        work_dir = tempfile.mkdtemp(prefix='pipeline_benchmark')
+        try:
+            for corpus_type in parse_list(options.corpus_types, str):
+                for docs in parse_list(options.sizes):
+                    for result in run_corpus(work_dir, generator,
+                            corpus_type, docs, options):
+                        key = tuple([result[field] for field in RESULT_KEY])
+                        if key not in fastest or result['wall_seconds'] < \
+                                fastest[key]['wall_seconds']:
+                            fastest[key] = result
+        finally:
+            shutil.rmtree(work_dir)
+    return [fastest[key] for key in sorted(fastest)]
+
+def compare_results(old_results, new_results, threshold):
+    """Return the (key, old seconds, new seconds, regressed) of every
+    stage in both runs, and the keys of the stages in only one of them.
+    """
+    old_results = dict((tuple([result[field] for field in RESULT_KEY]),
+        result) for result in old_results)
+    new_results = dict((tuple([result[field] for field in RESULT_KEY]),
+        result) for result in new_results)
+    comparisons = []
+    for key in sorted(set(old_results) & set(new_results)):
+        old_seconds = old_results[key]['wall_seconds']
+        new_seconds = new_results[key]['wall_seconds']
+        regressed = new_seconds > old_seconds * (1 + threshold) and \
+                new_seconds - old_seconds > MIN_REGRESSION_SECONDS
+        comparisons.append((key, old_seconds, new_seconds, regressed))
+    return comparisons, sorted(set(old_results) ^ set(new_results))
+
+def format_key(key):
+    return ' '.join([str(value) for value in key if value is not None])
+
+def run(results_file, options):
+    results = run_benchmark(options)
+    with open(results_file, 'w') as file:
+        json.dump({
+            'created': time.time(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'options': options.__dict__,
+            'results': results,
+            }, file, indent=1, sort_keys=True)
+
+    print("%-44s %10s %10s %12s" % ('stage', 'wall (s)', 'cpu (s)',
+        'peak +(KB)'))
+    for result in results:
+        print("%-44s %10.3f %10.3f %12d" % (format_key(
+            [result[field] for field in RESULT_KEY]),
+            result['wall_seconds'], result['cpu_seconds'],
+            result['peak_rss_growth_kb']))
+
+def compare(old_file, new_file, options):
+    """Print the change in time of every stage between two runs, returning
+    whether any stage regressed.
+    """
+    with open(old_file, 'r') as file:
+        old_results = json.load(file)['results']
+    with open(new_file, 'r') as file:
+        new_results = json.load(file)['results']
+    comparisons, unmatched = compare_results(old_results, new_results,
+            options.threshold)
+
+    print("%-44s %10s %10s %8s" % ('stage', 'old (s)', 'new (s)', 'change'))
+    for key, old_seconds, new_seconds, regressed in comparisons:
+        change = (new_seconds - old_seconds) / old_seconds \
+                if old_seconds else 0.0
+        print("%-44s %10.3f %10.3f %+7.0f%%%s" % (format_key(key),
+            old_seconds, new_seconds, 100 * change,
+            '  REGRESSION' if regressed else ''))
+    for key in unmatched:
+        print("%-44s only in one run" % format_key(key))
+    regressions = len([comparison for comparison in comparisons
+        if comparison[3]])
+    print("%d of %d stages regressed" % (regressions, len(comparisons)))
+    return regressions > 0
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip().split('usage: ')[1])
+    parser.add_option('--sizes', default=DEFAULT_SIZES,
+            help="comma separated numbers of documents in the corpora")
+    parser.add_option('--windows', default=DEFAULT_WINDOWS,
+            help="comma separated windows")
+    parser.add_option('--targets', default=DEFAULT_TARGET_COUNTS,
+            help="comma separated numbers of targets in the target lists")
+    parser.add_option('--corpus-types', default=DEFAULT_CORPUS_TYPES,
+            help="comma separated corpus types, phpBB and/or xml")
+    parser.add_option('--seed', type='int',
+            default=synthetic_corpus.DEFAULT_SEED)
+    parser.add_option('--vocabulary-size', type='int',
+            default=synthetic_corpus.DEFAULT_VOCABULARY_SIZE)
+    parser.add_option('--zipf-exponent', type='float',
+            default=synthetic_corpus.DEFAULT_ZIPF_EXPONENT)
+    parser.add_option('--target-density', type='float',
+            default=synthetic_corpus.DEFAULT_TARGET_DENSITY,
+            help="fraction of the words of the corpora which are targets")
+    parser.add_option('--doc-length', type='int',
+            default=synthetic_corpus.DEFAULT_DOC_LENGTH,
+            help="average number of words in a document")
+    parser.add_option('--workers', type='int', default=1)
+    parser.add_option('--synch-freq', type='int', default=DEFAULT_SYNCH_FREQ)
+    parser.add_option('--repeats', type='int', default=DEFAULT_REPEATS,
+            help="times to run each stage, keeping the fastest")
+    parser.add_option('--threshold', type='float', default=DEFAULT_THRESHOLD,
+            help="fraction a stage must slow down by to be a regression")
+    options, args = parser.parse_args()
+
+    if len(args) == 2 and args[0] == 'run':
+        run(args[1], options)
+    elif len(args) == 3 and args[0] == 'compare':
+        if compare(args[1], args[2], options):
+            sys.exit(1)
+    else:
+        parser.error("expected run or compare")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Seeded generator of synthetic corpora for benchmarks: phpBB forum pages
+and MEDLINE style XML citations, whose words are drawn from a generated
+vocabulary with a Zipf distribution and have target words mixed in at a
+given density.  The same seed and parameters always give the same corpus,
+along with its target lists, stop words, tag file and truth DB.
+
+usage: python synthetic_corpus.py out_dir [docs] [phpBB|xml] [seed]
+"""
+
+import bisect
+import os
+import random
+import sys
+
+from bsddb import db
+
+DEFAULT_DOCS = 1000
+DEFAULT_SEED = 0
+DEFAULT_VOCABULARY_SIZE = 20000
+DEFAULT_ZIPF_EXPONENT = 1.1
+DEFAULT_TARGET_COUNT = 100
+DEFAULT_TARGET_DENSITY = 0.01
+DEFAULT_DOC_LENGTH = 200
+# fraction of the targets which are two word phrases
+PHRASE_TARGET_RATE = 0.2
+# most frequent words of the vocabulary written to the stop word file
+STOP_WORD_COUNT = 50
+# fraction of the pairs of targets given a correlation in the truth DB
+TRUTH_PAIR_RATE = 0.5
+POSTS_PER_PAGE = 10
+PAGES_PER_THREAD = 3
+CITATIONS_PER_FILE = 100
+WORDS_PER_LINE = 12
+TITLE_LENGTH = 6
+HEADING_LENGTH = 3
+# words are strings of consonant-vowel syllables, and targets start with
+# a letter which is not one of the consonants so they never collide
+# with a word of the vocabulary
+CONSONANTS = 'bcdfghklmnprstvw'
+VOWELS = 'aeiou'
+TARGET_PREFIX = 'x'
+TAGS = ['TitleTag: ArticleTitle', 'DelimiatorTag: MedlineCitation',
+        'HeadingTag: MeshHeading', 'AbstractText']
+# each kind of output draws from a random stream of its own, so changing
+# one of them leaves the others alone
+PHPBB_STREAM = 1
+XML_STREAM = 2
+TRUTH_STREAM = 3
+TARGET_STREAM = 4
+
+def make_word(number, prefix=''):
+    """Return the word of a number, a syllable for each of its digits in
+    base len(CONSONANTS) * len(VOWELS).
+    """
+    syllables = []
+    while True:
+        number, digit = divmod(number, len(CONSONANTS) * len(VOWELS))
+        syllables.append(CONSONANTS[digit // len(VOWELS)] +
+                VOWELS[digit % len(VOWELS)])
+        if not number:
+            break
+    return prefix + ''.join(syllables)
+
+class ZipfSampler:
+    """Draws ranks in [0, @size) where rank r is drawn with a probability
+    proportional to 1 / (r + 1) ** @exponent.
+    """
+    def __init__(self, size, exponent, rand):
+        self.rand = rand
+        self.cumulative = []
+        total = 0.0
+        for rank in xrange(1, size + 1):
+            total += rank ** -exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self):
+        return bisect.bisect(self.cumulative, self.rand.random() * self.total)
+
+class CorpusGenerator:
+    """Writes synthetic corpora and the files experiments on them need.
+    The vocabulary is ranked by frequency, so its first words are the
+    most common ones.
+    """
+    def __init__(self, seed=DEFAULT_SEED,
+            vocabulary_size=DEFAULT_VOCABULARY_SIZE,
+            zipf_exponent=DEFAULT_ZIPF_EXPONENT,
+            target_count=DEFAULT_TARGET_COUNT,
+            target_density=DEFAULT_TARGET_DENSITY,
+            doc_length=DEFAULT_DOC_LENGTH):
+        self.seed = seed
+        self.zipf_exponent = zipf_exponent
+        self.target_density = target_density
+        self.doc_length = doc_length
+        self.vocabulary = [make_word(number)
+                for number in xrange(vocabulary_size)]
+
+        rand = self.get_random(TARGET_STREAM)
+        self.targets = []
+        for number in xrange(target_count):
+            target = make_word(number, TARGET_PREFIX)
+            if rand.random() < PHRASE_TARGET_RATE:
+                target += ' ' + make_word(target_count + number,
+                        TARGET_PREFIX)
+            self.targets.append(target)
+
+    def get_random(self, stream):
+        return random.Random(self.seed * 10 + stream)
+
+    def make_text(self, length, rand, sampler):
+        """Return a list of @length words, each of them a target with a
+        probability of the target density.
+        """
+        words = []
+        for _ in xrange(length):
+            if rand.random() < self.target_density:
+                words.append(rand.choice(self.targets))
+            else:
+                words.append(self.vocabulary[sampler.sample()])
+        return words
+
+    def make_doc(self, rand, sampler, line_break):
+        """Return the text of a document of around the document length,
+        with a @line_break every WORDS_PER_LINE words.
+        """
+        words = self.make_text(rand.randint(self.doc_length // 2,
+            self.doc_length * 3 // 2), rand, sampler)
+        return line_break.join([' '.join(words[start:start + WORDS_PER_LINE])
+            for start in xrange(0, len(words), WORDS_PER_LINE)])
+
+    def write_phpBB(self, corpus_dir, docs):
+        """Write @docs posts as phpBB pages of POSTS_PER_PAGE posts, in
+        threads of PAGES_PER_THREAD pages.
+        """
+        rand = self.get_random(PHPBB_STREAM)
+        sampler = ZipfSampler(len(self.vocabulary), self.zipf_exponent, rand)
+        page_num = 0
+        while docs > 0:
+            thread_num, page = divmod(page_num, PAGES_PER_THREAD)
+            if page == 0:
+                title = ' '.join(self.make_text(TITLE_LENGTH, rand, sampler))
+            thread_dir = os.path.join(corpus_dir, 'thread%d' % thread_num)
+            if not os.path.exists(thread_dir):
+                os.makedirs(thread_dir)
+            posts = ['<span class="postbody">%s</span>' %
+                    self.make_doc(rand, sampler, '<br />')
+                    for _ in xrange(min(docs, POSTS_PER_PAGE))]
+            with open(os.path.join(thread_dir, 'page%d.html' % page),
+                    'w') as page_file:
+                page_file.write('<html><body><a class="maintitle" '
+                        'href="viewtopic.html">%s</a>%s</body></html>\n'
+                        % (title, ''.join(posts)))
+            docs -= len(posts)
+            page_num += 1
+
+    def write_xml(self, corpus_dir, docs):
+        """Write @docs MEDLINE citations into files of CITATIONS_PER_FILE
+        citations.
+        """
+        rand = self.get_random(XML_STREAM)
+        sampler = ZipfSampler(len(self.vocabulary), self.zipf_exponent, rand)
+        if not os.path.exists(corpus_dir):
+            os.makedirs(corpus_dir)
+        file_num = 0
+        while docs > 0:
+            with open(os.path.join(corpus_dir, 'citations%d.xml' % file_num),
+                    'w') as xml_file:
+                xml_file.write('<MedlineCitationSet>\n')
+                for _ in xrange(min(docs, CITATIONS_PER_FILE)):
+                    xml_file.write('<MedlineCitation><ArticleTitle>%s'
+                            '</ArticleTitle><MeshHeading>%s</MeshHeading>'
+                            '<AbstractText>%s</AbstractText>'
+                            '</MedlineCitation>\n' % (
+                        ' '.join(self.make_text(TITLE_LENGTH, rand, sampler)),
+                        ' '.join(self.make_text(HEADING_LENGTH, rand,
+                            sampler)),
+                        self.make_doc(rand, sampler, '\n')))
+                    docs -= 1
+                xml_file.write('</MedlineCitationSet>\n')
+            file_num += 1
+
+    def write_corpus(self, corpus_type, corpus_dir, docs):
+        if corpus_type == 'phpBB':
+            self.write_phpBB(corpus_dir, docs)
+        elif corpus_type == 'xml':
+            self.write_xml(corpus_dir, docs)
+        else:
+            raise AttributeError ("invalid corpus type %s\n\
+                    must be one of phpBB or xml" % corpus_type)
+
+    def write_targets(self, target_file, target_count=None):
+        """Write the first @target_count targets, or all of them.
+        """
+        with open(target_file, 'w') as file:
+            for target in self.targets[:target_count]:
+                file.write(target + '\n')
+
+    def write_stop_words(self, stop_file):
+        with open(stop_file, 'w') as file:
+            for word in self.vocabulary[:STOP_WORD_COUNT]:
+                file.write(word + '\n')
+
+    def write_tag_file(self, tag_file):
+        with open(tag_file, 'w') as file:
+            file.write('\n'.join(TAGS) + '\n')
+
+    def write_truth_db(self, truth_file):
+        """Write a truth DB with a pearson correlation for TRUTH_PAIR_RATE
+        of the ordered pairs of targets.
+        """
+        rand = self.get_random(TRUTH_STREAM)
+        truth_DB = db.DB()
+        truth_DB.open(truth_file, None, db.DB_HASH,
+                db.DB_CREATE | db.DB_TRUNCATE)
+        for target_1 in self.targets:
+            for target_2 in self.targets:
+                if target_1 != target_2 and rand.random() < TRUTH_PAIR_RATE:
+                    truth_DB.put('%s,%s' % (target_1, target_2),
+                            str(rand.uniform(-.6, .6)))
+        truth_DB.close()
+
+def main():
+    out_dir = sys.argv[1]
+    docs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_DOCS
+    corpus_type = sys.argv[3] if len(sys.argv) > 3 else 'phpBB'
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_SEED
+
+    generator = CorpusGenerator(seed)
+    generator.write_corpus(corpus_type, os.path.join(out_dir, corpus_type),
+            docs)
+    generator.write_targets(os.path.join(out_dir, 'targets.txt'))
+    generator.write_stop_words(os.path.join(out_dir, 'stop_words.txt'))
+    generator.write_tag_file(os.path.join(out_dir, 'tags.txt'))
+    generator.write_truth_db(os.path.join(out_dir, 'truth.db'))
+    print("wrote %d %s documents into %s" % (docs, corpus_type, out_dir))
+
+if __name__ == '__main__':
+    main()
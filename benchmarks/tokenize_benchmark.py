@@ -0,0 +1,67 @@
+"""Benchmark of tokenizer.tokenize against normalizing, splitting and
+filtering stop words in separate passes, on the posts of a phpBB forum
+crawl.
+
+usage: python tokenize_benchmark.py corpus_dir [stop_file]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import read_corpora
+from normalize import normalize
+from tokenizer import tokenize
+
+REPEATS = 3
+
+def legacy_tokenize(text, stop_words):
+    """The normalize, split and filter passes Jar used to make.
+    """
+    text = normalize(text).split()
+    return ([(word, word_pos) for word_pos, word in enumerate(text)
+             if word not in stop_words], len(text))
+
+def read_stop_words(stop_file):
+    stop_words = {}
+    if stop_file:
+        with open(stop_file, 'r') as file:
+            for line in file:
+                stop_words[normalize(line.strip())] = None
+    return stop_words
+
+def read_texts(corpus_dir):
+    """Return the titles and posts of every thread in the corpus.
+    """
+    texts = []
+    for title, posts in read_corpora.iter_phpBB_threads(corpus_dir):
+        texts.append(title)
+        texts.extend(posts)
+    return texts
+
+def time_tokenize(texts, stop_words, tokenize):
+    def tokenize_all():
+        for text in texts:
+            tokenize(text, stop_words)
+    return min(timeit.Timer(tokenize_all).repeat(REPEATS, 1))
+
+def main():
+    texts = read_texts(sys.argv[1])
+    stop_words = read_stop_words(sys.argv[2] if len(sys.argv) > 2 else None)
+    for text in texts:
+        if tokenize(text, stop_words) != legacy_tokenize(text, stop_words):
+            raise ValueError ("tokenizers disagree on %r" % text)
+
+    legacy = time_tokenize(texts, stop_words, legacy_tokenize)
+    current = time_tokenize(texts, stop_words, tokenize)
+    print("%d texts, %d characters" % (len(texts),
+        sum([len(text) for text in texts])))
+    print("%-12s %12s" % ('', 'time (s)'))
+    print("%-12s %12.3f" % ('legacy', legacy))
+    print("%-12s %12.3f" % ('tokenizer', current))
+    print("speedup %.2fx" % (legacy / current))
+
+if __name__ == '__main__':
+    main()
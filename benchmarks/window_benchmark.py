@@ -0,0 +1,136 @@
+"""Microbenchmark of the sliding window classes of get_cooccurrences against
+the list based classes they replaced, across window sizes.
+
+usage: python window_benchmark.py [words] [windows...]
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import get_cooccurrences
+
+DEFAULT_WORDS = 200000
+DEFAULT_WINDOWS = [10, 50, 100, 250, 500]
+VOCABULARY_SIZE = 5000
+TARGET_COUNT = 50
+STOP_WORD_RATE = 0.3
+REPEATS = 3
+
+class LegacyLimitQueue:
+    """The list based LimitQueue, evicting with pop(0).
+    """
+    @classmethod
+    def set_window(cls, window):
+        cls.window = window
+
+    def __init__(self):
+        self.queue = []
+
+    def push(self, indexed_word):
+        word, word_pos = indexed_word
+        self.queue.append(indexed_word)
+
+        head_word, head_word_pos = self.queue[0]
+        room_left = self.window - (word_pos - head_word_pos)
+        while room_left <= 0:
+            old_head_word, old_head_num = self.queue.pop(0)
+            head_word, head_word_pos = self.queue[0]
+            room_left += (head_word_pos - old_head_num)
+
+class LegacyCooccurrenceLimiter:
+    """The dictionary based CooccurrenceLimiter, scanning every target
+    for each word.
+    """
+    @classmethod
+    def set_window(cls, window):
+        cls.window = window
+
+    def __init__(self):
+        self.targets = {}
+
+    def place_target_in_window(self, indexed_target):
+        target_word, target_pos = indexed_target
+        self.targets[target_word] = target_pos
+
+    def get_targets_in_window(self, indexed_word):
+        word, word_pos = indexed_word
+        targets_in_window = []
+        for target_word, target_pos in self.targets.items():
+            if self.window - (word_pos - target_pos) <= 0:
+                del self.targets[target_word]
+            else:
+                targets_in_window.append((target_word, target_pos))
+        return targets_in_window
+
+def make_text(words, seed=0):
+    """Return a list of (term id, word_position) pairs, with gaps left by
+    stop words, in which the first TARGET_COUNT term ids are targets.
+    """
+    rand = random.Random(seed)
+    text = []
+    word_pos = 0
+    for _ in xrange(words):
+        word_pos += 1
+        if rand.random() < STOP_WORD_RATE:
+            continue
+        text.append((rand.randrange(VOCABULARY_SIZE), word_pos))
+    return text
+
+def slide(text, targets, queue_class, limiter_class):
+    """Run the window bookkeeping of get_counts over @text, returning the
+    number of cooccurrences seen.
+    """
+    limit_queue = queue_class()
+    cooccurrence_limiter = limiter_class()
+    cooccurrences = 0
+    for indexed_word in text:
+        word, word_pos = indexed_word
+        cooccurrences += len(
+                cooccurrence_limiter.get_targets_in_window(indexed_word))
+        if word in targets:
+            cooccurrences += len(limit_queue.queue)
+            cooccurrence_limiter.place_target_in_window(indexed_word)
+        limit_queue.push(indexed_word)
+    return cooccurrences
+
+def time_classes(text, targets, window, queue_class, limiter_class):
+    queue_class.set_window(window)
+    limiter_class.set_window(window)
+    timer = timeit.Timer(lambda: slide(text, targets, queue_class,
+        limiter_class))
+    return min(timer.repeat(REPEATS, 1))
+
+def main():
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WORDS
+    windows = [int(window) for window in sys.argv[2:]] or DEFAULT_WINDOWS
+    text = make_text(words)
+    targets = dict.fromkeys(range(TARGET_COUNT))
+
+    print("%d words, %d targets" % (len(text), len(targets)))
+    print("%8s %12s %12s %8s" % ('window', 'legacy (s)', 'deque (s)',
+        'speedup'))
+    for window in windows:
+        ## both implementations must see the same cooccurrences
+        get_cooccurrences.set_window(window)
+        LegacyLimitQueue.set_window(window)
+        LegacyCooccurrenceLimiter.set_window(window)
+        if slide(text, targets, LegacyLimitQueue,
+                LegacyCooccurrenceLimiter) != slide(text, targets,
+                get_cooccurrences.LimitQueue,
+                get_cooccurrences.CooccurrenceLimiter):
+            raise ValueError ("window classes disagree at window %d" % window)
+
+        legacy = time_classes(text, targets, window, LegacyLimitQueue,
+                LegacyCooccurrenceLimiter)
+        current = time_classes(text, targets, window,
+                get_cooccurrences.LimitQueue,
+                get_cooccurrences.CooccurrenceLimiter)
+        print("%8d %12.3f %12.3f %7.2fx" % (window, legacy, current,
+            legacy / current))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""A compact, memory-mappable columnar index.
+
+An index is a directory holding:
+
+vocabulary.txt -- one utf-8 encoded word per line, the line number is the
+                  word's term id
+sources.txt    -- one document source per line, the line number is the
+                  source id
+terms.bin      -- int32 term ids of every indexed word, field after field
+positions.bin  -- int32 word positions, aligned with terms.bin
+docs.bin       -- one int64 record per document: the source id followed by
+                  a (start, length) pair into terms.bin/positions.bin for
+                  each of the title, meta_info and text fields.  A length
+                  of -1 marks a field which was None.
+postings.bin   -- int64 offsets into terms.bin of every occurrence of each
+                  term, grouped by term id and in offset order within a
+                  term
+term_counts.bin -- int64 number of occurrences of each term id, which
+                  also gives where each term's postings start
+
+The postings and term counts are written by write_postings once a corpus
+has been indexed.
+"""
+
+import cPickle
+import hashlib
+import mmap
+import os
+import shutil
+import sys
+
+import numpy
+
+VOCABULARY_FILE = 'vocabulary.txt'
+SOURCE_FILE = 'sources.txt'
+TERM_FILE = 'terms.bin'
+POSITION_FILE = 'positions.bin'
+DOC_FILE = 'docs.bin'
+POSTING_FILE = 'postings.bin'
+TERM_COUNT_FILE = 'term_counts.bin'
+
+TERM_TYPE = numpy.int32
+POSITION_TYPE = numpy.int32
+DOC_TYPE = numpy.int64
+POSTING_TYPE = numpy.int64
+TERM_COUNT_TYPE = numpy.int64
+
+DOC_FIELDS = 3 # title, meta_info, text
+DOC_RECORD_LENGTH = 1 + 2 * DOC_FIELDS
+NO_FIELD = -1
+NO_SOURCE = -1
+## what files and directories are called while they are being written
+WRITING_SUFFIX = '.writing'
+## bytes of a file hashed at a time
+HASH_BUFFER_SIZE = 1 << 20
+
+def replace_atomically(path, build):
+    """Call @build with a temporary path, whose file or directory then
+    replaces @path, so an interruption never leaves a partially built
+    file or directory behind.  Whatever an interrupted call left at the
+    temporary path is removed first.
+    """
+    temp_path = path + WRITING_SUFFIX
+    if os.path.isdir(temp_path):
+        shutil.rmtree(temp_path)
+    build(temp_path)
+    os.rename(temp_path, path)
+
+def write_atomically(file_name, write):
+    """Call @write with a temporary file which then replaces @file_name,
+    so an interruption never leaves a partially written file behind.
+    """
+    def build(temp_file_name):
+        with open(temp_file_name, 'wb') as file:
+            write(file)
+    replace_atomically(file_name, build)
+
+def update_digest(digest, file_name):
+    """Add the contents of a file to a hashlib @digest, a buffer at a
+    time.
+    """
+    with open(file_name, 'rb') as file:
+        while True:
+            data = file.read(HASH_BUFFER_SIZE)
+            if not data:
+                break
+            digest.update(data)
+
+def _read_lines(file_name):
+    """Return the utf-8 decoded lines of a file, or an empty list if
+    the file doesn't exist yet.
+    """
+    if not os.path.isfile(file_name):
+        return []
+    with open(file_name, 'rb') as file:
+        return [line[:-1].decode('utf-8') for line in file]
+
+def _encode(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+def _count_items(file_name, dtype):
+    if not os.path.isfile(file_name):
+        return 0
+    return os.path.getsize(file_name) / numpy.dtype(dtype).itemsize
+
+def _map_array(file_name, dtype):
+    """Return a read-only, zero-copy view of a binary array file along
+    with the mmap backing it (None for empty or missing files).
+    """
+    if not os.path.isfile(file_name) or os.path.getsize(file_name) == 0:
+        return numpy.zeros(0, dtype), None
+    with open(file_name, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return numpy.frombuffer(mapped, dtype), mapped
+
+class IndexWriter:
+    """Appends documents to a columnar index, buffering them in memory
+    until flush is called.
+    """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+
+        self.vocabulary = {}
+        for term_id, word in enumerate(
+                _read_lines(os.path.join(index_dir, VOCABULARY_FILE))):
+            self.vocabulary[word] = term_id
+        self.sources = {}
+        for source_id, source in enumerate(
+                _read_lines(os.path.join(index_dir, SOURCE_FILE))):
+            self.sources[source] = source_id
+
+        self.token_count = _count_items(os.path.join(index_dir, TERM_FILE),
+                TERM_TYPE)
+        self.doc_count = _count_items(os.path.join(index_dir, DOC_FILE),
+                DOC_TYPE) / DOC_RECORD_LENGTH
+
+        self.clear_buffers()
+
+    def get_lengths(self):
+        """Return the lengths of the index files as of the last flush,
+        which truncate_index can roll the index back to.
+        """
+        return {
+            VOCABULARY_FILE: len(self.vocabulary) - len(self.new_words),
+            SOURCE_FILE: len(self.sources) - len(self.new_sources),
+            TERM_FILE: self.token_count - len(self.terms),
+            POSITION_FILE: self.token_count - len(self.positions),
+            DOC_FILE: (self.doc_count - len(self.docs)) * DOC_RECORD_LENGTH,
+            }
+
+    def clear_buffers(self):
+        self.new_words = []
+        self.new_sources = []
+        self.terms = []
+        self.positions = []
+        self.docs = []
+
+    def get_term_id(self, word):
+        """Return the term id of a word, adding it to the vocabulary if
+        it hasn't been seen before.
+        """
+        try:
+            return self.vocabulary[word]
+        except KeyError:
+            term_id = len(self.vocabulary)
+            self.vocabulary[word] = term_id
+            self.new_words.append(word)
+            return term_id
+
+    def get_source_id(self, source):
+        if source is None:
+            return NO_SOURCE
+        try:
+            return self.sources[source]
+        except KeyError:
+            source_id = len(self.sources)
+            self.sources[source] = source_id
+            self.new_sources.append(source)
+            return source_id
+
+    def add_field(self, field):
+        """Buffer an indexed field, a list of (word, word_position) pairs,
+        returning its (start, length) record.
+        """
+        if field is None:
+            return self.token_count, NO_FIELD
+        start = self.token_count
+        get_term_id = self.get_term_id
+        for word, word_pos in field:
+            self.terms.append(get_term_id(word))
+            self.positions.append(word_pos)
+        self.token_count += len(field)
+        return start, len(field)
+
+    def add_doc(self, source, title, meta_info, text):
+        record = [self.get_source_id(source)]
+        for field in (title, meta_info, text):
+            record.extend(self.add_field(field))
+        self.docs.append(record)
+        self.doc_count += 1
+
+    def flush(self):
+        """Append everything buffered so far onto the index files.
+        """
+        def append_lines(file_name, lines):
+            if lines:
+                with open(os.path.join(self.index_dir, file_name),
+                        'ab') as file:
+                    for line in lines:
+                        file.write('%s\n' % _encode(line))
+
+        def append_array(file_name, values, dtype):
+            with open(os.path.join(self.index_dir, file_name), 'ab') as file:
+                numpy.array(values, dtype).tofile(file)
+
+        append_lines(VOCABULARY_FILE, self.new_words)
+        append_lines(SOURCE_FILE, self.new_sources)
+        append_array(TERM_FILE, self.terms, TERM_TYPE)
+        append_array(POSITION_FILE, self.positions, POSITION_TYPE)
+        append_array(DOC_FILE, self.docs, DOC_TYPE)
+        self.clear_buffers()
+
+def truncate_index(index_dir, lengths):
+    """Roll an index back to the file lengths returned by
+    IndexWriter.get_lengths, dropping anything appended since.
+    """
+    for file_name in (VOCABULARY_FILE, SOURCE_FILE):
+        path = os.path.join(index_dir, file_name)
+        lines = _read_lines(path)
+        if len(lines) > lengths[file_name]:
+            write_atomically(path, lambda file: file.writelines(['%s\n'
+                % _encode(line) for line in lines[:lengths[file_name]]]))
+
+    for file_name, dtype in ((TERM_FILE, TERM_TYPE),
+            (POSITION_FILE, POSITION_TYPE), (DOC_FILE, DOC_TYPE)):
+        path = os.path.join(index_dir, file_name)
+        size = lengths[file_name] * numpy.dtype(dtype).itemsize
+        if os.path.isfile(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as file:
+                file.truncate(size)
+
+def write_postings(index_dir):
+    """Write the postings and term counts of an index in one sort of its
+    term ids.
+    """
+    reader = IndexReader(index_dir)
+    try:
+        term_counts = numpy.bincount(reader.terms,
+                minlength=len(reader.vocabulary)).astype(TERM_COUNT_TYPE)
+        ## a stable sort keeps the occurrences of a term in offset order
+        postings = numpy.argsort(reader.terms,
+                kind='mergesort').astype(POSTING_TYPE)
+    finally:
+        reader.close()
+    for file_name, values in ((POSTING_FILE, postings),
+            (TERM_COUNT_FILE, term_counts)):
+        write_atomically(os.path.join(index_dir, file_name), values.tofile)
+
+def update_postings(index_dir):
+    """Write the postings of an index unless they are up to date with it.
+    The index is only ever appended to, so postings covering as many
+    words as the index are current.
+    """
+    reader = IndexReader(index_dir)
+    try:
+        current = reader.has_postings()
+    finally:
+        reader.close()
+    if not current:
+        write_postings(index_dir)
+
+def get_version(index_dir, name):
+    """Return a digest of the index @name with up to date postings, which
+    changes whenever documents are added to the index.  Besides the name
+    and the lengths of the index files, it covers the words of the
+    vocabulary, the sources and the term counts, so neither the indexes
+    of two corpora nor an index rebuilt from another corpus share a
+    version.
+    """
+    digest = hashlib.sha1()
+    digest.update('%s\n' % _encode(name))
+    for file_name in (VOCABULARY_FILE, SOURCE_FILE, TERM_FILE, POSITION_FILE,
+            DOC_FILE):
+        path = os.path.join(index_dir, file_name)
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        digest.update('%s %d\n' % (file_name, size))
+    ## the lengths above tell where each file ends
+    for file_name in (VOCABULARY_FILE, SOURCE_FILE, TERM_COUNT_FILE):
+        path = os.path.join(index_dir, file_name)
+        if os.path.isfile(path):
+            update_digest(digest, path)
+    return digest.hexdigest()
+
+class IndexReader:
+    """Read-only access to a columnar index through memory-mapped,
+    zero-copy numpy views.
+    """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.vocabulary = _read_lines(os.path.join(index_dir, VOCABULARY_FILE))
+        self.sources = _read_lines(os.path.join(index_dir, SOURCE_FILE))
+
+        self.terms, self.term_map = _map_array(
+                os.path.join(index_dir, TERM_FILE), TERM_TYPE)
+        self.positions, self.position_map = _map_array(
+                os.path.join(index_dir, POSITION_FILE), POSITION_TYPE)
+        docs, self.doc_map = _map_array(
+                os.path.join(index_dir, DOC_FILE), DOC_TYPE)
+        self.docs = docs.reshape((-1, DOC_RECORD_LENGTH))
+        self.postings, self.posting_map = _map_array(
+                os.path.join(index_dir, POSTING_FILE), POSTING_TYPE)
+        self.term_counts, self.term_count_map = _map_array(
+                os.path.join(index_dir, TERM_COUNT_FILE), TERM_COUNT_TYPE)
+        ## where the postings of each term id start, and the last one ends
+        self.posting_starts = numpy.concatenate(([0],
+            numpy.cumsum(self.term_counts)))
+
+    def __len__(self):
+        return len(self.docs)
+
+    def get_field(self, doc_id, field):
+        """Return (term ids, positions) views of a field of a document,
+        or None if the document was added without that field.
+        """
+        start, length = self.docs[doc_id, 1 + 2 * field: 3 + 2 * field]
+        if length == NO_FIELD:
+            return None
+        return (self.terms[start: start + length],
+                self.positions[start: start + length])
+
+    def has_postings(self):
+        """Return whether the postings and term counts cover the index.
+        """
+        return len(self.postings) == len(self.terms) and \
+                len(self.term_counts) == len(self.vocabulary)
+
+    def get_postings(self, term_id):
+        """Return a view of the offsets into the term ids of every
+        occurrence of a term.
+        """
+        return self.postings[
+                self.posting_starts[term_id]: self.posting_starts[term_id + 1]]
+
+    def get_field_bounds(self):
+        """Return arrays of the start and stop offsets into the term ids
+        of every field holding words, in index order.
+        """
+        starts = self.docs[:, 1::2].ravel()
+        lengths = self.docs[:, 2::2].ravel()
+        has_words = lengths > 0
+        return starts[has_words], starts[has_words] + lengths[has_words]
+
+    def get_source(self, doc_id):
+        source_id = self.docs[doc_id, 0]
+        if source_id == NO_SOURCE:
+            return None
+        return self.sources[source_id]
+
+    def get_words(self, doc_id, field):
+        """Return a field of a document as a list of (word, word_position)
+        pairs, the format the index was built from.
+        """
+        field = self.get_field(doc_id, field)
+        if field is None:
+            return None
+        terms, positions = field
+        vocabulary = self.vocabulary
+        return [(vocabulary[term_id], word_pos) for term_id, word_pos
+                in zip(terms.tolist(), positions.tolist())]
+
+    def iter_docs(self, start=0, stop=None):
+        """Yield (source, title, meta_info, text) tuples for the documents
+        numbered start through stop.
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+        for doc_id in xrange(start, stop):
+            yield (self.get_source(doc_id), self.get_words(doc_id, 0),
+                   self.get_words(doc_id, 1), self.get_words(doc_id, 2))
+
+    def close(self):
+        ## drop the views before their maps can be closed
+        self.terms = self.positions = self.docs = None
+        self.postings = self.term_counts = None
+        for mapped in (self.term_map, self.position_map, self.doc_map,
+                self.posting_map, self.term_count_map):
+            if mapped is not None:
+                mapped.close()
+
+def iter_pickled_docs(pickle_file):
+    """Reads through documents from an old style index, a stream of
+    pickled (source, title, meta_info, text) tuples.
+    """
+    with open(pickle_file, 'rb') as pickle_file:
+        while True:
+            try:
+                yield cPickle.load(pickle_file)
+            except EOFError:
+                return
+
+def convert_pickle_index(pickle_file, index_dir, synch_freq=10000):
+    """One-shot conversion of an old style pickled index into a
+    columnar index.
+    """
+    writer = IndexWriter(index_dir)
+    for doc_num, doc in enumerate(iter_pickled_docs(pickle_file)):
+        writer.add_doc(*doc)
+        if (doc_num + 1) % synch_freq == 0:
+            writer.flush()
+    writer.flush()
+
+def main():
+    convert_pickle_index(sys.argv[1], sys.argv[2])
+
+if __name__ == '__main__':
+    main()
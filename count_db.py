@@ -0,0 +1,113 @@
+"""Berkeley DB B-trees holding counts as fixed-width binary integers.
+"""
+
+from bsddb import db
+import numpy
+
+from sorted_runs import COUNT
+import stage_stats
+
+## records a SortedLookup steps over to reach a key before it searches
+## for the key from the root instead
+MAX_STEPS = 16
+
+def pack_count(count):
+    return COUNT.pack(count)
+
+def unpack_count(value):
+    return COUNT.unpack(value)[0]
+
+def write_sorted(db_file, records):
+    """Bulk load (key, value) records, which must be sorted by key, into
+    a new B-tree.  Sorted keys make every insert an append onto the last
+    leaf page.
+    """
+    sorted_db = db.DB()
+    sorted_db.open(db_file, None, db.DB_BTREE, db.DB_CREATE | db.DB_TRUNCATE)
+    writes = 0
+    for key, value in records:
+        sorted_db.put(key, value)
+        writes += 1
+    sorted_db.close()
+    stage_stats.count('db_writes', writes)
+
+def write_counts(db_file, records):
+    """Bulk load (key, (count,)) records, which must be sorted by key,
+    into a new B-tree.
+    """
+    write_sorted(db_file, ((key, pack_count(count))
+            for key, (count,) in records))
+
+def read_counts(db_file):
+    """Read a B-tree of counts with 64-bit integer keys in one sequential
+    sweep, returning aligned numpy arrays of the keys and the counts.
+    """
+    count_db = db.DB()
+    count_db.open(db_file, None, db.DB_BTREE, db.DB_RDONLY)
+    keys = []
+    counts = []
+    cursor = count_db.cursor()
+    record = cursor.first()
+    while record:
+        key, count = record
+        keys.append(key)
+        counts.append(count)
+        record = cursor.next()
+    count_db.close()
+    keys = ''.join(keys)
+    counts = ''.join(counts)
+    stage_stats.count('db_reads', len(keys) // 8)
+    stage_stats.count('bytes_read', len(keys) + len(counts))
+    ## the keys and counts are both fixed-width big-endian integers, so
+    ## the records can be read as arrays in one go
+    return (numpy.frombuffer(keys, '>u8').astype(numpy.uint64),
+            numpy.frombuffer(counts, '>i8').astype(numpy.int64))
+
+class SortedLookup:
+    """Looks up keys, which must be asked for in ascending order, in a
+    B-tree by moving one cursor forward through it.  A key within
+    MAX_STEPS records of the last one is reached by stepping the cursor
+    along the leaf pages, and only a key further on takes a search from
+    the root, so dense lookups are a single sorted sweep of the tree
+    and sparse ones cost no more than a search each.
+    """
+    def __init__(self, db_file):
+        self.db = db.DB()
+        self.db.open(db_file, None, db.DB_BTREE, db.DB_RDONLY)
+        self.cursor = self.db.cursor()
+        self.record = self.cursor.first()
+        self.reads = 0
+
+    def get(self, key, default=None):
+        """Return the value stored under @key, or @default if there is
+        none.
+        """
+        self.reads += 1
+        steps = 0
+        while self.record is not None and self.record[0] < key:
+            if steps == MAX_STEPS:
+                ## skip straight to the first record at or past the key
+                try:
+                    self.record = self.cursor.set_range(key)
+                except db.DBNotFoundError:
+                    self.record = None
+                break
+            self.record = self.cursor.next()
+            steps += 1
+        if self.record is not None and self.record[0] == key:
+            return self.record[1]
+        return default
+
+    def get_count(self, key, default=None):
+        """Return the count stored under @key, or @default if there is
+        none.
+        """
+        value = self.get(key)
+        if value is None:
+            return default
+        return unpack_count(value)
+
+    def close(self):
+        self.cursor.close()
+        self.db.close()
+        stage_stats.count('db_reads', self.reads)
@@ -11,9 +11,5 @@ e.add_to_index(corpus_dir, 'phpBB',
 
 e.perform_experiment(targets, synonym_file=None, 
                        window=50, pmi_threshold=0, 
-                       relation_threshold=0, truth_DB=truth, 
-                       truth_function='2_way_mild')
-e.perform_experiment(targets, synonym_file=None, 
-                       window=50, pmi_threshold=0, 
-                       relation_threshold=0, truth_DB=truth, 
-                       truth_function='2_way_strong')
+                       relation_threshold=0, truth_db=truth, 
+                       truth_function=['2_way_mild', '2_way_strong'])
@@ -2,24 +2,55 @@
 number of parameters. The Experimenter class maintains consistency between uses,
 and uses results from previous experiments when possible to avoid
 redundant calculation.
+
+The results of every task are kept in a cache under a digest of
+everything they were computed from: the contents of the input files, the
+version of the index and the parameters of the task, along with the
+digest of the results the task read.  Editing a target list or adding
+to the index therefore never reuses a stale result.
 """
 
 import os
 import cPickle
+import hashlib
+import itertools
+import multiprocessing
+import Queue
+import shutil
+import time
+import traceback
+from collections import deque, OrderedDict
 
+import column_index
 import index
 import get_cooccurrences
 import get_PMIs
 import get_relations
 import get_features
+import stage_stats
+from column_index import write_atomically
 
 INSTANCE_FILE = 'saved_experimenter_instance'
+INDEX_DIR = 'index'
+LEGACY_INDEX_FILE = 'index.txt'
+TOTAL_WORDS_FILE = 'total_word_count.txt'
+SEGMENT_DIR = 'segments'
+CACHE_DIR = 'cache'
+STAGE_LOG_FILE = 'stage_log.json'
+PROFILE_DIR = 'profiles'
+## seconds a sweep waits for a task to finish before checking that its
+## worker processes are still alive
+SWEEP_POLL_SECONDS = 1
+## the segment of the corpora indexed into the single shared index used
+## before every corpus got its own segment
+LEGACY_SEGMENT = 'index'
 
 INDEX_TASK = 1
 COOCCURRENCE_TASK = 2
 PMI_TASK = 3
 RELATION_TASK = 4
 FEATURE_TASK = 5
+MERGE_TASK = 6
 
 INDEX_FILE_PATH = 1
 TOTAL_WORDS_PATH = 2
@@ -30,40 +61,181 @@ COOCCURRENCE_FILE_PATH = 6
 PMI_FILE_PATH = 7
 RELATION_FILE_PATH = 8
 FEATURE_FILE_PATH = 9
+TARGET_IDS_FILE_PATH = 10
+
+TASK_NAMES = {
+        INDEX_TASK: 'index',
+        COOCCURRENCE_TASK: 'segment cooccurrences',
+        MERGE_TASK: 'cooccurrences',
+        PMI_TASK: 'PMIs',
+        RELATION_TASK: 'relations',
+        FEATURE_TASK: 'features',
+        }
+## the results each task reads, which must be in the cache before it
+## can be performed
+TASK_INPUTS = {
+        FEATURE_TASK: (RELATION_TASK, PMI_TASK, MERGE_TASK),
+        RELATION_TASK: (PMI_TASK, MERGE_TASK),
+        PMI_TASK: (MERGE_TASK,),
+        MERGE_TASK: (),
+        }
+
+## the parameters of perform_experiment which a sweep can vary, and the
+## values they take when a sweep leaves them out
+SWEEP_DEFAULTS = {
+        'synonym_file': None,
+        'window': float('inf'),
+        'pmi_threshold': 0,
+        'relation_threshold': 0,
+        'truth_db': None,
+        'truth_function': None,
+        'corpora': None,
+        'feature_format': 'arff',
+        }
+
+## the formats feature files can be written in: arff text, or the arrays
+## of get_features.FeatureArrayWriter
+FEATURE_FORMATS = ('arff', 'npz')
+## hex digits of the digest of its input files in a feature file's path
+FEATURE_DIGEST_LENGTH = 12
+
+def _count_window_cooccurrences(window_files, target_file, synonym_file,
+        windows, workers):
+    """Function used to count cooccurrences for several windows in a
+    single pass over the index.
+    """
+    get_cooccurrences.get_window_cooccurrences(
+            window_files[0][INDEX_FILE_PATH], target_file, synonym_file,
+            windows, [files[WORD_COUNT_FILE_PATH] for files in window_files],
+            [files[COOCCURRENCE_FILE_PATH] for files in window_files],
+            [files[TARGET_IDS_FILE_PATH] for files in window_files],
+            workers)
 
-def _count_cooccurrences(files, target_file, synonym_file, window):
-    """Function used for the cooccurrence counting task.
+def _merge_segment_counts(files, segment_files):
+    """Function used to sum the counts of several index segments into
+    the counts of the segments together.
     """
-    get_cooccurrences.get_cooccurrences(files[INDEX_FILE_PATH], target_file,
-            synonym_file, window, files[WORD_COUNT_FILE_PATH],
-            files[COOCCURRENCE_FILE_PATH])
-    
-def _calculate_PMIs(files, pmi_threshold):
-    """Function used for the PMI calculation task.
+    get_cooccurrences.merge_segment_counts(
+            [segment[INDEX_FILE_PATH] for segment in segment_files],
+            files[TARGET_FILE_PATH], files[SYNONYM_FILE_PATH],
+            [segment[WORD_COUNT_FILE_PATH] for segment in segment_files],
+            [segment[COOCCURRENCE_FILE_PATH] for segment in segment_files],
+            files[WORD_COUNT_FILE_PATH], files[COOCCURRENCE_FILE_PATH],
+            files[TARGET_IDS_FILE_PATH])
+    total_word_count = 0
+    for segment in segment_files:
+        with open(segment[TOTAL_WORDS_PATH], 'r') as total_words_file:
+            total_word_count += int(total_words_file.readline()[:-1])
+    write_atomically(files[TOTAL_WORDS_PATH], lambda total_words_file:
+            total_words_file.write('%s\n' % total_word_count))
+
+def _calculate_threshold_PMIs(threshold_files, pmi_thresholds):
+    """Function used to calculate the PMIs for several thresholds from
+    a single load of the counts.
     """
-    get_PMIs.get_PMIs(files[WORD_COUNT_FILE_PATH], 
-            files[COOCCURRENCE_FILE_PATH], pmi_threshold, 
-            files[TOTAL_WORDS_PATH], files[PMI_FILE_PATH])
+    get_PMIs.get_threshold_PMIs(threshold_files[0][WORD_COUNT_FILE_PATH],
+            threshold_files[0][COOCCURRENCE_FILE_PATH], pmi_thresholds,
+            threshold_files[0][TOTAL_WORDS_PATH],
+            [files[PMI_FILE_PATH] for files in threshold_files])
 
-def _calculate_relations(files, relation_threshold):
+def _calculate_relations(files, relation_threshold, memory_budget=None):
     """Function used for the relation calculation task.
     """
-    get_relations.get_relations(files[PMI_FILE_PATH], relation_threshold, 
-        files[RELATION_FILE_PATH])
+    get_relations.get_relations(files[PMI_FILE_PATH], relation_threshold,
+        files[RELATION_FILE_PATH], files[TARGET_IDS_FILE_PATH],
+        memory_budget=memory_budget)
 
-def _write_feature_files(files, truth_db, truth_function):
-    """Function used to output a feature file for use in WEKA.
+def _write_feature_files(function_files, truth_db, truth_functions):
+    """Function used to output feature files for use in WEKA, where
+    function_files[i] are the files of the feature file of
+    truth_functions[i].  The feature files share their relations, so
+    they are all written from a single pass over them.
     """
+    files = function_files[0]
     get_features.get_features(files[RELATION_FILE_PATH], 
         files[PMI_FILE_PATH], files[COOCCURRENCE_FILE_PATH],
-        files[FEATURE_FILE_PATH], truth_db, truth_function)
+        [feature_files[FEATURE_FILE_PATH] for feature_files
+            in function_files],
+        files[TARGET_IDS_FILE_PATH], truth_db, truth_functions)
 
-TASK_FUNCTIONS = {
-        COOCCURRENCE_TASK: _count_cooccurrences,
-        PMI_TASK: _calculate_PMIs,
-        RELATION_TASK: _calculate_relations,
-        FEATURE_TASK: _write_feature_files,
-        }
+def _make_dirs(files):
+    """Create the directories of the files we want to create.
+    """
+    for _, file_name in files.iteritems():
+        if file_name:
+            directory = os.path.dirname(file_name)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+
+def _as_list(value):
+    """Allow an experiment parameter to be given as either a single value
+    or a list of values.
+    """
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def _expand_grid(grid):
+    """Return a dictionary of perform_experiment arguments for every
+    combination of the values in a sweep grid.  Each selection of
+    corpora is given as a list, whether it was a single corpus or not.
+    """
+    if 'target_file' not in grid:
+        raise ValueError ("a sweep needs a target_file")
+    names = sorted(grid)
+    for name in names:
+        if name != 'target_file' and name not in SWEEP_DEFAULTS:
+            raise ValueError ("%s is not a parameter of an experiment" % name)
+    experiments = []
+    for values in itertools.product(*[_as_list(grid[name])
+            for name in names]):
+        experiment = dict(SWEEP_DEFAULTS)
+        experiment.update(zip(names, values))
+        if isinstance(experiment['corpora'], basestring):
+            experiment['corpora'] = [experiment['corpora']]
+        experiments.append(experiment)
+    return experiments
+
+def _run_sweep_task(task_num, stage, function, args, profile_file):
+    """Run a task of a sweep in a worker process as @stage, handing back
+    its number along with the traceback of the error it raised, if any,
+    and otherwise the record of the stage.
+    """
+    try:
+        record = stage_stats.run_stage(stage, function, args, profile_file)
+    except Exception:
+        return task_num, traceback.format_exc(), None
+    return task_num, None, record
+
+def _get_finished_task(finished, pool_workers, running):
+    """Wait for what _run_sweep_task hands back through the queue
+    @finished once a task finishes, checking every SWEEP_POLL_SECONDS
+    that the worker processes with the pids @pool_workers are alive.
+    @running holds the tasks being run, by number.
+    """
+    while True:
+        try:
+            return finished.get(True, SWEEP_POLL_SECONDS)
+        except Queue.Empty:
+            alive = set([process.pid
+                for process in multiprocessing.active_children()])
+            if not pool_workers <= alive:
+                raise ValueError ("a sweep worker process died while "
+                        "running %s" % ', '.join(sorted(
+                            [TASK_NAMES[task.experiments[0].task]
+                                for task in running.itervalues()])))
+
+def _get_size(path):
+    """Return the number of bytes in a file, or in the files under a
+    directory.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dir_name, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(dir_name, file_name))
+    return size
 
 class Experimenter(object):
     """Class which saves results of experiments and determines how
@@ -96,110 +268,785 @@ class Experimenter(object):
         obj.instance_file = os.path.join(directory, INSTANCE_FILE)
         obj.completed_tasks = {}
         obj.index_contents = {}
+        obj.segments = []
+        obj.forget_digests()
+        obj.cache_size = None
+        obj.cache_report = OrderedDict()
+        obj.profiled_stages = set()
         obj.save_instance()
         return obj
 
+    def __setstate__(self, state):
+        ## instances pickled by older versions lack the cache and stage
+        ## attributes, and the digests they remembered may be stale
+        self.cache_size = None
+        self.cache_report = OrderedDict()
+        self.profiled_stages = set()
+        self.__dict__.update(state)
+        self.forget_digests()
+
     def save_instance(self):
-        """Pickles the instance for concurrency between experiments
+        """Pickles the instance for concurrency between experiments.  The
+        pickle is replaced atomically, so an interruption never leaves a
+        half written instance behind.
+        """
+        write_atomically(self.instance_file, lambda instance_file:
+                cPickle.dump(self, instance_file))
+
+    def get_index(self):
+        """Return the path of the columnar index, converting a pickled
+        index written by an older version of the Experimenter if needed.
+        """
+        index_dir = os.path.join(self.directory, INDEX_DIR)
+        legacy_index = os.path.join(self.directory, LEGACY_INDEX_FILE)
+        if os.path.isfile(legacy_index) and not os.path.exists(index_dir):
+            ## convert next to the real location so an interrupted
+            ## conversion never looks like a finished index
+            column_index.replace_atomically(index_dir, lambda temp_dir:
+                    column_index.convert_pickle_index(legacy_index, temp_dir))
+        return index_dir
+
+    def get_segment_names(self):
+        """Return the corpora indexed into segments of their own, in the
+        order they were indexed.
+        """
+        ## instances pickled before segments existed have no list of them
+        return getattr(self, 'segments', [])
+
+    def get_segments(self, corpora=None):
+        """Return the (name, index path, total word count path) of the
+        index segments holding @corpora, in the order they were indexed,
+        or of every segment if no corpora are given.  @corpora may also
+        be a single corpus.  Corpora indexed into the shared index of
+        older versions of the Experimenter form a single segment, and can
+        only be selected together.
+        """
+        segment_names = self.get_segment_names()
+        if corpora is None:
+            corpora = self.index_contents.keys()
+        elif isinstance(corpora, basestring):
+            corpora = [corpora]
+        corpora = [os.path.basename(os.path.normpath(corpus))
+                for corpus in corpora]
+        for corpus in corpora:
+            if corpus not in self.index_contents:
+                raise ValueError ("%s has not been indexed" % corpus)
+
+        segments = []
+        legacy_corpora = [corpus for corpus in self.index_contents
+                if corpus not in segment_names]
+        selected_legacy_corpora = [corpus for corpus in legacy_corpora
+                if corpus in corpora]
+        if selected_legacy_corpora:
+            if len(selected_legacy_corpora) < len(legacy_corpora):
+                raise ValueError ("%s share an index and must be selected "
+                        "together" % ', '.join(sorted(legacy_corpora)))
+            segments.append((LEGACY_SEGMENT, self.get_index(),
+                os.path.join(self.directory, TOTAL_WORDS_FILE)))
+        for segment_name in segment_names:
+            if segment_name in corpora:
+                segment_dir = os.path.join(self.directory, SEGMENT_DIR,
+                        segment_name)
+                segments.append((segment_name,
+                    os.path.join(segment_dir, INDEX_DIR),
+                    os.path.join(segment_dir, TOTAL_WORDS_FILE)))
+        if not segments:
+            raise ValueError ("no corpora have been indexed")
+        return segments
+
+    def get_selection(self, corpora=None):
+        """Return the names of the segments holding @corpora, which set
+        the experiments on those corpora apart from experiments on others.
         """
-        with open(self.instance_file, 'w') as instance_file:
-            cPickle.dump(self, instance_file)
+        return tuple([segment[0] for segment in self.get_segments(corpora)])
 
     def add_to_index(self, corpus_dir, corpus_type,
-                     stop_file=None, tag_file=None, synch_freq=10000):
-        """Appends entries from @corpus_dir into the index
+                     stop_file=None, tag_file=None, synch_freq=10000,
+                     workers=1):
+        """Indexes the entries of @corpus_dir into an index segment of
+        its own, with the corpus files parsed by @workers processes.
+        Calling it again after an interrupted run resumes from the run's
+        last checkpoint.
         """
         corpus_name = os.path.basename(os.path.normpath(corpus_dir))
         if corpus_name not in self.index_contents:
-            index_file = os.path.join(self.directory, 'index.txt')
-            word_count_file = os.path.join(
-                self.directory, 'total_word_count.txt')
-            index.build_index(corpus_dir, corpus_type, stop_file,
-                    index_file, tag_file, word_count_file, synch_freq)
+            segment_dir = os.path.join(self.directory, SEGMENT_DIR,
+                    corpus_name)
+            index_file = os.path.join(segment_dir, INDEX_DIR)
+            word_count_file = os.path.join(segment_dir, TOTAL_WORDS_FILE)
+            if not os.path.exists(segment_dir):
+                os.makedirs(segment_dir)
+            self.run_stage(INDEX_TASK, index.build_index, (corpus_dir,
+                corpus_type, stop_file, index_file, tag_file,
+                word_count_file, synch_freq, workers), corpus=corpus_name)
             value = (corpus_type, stop_file, tag_file)
             self.index_contents[corpus_name] = value
+            self.segments = self.get_segment_names() + [corpus_name]
         self.save_instance()
 
-    def get_files(self, target_file, synonym_file, window, pmi_threshold,
-            relation_threshold, truth_db, truth_function):
-        """Calculate the name of various intermediate files based on the
-        arguments passed to perform_experiment.
+    def forget_digests(self):
+        """Forget the digests of files and the versions of indexes, which
+        are only remembered for the length of an experiment or sweep.  A
+        file can change without its size or modification time changing,
+        so they are worked out again for every experiment.
         """
-        files = {}
-        experiment_dir = os.path.join(self.directory, 'experiment_results')
-        feature_dir = os.path.join(self.directory, 'features')
+        self.file_hashes = {}
+        self.index_versions = {}
 
-        index_file = os.path.join(self.directory, 'index.txt')
-        files[INDEX_FILE_PATH] = index_file
-        total_words_file = os.path.join(self.directory, 'total_word_count.txt')
+    def hash_file(self, file_name):
+        """Return a digest of the contents of a file, or None if no file
+        is given.  Digests are remembered until forget_digests is called.
+        """
+        if file_name is None:
+            return None
+        if file_name not in self.file_hashes:
+            digest = hashlib.sha1()
+            column_index.update_digest(digest, file_name)
+            self.file_hashes[file_name] = digest.hexdigest()
+        return self.file_hashes[file_name]
+
+    def get_index_version(self, segment):
+        """Return the version of a segment, as returned by get_segments,
+        writing the postings of its index first if they are out of date.
+        Versions are remembered until forget_digests is called.
+        """
+        segment_name, index_file, _ = segment
+        if index_file not in self.index_versions:
+            column_index.update_postings(index_file)
+            self.index_versions[index_file] = column_index.get_version(
+                    index_file, segment_name)
+        return self.index_versions[index_file]
+
+    def get_experiments(self, target_file, synonym_file, window,
+            pmi_threshold, relation_threshold, truth_db, truth_function,
+            corpora=None, feature_format='arff'):
+        """Return the experiments behind the arguments passed to
+        perform_experiment, by task.  Each experiment is identified by
+        the digests of its input files, the version of the index and its
+        parameters, and the experiments after cooccurrence counting by
+        the digest of the experiment they read as well.  The counting of
+        each segment is a list of experiments, one per segment.  With a
+        single segment there is nothing to merge, so the counting of the
+        segment stands in for the merged counting.
+        """
+        inputs = (self.hash_file(target_file), self.hash_file(synonym_file))
+        versions = tuple([self.get_index_version(segment)
+            for segment in self.get_segments(corpora)])
 
+        experiments = {}
+        experiments[COOCCURRENCE_TASK] = [Experiment(COOCCURRENCE_TASK,
+            (window,), (version,) + inputs) for version in versions]
+        if len(versions) == 1:
+            experiments[MERGE_TASK] = experiments[COOCCURRENCE_TASK][0]
+        else:
+            experiments[MERGE_TASK] = Experiment(MERGE_TASK, (window,),
+                    (versions,) + inputs)
+        experiments[PMI_TASK] = Experiment(PMI_TASK, (pmi_threshold,),
+                (experiments[MERGE_TASK].get_key(),))
+        experiments[RELATION_TASK] = Experiment(RELATION_TASK,
+                (relation_threshold,), (experiments[PMI_TASK].get_key(),))
+        ## the feature file is kept where the user can find it, and every
+        ## place it is asked for is an experiment of its own
+        feature_file = self.get_feature_file(target_file, synonym_file,
+                window, pmi_threshold, relation_threshold, truth_db,
+                truth_function, corpora, feature_format)
+        experiments[FEATURE_TASK] = Experiment(FEATURE_TASK,
+                (self.hash_file(truth_db), truth_function, feature_file),
+                (experiments[RELATION_TASK].get_key(),))
+        return experiments
+
+    def get_result_path(self, experiment):
+        """Return where the results of an experiment are kept: the feature
+        file for feature files, or else its directory in the cache.
+        """
+        if experiment.task == FEATURE_TASK:
+            return experiment.args[2]
+        return os.path.join(self.directory, CACHE_DIR, experiment.get_key())
+
+    def get_segment_files(self, segment, experiment):
+        """Calculate the name of the counts of a single index segment, as
+        returned by get_segments, for its counting @experiment.
+        """
+        segment_name, index_file, total_words_file = segment
+        files = {}
+        files[INDEX_FILE_PATH] = index_file
         files[TOTAL_WORDS_PATH] = total_words_file
-        files[TARGET_FILE_PATH] = target_file
-        files[SYNONYM_FILE_PATH] = synonym_file
 
+        cooccurrence_dir = self.get_result_path(experiment)
+        files[WORD_COUNT_FILE_PATH] = os.path.join(cooccurrence_dir,
+                "word_count.db")
+        files[COOCCURRENCE_FILE_PATH] = os.path.join(cooccurrence_dir,
+                "cooccurrences.db")
+        files[TARGET_IDS_FILE_PATH] = os.path.join(cooccurrence_dir,
+                "target_ids.txt")
+
+        _make_dirs(files)
+        return files
+
+    def get_feature_file(self, target_file, synonym_file, window,
+            pmi_threshold, relation_threshold, truth_db, truth_function,
+            corpora=None, feature_format='arff'):
+        """Calculate the name of the feature file of an experiment.  Its
+        directory is named after the target and synonym files along with
+        a digest of their contents and of @truth_db, so experiments on
+        files with the same names in different directories, or with
+        different truth_dbs, don't write to the same feature file.
+        """
+        if feature_format not in FEATURE_FORMATS:
+            raise ValueError ("invalid feature format %s" % feature_format)
+        inputs = hashlib.sha1('\n'.join([str(self.hash_file(file_name))
+            for file_name in (target_file, synonym_file, truth_db)]))
         target_file = os.path.basename(os.path.normpath(str(target_file)))
         synonym_file = os.path.basename(os.path.normpath(str(synonym_file)))
+        feature_file_dir = os.path.join(self.directory, 'features',
+                '+'.join(self.get_selection(corpora)),
+                "%s_%s_%s" % (target_file, synonym_file,
+                    inputs.hexdigest()[:FEATURE_DIGEST_LENGTH]),
+                str(truth_function))
+        return os.path.join(feature_file_dir, "%s_%s_%s_features.%s" %
+                (window, pmi_threshold, relation_threshold, feature_format))
 
-        cooccurrence_dir = os.path.join(experiment_dir, 
-                "%s_%s" % (target_file, synonym_file),
-                "%s_cooccurrence_window" % window)
+    def get_files(self, target_file, synonym_file, experiments,
+            corpora=None):
+        """Calculate the name of various intermediate files of the
+        @experiments on @corpora returned by get_experiments.
+        """
+        files = {}
+        files[INDEX_FILE_PATH] = None
+        files[TARGET_FILE_PATH] = target_file
+        files[SYNONYM_FILE_PATH] = synonym_file
+
+        cooccurrence_dir = self.get_result_path(experiments[MERGE_TASK])
+        ## counting is done segment by segment, see get_segment_files,
+        ## and the counts of a single segment are read where they are
+        segments = self.get_segments(corpora)
+        if len(segments) == 1:
+            files[TOTAL_WORDS_PATH] = segments[0][2]
+        else:
+            files[TOTAL_WORDS_PATH] = os.path.join(cooccurrence_dir,
+                    TOTAL_WORDS_FILE)
         files[WORD_COUNT_FILE_PATH] = os.path.join(cooccurrence_dir,
                 "word_count.db")
         files[COOCCURRENCE_FILE_PATH] = os.path.join(cooccurrence_dir,
                 "cooccurrences.db")
+        files[TARGET_IDS_FILE_PATH] = os.path.join(cooccurrence_dir,
+                "target_ids.txt")
 
-        pmi_dir = os.path.join(cooccurrence_dir, 
-                "%s_pmi_threshold" % pmi_threshold)
-        files[PMI_FILE_PATH] = os.path.join(pmi_dir, "pmis.db")
+        files[PMI_FILE_PATH] = os.path.join(
+                self.get_result_path(experiments[PMI_TASK]), "pmis.db")
+        files[RELATION_FILE_PATH] = os.path.join(
+                self.get_result_path(experiments[RELATION_TASK]),
+                "relations.db")
+        files[FEATURE_FILE_PATH] = self.get_result_path(
+                experiments[FEATURE_TASK])
 
-        relation_dir = os.path.join(pmi_dir, "%s_relation_threshold")
-        files[RELATION_FILE_PATH] = os.path.join(relation_dir, "relations.db")
+        _make_dirs(files)
+        return files
+
+    def is_cached(self, experiment, report=None):
+        """Return whether the results of an experiment are in the cache,
+        marking them as just used.  The outcome is added to @report, a
+        dictionary from experiments to whether they were found, unless
+        the experiment is already in it.
+        """
+        entry = self.completed_tasks.get(experiment)
+        found = isinstance(entry, CacheEntry) and os.path.exists(entry.path)
+        if found:
+            entry.last_used = time.time()
+        if report is not None:
+            report.setdefault(experiment, found)
+        return found
 
-        feature_file_dir = os.path.join(feature_dir, 
-                                        "%s_%s" % (target_file, synonym_file),
-                                        str(truth_function))
-        files[FEATURE_FILE_PATH] = os.path.join(feature_file_dir,
-                "%s_%s_%s_features.arff" %
-                (window, pmi_threshold, relation_threshold))
+    def record(self, experiment):
+        """Record the results of an experiment which was just performed.
+        """
+        path = self.get_result_path(experiment)
+        if experiment.task == FEATURE_TASK:
+            ## the feature file no longer holds what it held for any
+            ## other experiment writing to it
+            for other in self.completed_tasks.keys():
+                if other.task == FEATURE_TASK and other.args[2:] == (path,):
+                    del self.completed_tasks[other]
+        self.completed_tasks[experiment] = CacheEntry(path, _get_size(path),
+                time.time())
+        self.save_instance()
 
-        # create directories for the files we want to create
-        for _, file_name in files.iteritems():
-            if file_name:
-                directory = os.path.dirname(file_name)
-                if directory and not os.path.exists(directory):
-                    os.makedirs(directory)
+    def set_cache_size(self, cache_size):
+        """Limit the results kept in the cache to roughly @cache_size
+        bytes, or lift the limit if it is None.  Feature files are kept
+        outside of the cache and never removed.
+        """
+        self.cache_size = cache_size
+        self.evict()
+        self.save_instance()
 
-        return files
+    def evict(self):
+        """Remove the least recently used results from the cache until it
+        fits in the cache size.
+        """
+        if self.cache_size is None:
+            return
+        entries = [(entry.last_used, experiment) for experiment, entry
+                in self.completed_tasks.iteritems()
+                if isinstance(entry, CacheEntry) and
+                experiment.task != FEATURE_TASK]
+        cached = sum([self.completed_tasks[experiment].size
+            for _, experiment in entries])
+        for _, experiment in sorted(entries):
+            if cached <= self.cache_size:
+                break
+            entry = self.completed_tasks.pop(experiment)
+            if os.path.exists(entry.path):
+                shutil.rmtree(entry.path)
+            cached -= entry.size
+        self.save_instance()
+
+    def get_pending_tasks(self, experiments, report=None):
+        """Return the tasks of the @experiments returned by
+        get_experiments which have to be performed: the feature file if
+        it isn't there, and every result missing from the cache which a
+        task that has to be performed reads.
+        """
+        pending = set()
+        checked = set()
+        tasks = [FEATURE_TASK]
+        while tasks:
+            task = tasks.pop()
+            if task in checked:
+                continue
+            checked.add(task)
+            if not self.is_cached(experiments[task], report):
+                pending.add(task)
+                tasks.extend(TASK_INPUTS[task])
+        return pending
+
+    def count_cooccurrences(self, target_file, synonym_file, windows,
+            window_files, window_experiments, workers=1, corpora=None,
+            report=None):
+        """Counts the cooccurrences for the given windows of @corpora,
+        into the files of each window in @window_files, as returned by
+        get_files, for the experiments in @window_experiments, as returned
+        by get_experiments.  Each index segment still missing counts is
+        counted for all of those windows in a single pass, and its counts
+        are kept for every later selection of corpora holding it, then the
+        counts of the segments are summed unless there is only one.
+        @workers processes share the counting.
+        """
+        segments = self.get_segments(corpora)
+        for segment_num, segment in enumerate(segments):
+            pending = {}
+            for window, experiments in zip(windows, window_experiments):
+                experiment = experiments[COOCCURRENCE_TASK][segment_num]
+                if not self.is_cached(experiment, report):
+                    pending[window] = experiment
+            if pending:
+                pending_windows = sorted(pending)
+                self.run_stage(COOCCURRENCE_TASK, _count_window_cooccurrences,
+                        ([self.get_segment_files(segment, pending[window])
+                            for window in pending_windows],
+                        target_file, synonym_file, pending_windows, workers),
+                        [pending[window] for window in pending_windows])
+                for experiment in pending.itervalues():
+                    self.record(experiment)
+
+        if len(segments) == 1:
+            return
+        for files, experiments in zip(window_files, window_experiments):
+            self.run_stage(MERGE_TASK, _merge_segment_counts, (files,
+                    [self.get_segment_files(segment, experiment)
+                        for segment, experiment
+                        in zip(segments, experiments[COOCCURRENCE_TASK])]),
+                    [experiments[MERGE_TASK]])
+            self.record(experiments[MERGE_TASK])
+
+    def calculate_PMIs(self, pmi_thresholds, threshold_files,
+            threshold_experiments):
+        """Performs the PMI calculation for the given thresholds of a
+        window from a single load of its counts.  @threshold_files and
+        @threshold_experiments hold the files and experiments of each
+        threshold, as returned by get_files and get_experiments.
+        """
+        self.run_stage(PMI_TASK, _calculate_threshold_PMIs,
+                (threshold_files, pmi_thresholds),
+                [experiments[PMI_TASK] for experiments
+                    in threshold_experiments])
+        for experiments in threshold_experiments:
+            self.record(experiments[PMI_TASK])
 
     def perform_experiment(self, target_file, synonym_file=None, 
                            window=float('inf'), pmi_threshold=0, 
                            relation_threshold=0, truth_db=None, 
-                           truth_function=None):
+                           truth_function=None, workers=1,
+                           memory_budget=None, corpora=None,
+                           feature_format='arff'):
         """Performs an experiment with the requested parameters.  The
         function will reuse past experimental results if possible.
+        @window, @pmi_threshold and @truth_function may also be lists, in
+        which case an experiment is performed for each combination of
+        them.  The cooccurrences for all of the windows are counted in a
+        single pass over the index, the PMIs for all of the thresholds
+        are calculated from a single load of each window's counts, and
+        the feature files for all of the truth functions are written from
+        a single pass over the relations they share.
+        Cooccurrence counting is split between @workers processes.
+        Relations are computed within a budget of roughly @memory_budget
+        bytes when one is given.  The experiment is performed on the
+        indexed @corpora, a corpus or a list of them, or on every indexed
+        corpus if none are given.
+        The feature files are written in @feature_format, one of
+        FEATURE_FORMATS.
+
+        Returns a dictionary from every experiment looked up in the cache
+        to whether it was found, which show_cache_report prints.
+        """
+        windows = _as_list(window)
+        pmi_thresholds = _as_list(pmi_threshold)
+        truth_functions = _as_list(truth_function)
+        self.forget_digests()
+        report = OrderedDict()
+        experiments = {}
+        experiment_files = {}
+        pending = {}
+        for window in windows:
+            for pmi_threshold in pmi_thresholds:
+                for truth_function in truth_functions:
+                    key = (window, pmi_threshold, truth_function)
+                    experiments[key] = self.get_experiments(target_file,
+                            synonym_file, window, pmi_threshold,
+                            relation_threshold, truth_db, truth_function,
+                            corpora, feature_format)
+                    experiment_files[key] = self.get_files(target_file,
+                            synonym_file, experiments[key], corpora)
+                    pending[key] = self.get_pending_tasks(experiments[key],
+                            report)
+
+        ## the experiments of the truth functions only differ in their
+        ## feature files, so the work before them is done once for the
+        ## first truth function whenever any of them needs it
+        def is_pending(task, window, pmi_threshold=None):
+            return any([task in pending[key] for key in pending
+                if key[0] == window and
+                pmi_threshold in (None, key[1])])
+        first_truth_function = truth_functions[0]
+
+        count_windows = [window for window in windows
+                if is_pending(MERGE_TASK, window)]
+        if count_windows:
+            self.count_cooccurrences(target_file, synonym_file,
+                    count_windows,
+                    [experiment_files[(window, pmi_thresholds[0],
+                        first_truth_function)] for window in count_windows],
+                    [experiments[(window, pmi_thresholds[0],
+                        first_truth_function)] for window in count_windows],
+                    workers, corpora, report)
+
+        for window in windows:
+            pmi_keys = [(window, pmi_threshold, first_truth_function)
+                    for pmi_threshold in pmi_thresholds
+                    if is_pending(PMI_TASK, window, pmi_threshold)]
+            if pmi_keys:
+                self.calculate_PMIs([pmi_threshold for _, pmi_threshold, _
+                    in pmi_keys], [experiment_files[key] for key in pmi_keys],
+                    [experiments[key] for key in pmi_keys])
+            for pmi_threshold in pmi_thresholds:
+                key = (window, pmi_threshold, first_truth_function)
+                if is_pending(RELATION_TASK, window, pmi_threshold):
+                    self.run_stage(RELATION_TASK, _calculate_relations,
+                            (experiment_files[key], relation_threshold,
+                                memory_budget),
+                            [experiments[key][RELATION_TASK]])
+                    self.record(experiments[key][RELATION_TASK])
+                feature_keys = [(window, pmi_threshold, truth_function)
+                        for truth_function in truth_functions
+                        if FEATURE_TASK in pending[(window, pmi_threshold,
+                            truth_function)]]
+                if feature_keys:
+                    self.run_stage(FEATURE_TASK, _write_feature_files,
+                            ([experiment_files[key] for key in feature_keys],
+                                truth_db, [truth_function for _, _,
+                                    truth_function in feature_keys]),
+                            [experiments[key][FEATURE_TASK]
+                                for key in feature_keys])
+                    for key in feature_keys:
+                        self.record(experiments[key][FEATURE_TASK])
+
+        self.evict()
+        self.cache_report = report
+        return report
+
+    def plan_sweep(self, experiments, memory_budget=None):
+        """Return the tasks still pending after cooccurrence counting for
+        a list of experiments, as returned by _expand_grid along with
+        their pending tasks, files and experiments by task, with every
+        task shared by several experiments planned once: the PMIs of all
+        of the thresholds of a window, then the relations of each
+        threshold, then the feature files of every truth function using
+        those relations.
+        """
+        tasks = []
+        pmi_groups = {}
+        for experiment in experiments:
+            if PMI_TASK in experiment['pending']:
+                merge_experiment = experiment['experiments'][MERGE_TASK]
+                pmi_experiment = experiment['experiments'][PMI_TASK]
+                pmi_groups.setdefault(merge_experiment, {})[
+                        pmi_experiment] = (experiment['pmi_threshold'],
+                                experiment['files'])
+
+        pmi_tasks = {}
+        for merge_experiment, pmi_experiments in pmi_groups.iteritems():
+            pmi_experiments = sorted(pmi_experiments.iteritems(),
+                    key=lambda (pmi_experiment, threshold_files):
+                    threshold_files[0])
+            pmi_tasks[merge_experiment] = SweepTask(
+                    _calculate_threshold_PMIs,
+                    ([files for _, (_, files) in pmi_experiments],
+                     [pmi_threshold for _, (pmi_threshold, _)
+                         in pmi_experiments]),
+                    [pmi_experiment for pmi_experiment, _
+                        in pmi_experiments])
+            tasks.append(pmi_tasks[merge_experiment])
+
+        planned = {}
+        feature_groups = OrderedDict()
+        for experiment in experiments:
+            files = experiment['files']
+            pending = experiment['pending']
+            depends_on = None
+            if PMI_TASK in pending:
+                depends_on = pmi_tasks[experiment['experiments'][MERGE_TASK]]
+
+            relation_experiment = experiment['experiments'][RELATION_TASK]
+            if RELATION_TASK in pending:
+                if relation_experiment not in planned:
+                    planned[relation_experiment] = SweepTask(
+                            _calculate_relations,
+                            (files, experiment['relation_threshold'],
+                                memory_budget),
+                            [relation_experiment], depends_on)
+                    tasks.append(planned[relation_experiment])
+                depends_on = planned[relation_experiment]
+
+            ## feature files reading the same relations and truth_db
+            ## are written together, by one pass over the relations
+            if FEATURE_TASK in pending:
+                depends_on, feature_experiments = feature_groups.setdefault(
+                        (relation_experiment, experiment['truth_db']),
+                        (depends_on, OrderedDict()))
+                feature_experiments.setdefault(
+                        experiment['experiments'][FEATURE_TASK],
+                        (files, experiment['truth_function']))
+
+        for (_, truth_db), (depends_on, feature_experiments) in \
+                feature_groups.iteritems():
+            tasks.append(SweepTask(_write_feature_files,
+                ([files for files, _ in feature_experiments.itervalues()],
+                    truth_db, [truth_function for _, truth_function
+                        in feature_experiments.itervalues()]),
+                feature_experiments.keys(), depends_on))
+        return tasks
+
+    def finish_sweep_task(self, task):
+        """Record the experiments of a finished task as completed, and
+        return the tasks which were waiting on it.
+        """
+        for experiment in task.experiments:
+            self.record(experiment)
+        return task.dependents
+
+    def run_sweep(self, tasks, workers=1):
+        """Run the tasks planned by plan_sweep, each once the task it
+        depends on is done.  With more than one worker, tasks which don't
+        depend on each other run at the same time on a pool of worker
+        processes.  Only this process records completed tasks, as soon as
+        each one finishes.  If a worker process dies, killed by a signal
+        or for running out of memory, the task it was running would never
+        finish, so the sweep fails instead.
+        """
+        ready = deque([task for task in tasks if task.depends_on is None])
+        if workers <= 1:
+            while ready:
+                task = ready.popleft()
+                self.run_stage(task.experiments[0].task, task.function,
+                        task.args, task.experiments)
+                ready.extend(self.finish_sweep_task(task))
+            return
+
+        children = set([process.pid
+            for process in multiprocessing.active_children()])
+        pool = multiprocessing.Pool(workers)
+        ## the workers of the pool only ever exit if they die, so every
+        ## one of them should stay alive until the pool is closed
+        pool_workers = set([process.pid for process
+            in multiprocessing.active_children()]) - children
+        ## the pool hands finished tasks back to this process through
+        ## the queue, in whatever order they finish
+        finished = Queue.Queue()
+        running = {}
+        try:
+            while ready or running:
+                while ready:
+                    task = ready.popleft()
+                    task_num = id(task)
+                    running[task_num] = task
+                    stage = task.experiments[0].task
+                    pool.apply_async(_run_sweep_task,
+                            (task_num, TASK_NAMES[stage], task.function,
+                                task.args, self.get_profile_file(stage)),
+                            callback=finished.put)
+                task_num, error, record = _get_finished_task(finished,
+                        pool_workers, running)
+                if error is not None:
+                    raise ValueError ("sweep task failed:\n%s" % error)
+                task = running.pop(task_num)
+                self.log_stage(record, task.experiments)
+                ready.extend(self.finish_sweep_task(task))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def perform_sweep(self, grid, workers=1, memory_budget=None):
+        """Performs an experiment for every combination of the parameters
+        in @grid, a dictionary from the arguments of perform_experiment to
+        the list of values each should take, such as
+
+        {'target_file': 'targets.txt', 'window': [10, 50],
+         'pmi_threshold': [0, 25], 'relation_threshold': [0, 100],
+         'truth_db': 'truth.db', 'truth_function': ['2_way_mild',
+         '2_way_strong']}
+
+        A parameter may also be given a single value.  The values of
+        corpora are selections of corpora, each a corpus or a list of
+        them, so 'corpora': ['forum', 'medline'] performs experiments on
+        each corpus on its own and 'corpora': [['forum', 'medline']] on
+        both together.  Left out parameters take their default.
+        Work shared by several experiments is done once: the
+        cooccurrences for every window are counted in a single pass over
+        each index segment, split between @workers processes, then the
+        PMIs of each window, the relations of each PMI threshold and the
+        feature files of the truth functions of each relations are
+        computed by a pool of @workers processes as soon as the work they
+        depend on is done.
+
+        Returns the cache report of the sweep, as perform_experiment does.
         """
-        experiments = [ 
-                Experiment(COOCCURRENCE_TASK, 
-                    (target_file, synonym_file, window),
-                    ()),
-                Experiment(PMI_TASK, 
-                    (pmi_threshold,), 
-                    (target_file, synonym_file, window)),
-                Experiment(RELATION_TASK, 
-                    (relation_threshold,),
-                    (target_file, synonym_file, window, pmi_threshold)),
-                Experiment(FEATURE_TASK, 
-                    (truth_db, truth_function),
-                    (target_file, synonym_file, window, pmi_threshold,
-                     relation_threshold)),
-                ]
-        files = self.get_files(target_file, synonym_file, window, pmi_threshold,
-                relation_threshold, truth_db, truth_function)
+        experiments = _expand_grid(grid)
+        self.forget_digests()
+        report = OrderedDict()
+        count_groups = {}
         for experiment in experiments:
-            if experiment not in self.completed_tasks:
-                experiment(files)
-                self.completed_tasks[experiment] = None
-                self.save_instance()
+            experiment['experiments'] = self.get_experiments(
+                    experiment['target_file'], experiment['synonym_file'],
+                    experiment['window'], experiment['pmi_threshold'],
+                    experiment['relation_threshold'], experiment['truth_db'],
+                    experiment['truth_function'], experiment['corpora'],
+                    experiment['feature_format'])
+            experiment['files'] = self.get_files(experiment['target_file'],
+                    experiment['synonym_file'], experiment['experiments'],
+                    experiment['corpora'])
+            experiment['pending'] = self.get_pending_tasks(
+                    experiment['experiments'], report)
+            if MERGE_TASK in experiment['pending']:
+                group = (self.get_selection(experiment['corpora']),
+                        experiment['target_file'], experiment['synonym_file'])
+                corpora, windows = count_groups.setdefault(group,
+                        (experiment['corpora'], {}))
+                windows[experiment['window']] = experiment
+
+        for (_, target_file, synonym_file), (corpora, windows) in \
+                count_groups.iteritems():
+            count_windows = sorted(windows)
+            self.count_cooccurrences(target_file, synonym_file,
+                    count_windows,
+                    [windows[window]['files'] for window in count_windows],
+                    [windows[window]['experiments']
+                        for window in count_windows],
+                    workers, corpora, report)
+
+        self.run_sweep(self.plan_sweep(experiments, memory_budget), workers)
+        self.evict()
+        self.cache_report = report
+        return report
+
+    def set_profiling(self, stages=()):
+        """Profile the @stages, named as in TASK_NAMES, of later
+        experiments with cProfile, writing a profile of each time a stage
+        is run into the profiles directory of the experimenter.  The
+        stage log names the profile of each stage.  Profiling is turned
+        off by leaving out @stages.
+        """
+        names = dict((name, task) for task, name in TASK_NAMES.iteritems())
+        for stage in stages:
+            if stage not in names:
+                raise ValueError ("invalid stage %s, must be one of %s"
+                        % (stage, ', '.join(sorted(names))))
+        self.profiled_stages = set([names[stage] for stage in stages])
+        self.save_instance()
+
+    def get_profile_file(self, task):
+        """Return a new file for a profile of the stage of @task, or None
+        if the stage isn't being profiled.
+        """
+        if task not in self.profiled_stages:
+            return None
+        profile_dir = os.path.join(self.directory, PROFILE_DIR)
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+        return os.path.join(profile_dir, "%s_%.6f.prof" %
+                (TASK_NAMES[task].replace(' ', '_'), time.time()))
+
+    def run_stage(self, task, function, args, experiments=(), **info):
+        """Call @function with @args as the stage of @task, performing
+        @experiments, and log the time, counters and memory of the
+        stage along with the items of @info.
+        """
+        record = stage_stats.run_stage(TASK_NAMES[task], function, args,
+                self.get_profile_file(task))
+        self.log_stage(record, experiments, **info)
+
+    def log_stage(self, record, experiments=(), **info):
+        """Append the record of a stage performing @experiments to the
+        stage log of the experimenter, a JSON object per line.  The
+        experiments are given by their keys in the cache.
+        """
+        stage_stats.append_log(os.path.join(self.directory, STAGE_LOG_FILE),
+                record, experiments=[experiment.get_key()
+                    for experiment in experiments], **info)
+
+    def show_stage_log(self):
+        """Print the time, throughput and growth in peak memory of every
+        stage run by the experimenter onto STDOUT
+        """
+        for record in stage_stats.read_log(
+                os.path.join(self.directory, STAGE_LOG_FILE)):
+            rates = ', '.join(["%.0f %s" % (record[counter + '_per_second'],
+                counter.replace('_', ' ') + '/sec') for counter
+                in ('docs', 'tokens', 'bytes_read')
+                if counter + '_per_second' in record])
+            print("%s: %.2fs wall, %.2fs cpu, %d KB more peak memory "
+                "(%d KB so far)%s" % (
+                record['stage'], record['wall_seconds'],
+                record['cpu_seconds'], record['peak_rss_growth_kb'],
+                record['process_peak_rss_kb'],
+                ', ' + rates if rates else ''))
+            for counter, value in sorted(record['counters'].iteritems()):
+                print("    %s: %s" % (counter, value))
+
+    def show_cache_report(self, report=None):
+        """Print whether each experiment looked up by the last experiment
+        or sweep, or in @report, was found in the cache onto STDOUT
+        """
+        if report is None:
+            report = self.cache_report
+        hits = 0
+        for experiment, found in report.iteritems():
+            hits += found
+            print("%s %s %s" % ('hit ' if found else 'miss',
+                TASK_NAMES[experiment.task],
+                experiment.args[1:] if experiment.task == FEATURE_TASK
+                else experiment.args))
+        print("%d hits, %d misses" % (hits, len(report) - hits))
 
     def show_performed_experiments(self):
         """Print performed experiments onto STDOUT
@@ -225,9 +1072,12 @@ class Experiment:
         return("task %s\nwith arguments %s\nin context %s"
                 % (self.task, self.args, self.context))
 
-    def __call__(self, files):
-        function = TASK_FUNCTIONS[self.task]
-        function(files, *self.args)
+    def get_key(self):
+        """Return a digest of the experiment, which names its results in
+        the cache.
+        """
+        return hashlib.sha1(repr((self.task, self.args,
+            self.context))).hexdigest()
 
     def __eq__(self, other):
         if self.task == other.task and self.args == other.args\
@@ -238,3 +1088,26 @@ class Experiment:
 
     def __hash__(self):
         return hash(self.args + self.context + (self.task,))
+
+class CacheEntry:
+    """Where the results of a completed experiment are kept, how many
+    bytes they take up and when they were last used.
+    """
+    def __init__(self, path, size, last_used):
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+
+class SweepTask:
+    """A task of a sweep: a call of @function with @args performing the
+    pending @experiments, which can only run once the task it depends on
+    is done.
+    """
+    def __init__(self, function, args, experiments, depends_on=None):
+        self.function = function
+        self.args = args
+        self.experiments = experiments
+        self.depends_on = depends_on
+        self.dependents = []
+        if depends_on is not None:
+            depends_on.dependents.append(self)
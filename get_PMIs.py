@@ -1,37 +1,64 @@
-from bsddb import db
-import math
+import numpy
+import count_db
+from vocabulary import ID_BITS, ID_MASK
 
-def get_PMIs(word_counts_db_file, cooccurrence_counts_db_file,
-        cooccurrence_threshold, total_words_file, pmi_db_file):
-    with open(total_words_file, 'r') as total_words_file:
-        total_word_count = float(total_words_file.readline()[:-1]) # to force precise division
+LOG_2 = numpy.log(2)
 
-    word_counts_db = db.DB()
-    word_counts_db.open(word_counts_db_file, None, db.DB_HASH, db.DB_RDONLY)
+def load_counts(word_counts_db_file, cooccurrence_counts_db_file):
+    """Load the word counts into an array indexed by word id, and the
+    cooccurrence counts into aligned arrays of pair keys and counts.
+    """
+    word_ids, counts = count_db.read_counts(word_counts_db_file)
+    word_counts = numpy.zeros(int(word_ids.max()) + 1 if len(word_ids) else 0)
+    word_counts[word_ids.astype(numpy.intp)] = counts
+    pairs, cooccurrence_counts = count_db.read_counts(
+            cooccurrence_counts_db_file)
+    return word_counts, pairs, cooccurrence_counts
 
-    cooccurrence_counts_db = db.DB()
-    cooccurrence_counts_db.open(cooccurrence_counts_db_file, None, db.DB_HASH, db.DB_RDONLY)
-    cursor = cooccurrence_counts_db.cursor()
-    record = cursor.first()
+def compute_PMIs(word_counts, pairs, cooccurrence_counts, total_word_count):
+    """Return the PMI of every pair at once.
+    """
+    targets = (pairs >> numpy.uint64(ID_BITS)).astype(numpy.intp)
+    words = (pairs & numpy.uint64(ID_MASK)).astype(numpy.intp)
+    prob_word = word_counts[words] / total_word_count
+    prob_target = word_counts[targets] / total_word_count
+    prob_cooccurrence = cooccurrence_counts / total_word_count
 
-    pmi_db = db.DB()
-    pmi_db.open(pmi_db_file, None, db.DB_HASH, db.DB_CREATE | db.DB_TRUNCATE)
+    return numpy.log(prob_cooccurrence) / LOG_2 - \
+            numpy.log(prob_target) / LOG_2 - numpy.log(prob_word) / LOG_2
 
-    while record:
-        key, cooccurrence_count = record
-        target, word = key.split(',')
-        cooccurrence_count = float(cooccurrence_count) # to force precise division
+def write_PMIs(pmi_db_file, pairs, pmis):
+    """Bulk load the PMIs of sorted pairs into a B-tree keyed by pair.
+    """
+    keys = pairs.astype('>u8').tostring()
+    count_db.write_sorted(pmi_db_file, ((keys[8 * pair_num: 8 * pair_num + 8],
+            str(pmi)) for pair_num, pmi in enumerate(pmis.tolist())))
 
-        if cooccurrence_count > cooccurrence_threshold:
-            prob_word = float(word_counts_db.get(word)) / total_word_count
-            prob_target = float(word_counts_db.get(target)) / total_word_count
-            prob_cooccurrence = cooccurrence_count / total_word_count
+def get_threshold_PMIs(word_counts_db_file, cooccurrence_counts_db_file,
+        cooccurrence_thresholds, total_words_file, pmi_db_files):
+    """Compute the PMIs of every pair which cooccurs more than the
+    smallest threshold, then write the PMIs of pairs above each of
+    cooccurrence_thresholds[i] into pmi_db_files[i].
+    """
+    with open(total_words_file, 'r') as total_words_file:
+        total_word_count = float(total_words_file.readline()[:-1]) # to force precise division
+
+    word_counts, pairs, cooccurrence_counts = load_counts(
+            word_counts_db_file, cooccurrence_counts_db_file)
+    cooccurrence_counts = cooccurrence_counts.astype(numpy.float64)
 
-            pmi = math.log(prob_cooccurrence, 2) - math.log(prob_target, 2) - math.log(prob_word, 2)
-            pmi_db.put(key, str(pmi))
+    above_threshold = cooccurrence_counts > min(cooccurrence_thresholds)
+    pairs = pairs[above_threshold]
+    cooccurrence_counts = cooccurrence_counts[above_threshold]
+    pmis = compute_PMIs(word_counts, pairs, cooccurrence_counts,
+            total_word_count)
 
-        record = cursor.next()
+    for cooccurrence_threshold, pmi_db_file in zip(cooccurrence_thresholds,
+            pmi_db_files):
+        above_threshold = cooccurrence_counts > cooccurrence_threshold
+        write_PMIs(pmi_db_file, pairs[above_threshold], pmis[above_threshold])
 
-    word_counts_db.close()
-    cooccurrence_counts_db.close()
-    pmi_db.close()
+def get_PMIs(word_counts_db_file, cooccurrence_counts_db_file,
+        cooccurrence_threshold, total_words_file, pmi_db_file):
+    get_threshold_PMIs(word_counts_db_file, cooccurrence_counts_db_file,
+            [cooccurrence_threshold], total_words_file, [pmi_db_file])
@@ -1,7 +1,16 @@
-from bsddb import db
+from bisect import bisect_right
+from collections import deque
+from column_index import IndexReader, update_postings
+import count_db
 import jar
 import locale
+import multiprocessing
+import numpy
 from normalize import normalize
+from sorted_runs import RunSet
+import stage_stats
+from vocabulary import ID_BITS, ID_MASK, pack_key, pack_pair, \
+        write_target_ids
 
 DEF_LOCALE = locale.getdefaultlocale()[1]
 SYNCH_FREQ = 10000
@@ -23,7 +32,7 @@ def get_synonyms_from_file(synonym_file):
     synonyms = {}
     if synonym_file:
         with open(synonym_file, 'r') as file:
-            for line_num, line in enumurate(file):
+            for line_num, line in enumerate(file):
                 line = line.strip()
                 try:
                     synonym, target = line.split(':')
@@ -32,11 +41,96 @@ def get_synonyms_from_file(synonym_file):
                 except ValueError: 
                     raise AttributeError ("Formatting Error on line %d\n\
                             Lines Should be in the format 'synonym:target'"
-                            % line_num + 1)
+                            % (line_num + 1))
                 synonyms[normalize(synonym)] = normalize(target)
 
     return synonyms
 
+def get_term_ids(targets, synonyms, vocabulary):
+    """Translate the target and synonym dictionaries into term ids of
+    the index @vocabulary.
+
+    Returns a dictionary of target ids, a dictionary mapping tuples of
+    term ids to the id of the multi-word target they spell, a dictionary
+    mapping single term ids to the id of the target they are a synonym
+    of, a {target id: target word} dictionary and the list of terms
+    given ids past the end of the vocabulary, in id order.  Targets and
+    synonyms which aren't a single indexed word get those extra ids.
+    """
+    word_ids = {}
+    for term_id, word in enumerate(vocabulary):
+        word_ids[word] = term_id
+    extra_ids = {}
+
+    def get_phrase(text):
+        """Return the term ids of the words in text, or None if some
+        word was never indexed, so the phrase can never be matched.
+        """
+        phrase = []
+        for word in text.split():
+            if isinstance(word, str):
+                word = word.decode(DEF_LOCALE)
+            if word not in word_ids:
+                return None
+            phrase.append(word_ids[word])
+        return tuple(phrase)
+
+    def get_id(text):
+        phrase = get_phrase(text)
+        if phrase is not None and len(phrase) == 1:
+            return phrase[0]
+        text = ' '.join(text.split())
+        if text not in extra_ids:
+            extra_ids[text] = len(vocabulary) + len(extra_ids)
+        return extra_ids[text]
+
+    target_ids = {}
+    target_words = {}
+    for target in sorted(targets):
+        target_id = get_id(target)
+        target_ids[target_id] = None
+        target_words[target_id] = target
+
+    ## Only single words are ever replaced by their synonym, and a
+    ## multi-word phrase listed as a synonym is never matched as a target
+    synonym_ids = {}
+    synonym_phrases = {}
+    for synonym in sorted(synonyms):
+        phrase = get_phrase(synonym)
+        if phrase is None:
+            continue
+        if len(phrase) == 1:
+            synonym_ids[phrase[0]] = get_id(synonyms[synonym])
+        else:
+            synonym_phrases[phrase] = None
+
+    target_phrases = {}
+    for target in sorted(targets):
+        phrase = get_phrase(target)
+        if phrase is not None and len(phrase) > 1 and \
+                phrase not in synonym_phrases:
+            target_phrases[phrase] = get_id(target)
+
+    return (target_ids, compile_phrases(target_phrases), synonym_ids,
+            target_words, sorted(extra_ids, key=extra_ids.get))
+
+## marks the node of a trie where a phrase ends, word ids are never None
+PHRASE_END = None
+
+def compile_phrases(phrases):
+    """Compile a {phrase: target id} dictionary, with phrases given as
+    tuples of term ids, into a trie of nested {term id: node} dictionaries.
+    The node reached by the last word of a phrase maps PHRASE_END to the
+    phrase's target id.
+    """
+    trie = {}
+    for phrase, target_id in phrases.iteritems():
+        node = trie
+        for word_id in phrase:
+            node = node.setdefault(word_id, {})
+        node[PHRASE_END] = target_id
+    return trie
+
 def set_window(window):
     """Sets the window for LimitQueue and CooccurrenceLimiter classes.
     """
@@ -53,20 +147,20 @@ class LimitQueue:
     def __init__(self):
         ## self.window needs to be set to an appropriate value before-hand
         ## with a LimitQueue.set_window(n) call
-        self.queue = []
+        self.queue = deque()
     
     def push(self, indexed_word):
         """Push the new word onto the queue and delete any words nescessary
         to stay within the limit queue's window."""
         word, word_pos = indexed_word
-        self.queue.append(indexed_word)
+        queue = self.queue
+        queue.append(indexed_word)
 
-        head_word, head_word_pos = self.queue[0]
-        room_left = self.window - (word_pos - head_word_pos)
-        while room_left <= 0:
-            old_head_word, old_head_num = self.queue.pop(0)
-            head_word, head_word_pos = self.queue[0]
-            room_left += (head_word_pos - old_head_num)
+        ## words are pushed in position order, so the words which fell
+        ## out of the window are all at the head of the queue
+        oldest_pos = word_pos - self.window
+        while queue[0][1] <= oldest_pos:
+            queue.popleft()
 
 class CooccurrenceLimiter:
     """Ensures that only words within @windows are counted as cooccurrences
@@ -78,6 +172,9 @@ class CooccurrenceLimiter:
 
     def __init__(self):
         self.targets = {}
+        ## every placement in position order, so the targets which fell
+        ## out of the window are found at the head without a full scan
+        self.placements = deque()
 
     def place_target_in_window(self, indexed_target):
         """Ensures that the next words within @window
@@ -89,20 +186,24 @@ class CooccurrenceLimiter:
         ## targets in the window.
         target_word, target_pos = indexed_target
         self.targets[target_word] = target_pos
+        self.placements.append(indexed_target)
 
     def get_targets_in_window(self, indexed_word):
-        """Returns a list of words that are within @window words
-        of the given word.
+        """Returns a list of (target, target_position) pairs for the targets
+        within @window words of the given word.
         """
         word, word_pos = indexed_word
-        targets_in_window = []
-        for target_word, target_pos in self.targets.items():
-            if self.window - (word_pos - target_pos) <= 0:
+        targets = self.targets
+        placements = self.placements
+        oldest_pos = word_pos - self.window
+        while placements and placements[0][1] <= oldest_pos:
+            target_word, target_pos = placements.popleft()
+            ## a placement superseded by a later one of the same target
+            ## leaves the target in the window
+            if targets[target_word] == target_pos:
                 # target is no longer within the current window
-                del self.targets[target_word]
-            else:
-                targets_in_window.append(target_word)
-        return targets_in_window
+                del targets[target_word]
+        return targets.items()
 
 def iter_unseparated_words(text):
     """Yields lists of words which are not separated by a stop word.
@@ -123,25 +224,34 @@ def iter_unseparated_words(text):
         prievious_word_pos = word_pos
     yield current_phrase
 
-def replace_synonyms(phrase, synonyms, targets):
-    """Takes a phrase and performs a greedy search for increasingly shorter
-    sub-phrases of it in the synonym and target hash tables.
+def replace_synonyms(phrase, synonyms, phrase_trie):
+    """Takes a phrase and scans it left to right, replacing the longest
+    multi-word target starting at each word, found by walking the trie of
+    multi-word targets, or else the single word with its synonym.
     """
     phrase_length = len(phrase)
-    def search_phrase(left_bound):
-        for right_bound in range(phrase_length, left_bound, -1):
-            phrase_seg = ' '.join(word for word, word_pos in phrase[left_bound: right_bound])
-            if phrase_seg in synonyms:
-                phrase_seg = synonyms[phrase_seg]
-            elif phrase_seg in targets:
-                break
-        return (phrase_seg, left_bound), right_bound
-
     replaced_phrase = []
     left_bound = 0
-    while left_bound < len(phrase):
-        phrase_seg, left_bound = search_phrase(left_bound)
-        replaced_phrase.append(phrase_seg)
+    while left_bound < phrase_length:
+        ## the segment takes the position of its first word in the text
+        word, word_pos = phrase[left_bound]
+        match = None
+        node = phrase_trie.get(word)
+        right_bound = left_bound + 1
+        while node is not None:
+            if PHRASE_END in node and right_bound - left_bound > 1:
+                match = node[PHRASE_END], right_bound
+            if right_bound == phrase_length:
+                break
+            node = node.get(phrase[right_bound][0])
+            right_bound += 1
+
+        if match is None:
+            replaced_phrase.append((synonyms.get(word, word), word_pos))
+            left_bound += 1
+        else:
+            target_id, left_bound = match
+            replaced_phrase.append((target_id, word_pos))
 
     return replaced_phrase
 
@@ -153,106 +263,370 @@ def add_word_count(word, word_counts):
     except KeyError:
         word_counts[word] = 1
 
-def add_cooccurrence_count(target, word, cooccurrence_counts):
-    """Keeps track of how many times a word has cooccurred with a target.
+def add_cooccurrence_count(target, word, bucket, cooccurrence_counts,
+        windows):
+    """Keeps track of how many times a word has cooccurred with a target,
+    as a histogram over the distance buckets between @windows.
     """
     # don't count a word as cooccurring with itself
     if target != word:
+        ## A cooccurence (target, word) is equivalent to (word, target),
+        ## so both are counted under the same canonical pair key
+        pair = pack_pair(target, word)
         try:
-            cooccurrence_counts[(target, word)] += 1
+            cooccurrence_counts[pair][bucket] += 1
         except KeyError:
-            # A cooccurence (target, word) is equivalent to (word, target)
-            try:
-                cooccurrence_counts[(word, target)] += 1
-            except KeyError:
-                cooccurrence_counts[(target, word)] = 1
+            histogram = [0] * len(windows)
+            histogram[bucket] = 1
+            cooccurrence_counts[pair] = histogram
 
-def get_counts(text, synonyms, targets, word_counts, cooccurrence_counts):
-    """Get word counts and cooccurrences counts in a piece of text.
+def get_counts(text, synonyms, targets, phrase_trie, word_counts,
+        cooccurrence_counts, windows):
+    """Get word counts and cooccurrences counts in a piece of text, given
+    as (term id, word_position) pairs.
+
+    Cooccurrences are counted for every window in the sorted list @windows
+    at once: a cooccurrence at distance d falls into the bucket of the
+    smallest window larger than d, and so counts towards that window and
+    every larger one.  LimitQueue and CooccurrenceLimiter must be set to
+    the largest window.
     """
     limit_queue = LimitQueue()
     cooccurrence_limiter = CooccurrenceLimiter()
 
     for unseparated_words in iter_unseparated_words(text):
-        unseparated_words = replace_synonyms(unseparated_words, synonyms, targets)
+        unseparated_words = replace_synonyms(unseparated_words, synonyms,
+                phrase_trie)
         for indexed_word in unseparated_words:
             word, word_pos = indexed_word
             add_word_count(word, word_counts)
-            for target in cooccurrence_limiter.get_targets_in_window(indexed_word):
-                add_cooccurrence_count(target, word, cooccurrence_counts)
+            for target, target_pos in \
+                    cooccurrence_limiter.get_targets_in_window(indexed_word):
+                bucket = bisect_right(windows, word_pos - target_pos)
+                add_cooccurrence_count(target, word, bucket,
+                        cooccurrence_counts, windows)
             if word in targets:
                 for cooccurrence_word, cooccurrence_word_pos in limit_queue.queue:
-                    add_cooccurrence_count(word, cooccurrence_word, 
-                            cooccurrence_counts)
+                    bucket = bisect_right(windows,
+                            word_pos - cooccurrence_word_pos)
+                    ## the queue was last cut down for the word before the
+                    ## target, so after a gap left by stop words it can
+                    ## still hold words a whole window or more before it
+                    if bucket < len(windows):
+                        add_cooccurrence_count(word, cooccurrence_word,
+                                bucket, cooccurrence_counts, windows)
                 cooccurrence_limiter.place_target_in_window(indexed_word)
             limit_queue.push(indexed_word)
 
-def synchronize(word_counts, cooccurrence_counts,
-        word_counts_db_file, cooccurrence_counts_db_file):
+def synchronize(cooccurrence_counts, cooccurrence_count_runs):
     """Write structures to disk before clearing their contents from memory.
+    Each flush is sorted and written out as a run, the ith window's counts
+    going into the ith set of runs, and the runs are merged into the
+    final dbs by finish_counts.
     """
-    word_counts_db = db.DB()
-    word_counts_db.open(word_counts_db_file, None, 
-                db.DB_HASH, db.DB_CREATE)
-    for word, count in word_counts.iteritems():
-        word = word.encode(DEF_LOCALE)
-        old_val = word_counts_db.get(word)
-        if old_val is None:
-            new_val = count
-        else:
-            new_val = int(old_val) + count
-        word_counts_db.put(word, str(new_val))
-    word_counts_db.close()
-    word_counts.clear()
-
-    cooccurrence_counts_db = db.DB()
-    cooccurrence_counts_db.open(cooccurrence_counts_db_file, None, 
-                db.DB_HASH, db.DB_CREATE)
-    for (target, word), count in cooccurrence_counts.iteritems():
-        ## Try to find both (target, word) and (word, target) in the
-        ## db. This is important if word is itself a target, that is,
-        ## two targets cooccurr with each other, because an earlier
-        ## pass could have placed the cooccurrence pair a different
-        ## order than we have now
-        target, word = target.encode(DEF_LOCALE), word.encode(DEF_LOCALE)
-        key_1 = "%s,%s" % (target, word)
-        old_val_1 = cooccurrence_counts_db.get(key_1)
-        try:
-            new_val_1 = int(old_val_1) + count
-            cooccurrence_counts_db.put(key_1, str(new_val_1))
-        except TypeError:
-            key_2 = "%s,%s" % (word, target)
-            old_val_2 = cooccurrence_counts_db.get(key_2)
-            try:
-                new_val_2 = int(old_val_2) + count
-                cooccurrence_counts_db.put(key_2, str(new_val_2))
-            except TypeError:
-                cooccurrence_counts_db.put(key_1, str(count))
-    cooccurrence_counts_db.close()
-    cooccurrence_counts.clear()
+    with stage_stats.PhaseTimer('flush'):
+        cooccurrence_run = sorted(cooccurrence_counts.iteritems())
+        for window_num, cooccurrence_runs in enumerate(
+                cooccurrence_count_runs):
+            ## sum the histograms up into the counts for this window
+            window_run = []
+            for pair, histogram in cooccurrence_run:
+                count = sum(histogram[:window_num + 1])
+                if count:
+                    window_run.append((pack_key(pair), (count,)))
+            cooccurrence_runs.add_run(window_run)
+        cooccurrence_counts.clear()
+    stage_stats.count('flushes')
+
+def finish_counts(word_counts, cooccurrence_count_runs,
+        word_counts_db_files, cooccurrence_counts_db_files):
+    """Write the word counts, and merge the runs written by synchronize,
+    into B-tree dbs of counts.
+    """
+    for word_counts_db_file in word_counts_db_files:
+        count_db.write_counts(word_counts_db_file,
+                ((pack_key(word_id), (count,))
+                 for word_id, count in enumerate(word_counts) if count))
+    for runs, db_file in zip(cooccurrence_count_runs,
+            cooccurrence_counts_db_files):
+        count_db.write_counts(db_file, runs.merge())
+        runs.remove()
 
 def get_cooccurrences(index_file, target_file, synonym_file, 
-        window, word_counts_db, cooccurrence_counts_db):
+        window, word_counts_db, cooccurrence_counts_db, target_ids_file):
     """Place cooccurrence counts into a berkely db for a given
     index, given a list of targets to count cooccurrences for
     """
-    targets = get_targets_from_file(target_file)
-    synonyms = get_synonyms_from_file(synonym_file)
-    set_window(window)
+    get_window_cooccurrences(index_file, target_file, synonym_file,
+            [window], [word_counts_db], [cooccurrence_counts_db],
+            [target_ids_file])
+
+def get_phrase_length(phrase_trie):
+    """Return the number of words in the longest phrase of a trie.
+    """
+    lengths = [1 + get_phrase_length(node) for word_id, node
+            in phrase_trie.iteritems() if word_id is not PHRASE_END]
+    return max(lengths) if lengths else 0
+
+def get_regions(reader, term_ids, margin):
+    """Return the (start, stop) token ranges of the index around every
+    occurrence of @term_ids, found through the postings, holding the
+    words of its field within @margin word positions of it.  The ranges
+    are in index order, and ranges which overlap are merged.
+    """
+    tokens = [reader.get_postings(term_id) for term_id in term_ids]
+    tokens = numpy.sort(numpy.concatenate(tokens + [numpy.zeros(0,
+        numpy.int64)]))
+    field_starts, field_stops = reader.get_field_bounds()
+    fields = numpy.searchsorted(field_starts, tokens, 'right') - 1
+    positions = reader.positions
+
+    regions = []
+    for token, field in zip(tokens.tolist(), fields.tolist()):
+        field_start = int(field_starts[field])
+        ## word positions only increase within a field
+        field_positions = positions[field_start: field_stops[field]]
+        word_pos = positions[token]
+        start = field_start + int(numpy.searchsorted(field_positions,
+            word_pos - margin, 'left'))
+        stop = field_start + int(numpy.searchsorted(field_positions,
+            word_pos + margin, 'right'))
+        if regions and start < regions[-1][1]:
+            regions[-1] = (regions[-1][0], stop)
+        else:
+            regions.append((start, stop))
+    return regions
 
+def get_region_counts(reader, region, synonyms, targets, phrase_trie,
+        word_counts, cooccurrence_counts, windows):
+    """Get word counts and cooccurrence counts in a token range of the
+    index returned by get_regions.
+    """
+    start, stop = region
+    text = zip(reader.terms[start:stop].tolist(),
+            reader.positions[start:stop].tolist())
+    get_counts(text, synonyms, targets, phrase_trie, word_counts,
+            cooccurrence_counts, windows)
+
+def merge_counts(word_counts, cooccurrence_counts,
+        shard_word_counts, shard_cooccurrence_counts):
+    """Add the counts gathered from a shard of the index into the running
+    counts.
+    """
+    for word_id, count in shard_word_counts.iteritems():
+        word_counts[word_id] += count
+
+    for pair, shard_histogram in shard_cooccurrence_counts.iteritems():
+        histogram = cooccurrence_counts.get(pair)
+        if histogram is None:
+            cooccurrence_counts[pair] = shard_histogram
+        else:
+            for bucket, count in enumerate(shard_histogram):
+                histogram[bucket] += count
+
+## what a counting worker process needs to count its shards,
+## filled in by _init_counter when the worker starts
+_counter_state = {}
+
+def _init_counter(index_file, synonyms, targets, phrase_trie, windows):
+    set_window(windows[-1])
+    _counter_state['reader'] = IndexReader(index_file)
+    _counter_state['synonyms'] = synonyms
+    _counter_state['targets'] = targets
+    _counter_state['phrase_trie'] = phrase_trie
+    _counter_state['windows'] = windows
+
+def _count_shard(shard):
+    """Count a list of regions of the index in a worker process,
+    returning the partial count tables.
+    """
     word_counts = {}
     cooccurrence_counts = {}
+    for region in shard:
+        get_region_counts(_counter_state['reader'], region,
+                _counter_state['synonyms'], _counter_state['targets'],
+                _counter_state['phrase_trie'], word_counts,
+                cooccurrence_counts, _counter_state['windows'])
+    return word_counts, cooccurrence_counts
+
+def get_window_cooccurrences(index_file, target_file, synonym_file,
+        windows, word_counts_dbs, cooccurrence_counts_dbs, target_ids_files,
+        workers=1):
+    """Place cooccurrence counts for several windows into berkely dbs
+    in a single pass over the index.  The counts for windows[i] go into
+    word_counts_dbs[i] and cooccurrence_counts_dbs[i], and the words behind
+    the target ids into target_ids_files[i].  With more than one worker
+    the regions are split into shards which are counted by a pool of
+    worker processes.
+
+    Only the regions of the index around targets, synonyms and the first
+    words of multi-word targets are read, found through the postings of
+    the index.  Everywhere else words are counted as they were indexed,
+    so the word counts start from the term counts of the index, and the
+    words of each region are taken back out before the region is counted
+    with its synonyms and multi-word targets replaced.  A region reaches
+    a whole phrase past the largest window, so no phrase or cooccurrence
+    is ever cut off at its edge.
+    """
+    update_postings(index_file)
+    reader = IndexReader(index_file)
+    try:
+        vocabulary = reader.vocabulary
+        targets, phrase_trie, synonyms, target_words, extra_terms = \
+                get_term_ids(
+                    get_targets_from_file(target_file),
+                    get_synonyms_from_file(synonym_file), vocabulary)
+        for target_ids_file in target_ids_files:
+            write_target_ids(target_ids_file, target_words)
+
+        ## keep the db files lined up with the windows once they are sorted
+        window_files = sorted(zip(windows, word_counts_dbs,
+            cooccurrence_counts_dbs))
+        windows = [window for window, _, _ in window_files]
+        word_counts_dbs = [word_db for _, word_db, _ in window_files]
+        cooccurrence_counts_dbs = [cooccurrence_db for _, _, cooccurrence_db
+                in window_files]
+        set_window(windows[-1])
+
+        ## extra terms are never indexed, so they have no postings
+        term_ids = set([term_id for term_id in targets
+            if term_id < len(vocabulary)])
+        term_ids.update(synonyms)
+        term_ids.update(phrase_trie)
+        regions = get_regions(reader, sorted(term_ids),
+                windows[-1] + get_phrase_length(phrase_trie))
+        ## only the tokens of the regions are read, a term id and a
+        ## position for each
+        region_tokens = sum([stop - start for start, stop in regions])
+        stage_stats.count('docs', len(reader))
+        stage_stats.count('regions', len(regions))
+        stage_stats.count('tokens', region_tokens)
+        stage_stats.count('bytes_read', region_tokens *
+                (reader.terms.itemsize + reader.positions.itemsize))
+
+        ## word counts are kept in an array indexed by term id
+        word_counts = reader.term_counts.copy()
+        if regions:
+            word_counts -= numpy.bincount(numpy.concatenate(
+                [reader.terms[start:stop] for start, stop in regions]),
+                minlength=len(vocabulary))
+        word_counts = word_counts.tolist() + [0] * len(extra_terms)
+        cooccurrence_counts = {}
+        cooccurrence_count_runs = [RunSet(db_file + '.runs')
+                for db_file in cooccurrence_counts_dbs]
+
+        if workers > 1:
+            shards = [regions[start: start + SYNCH_FREQ]
+                    for start in xrange(0, len(regions), SYNCH_FREQ)]
+            pool = multiprocessing.Pool(workers, _init_counter,
+                    (index_file, synonyms, targets, phrase_trie, windows))
+            try:
+                ## imap hands the shards back in order, so the runs are
+                ## identical to the ones the serial path writes
+                for shard_counts in pool.imap(_count_shard, shards):
+                    merge_counts(word_counts, cooccurrence_counts,
+                            *shard_counts)
+                    synchronize(cooccurrence_counts, cooccurrence_count_runs)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for region_num, region in enumerate(regions):
+                with stage_stats.PhaseTimer('window'):
+                    get_region_counts(reader, region, synonyms, targets,
+                            phrase_trie, word_counts, cooccurrence_counts,
+                            windows)
+                ## synchronize on the same shard boundaries the worker
+                ## processes use, so both ways write identical dbs
+                if (region_num + 1) % SYNCH_FREQ == 0:
+                    synchronize(cooccurrence_counts, cooccurrence_count_runs)
+    finally:
+        reader.close()
+
+    synchronize(cooccurrence_counts, cooccurrence_count_runs)
+    finish_counts(word_counts, cooccurrence_count_runs, word_counts_dbs,
+            cooccurrence_counts_dbs)
+
+def get_segment_terms(vocabulary, targets, synonyms):
+    """Return every term counted against the index @vocabulary, in term
+    id order: the vocabulary followed by the extra terms of the targets
+    and synonyms.  Byte strings are decoded so a term matches the same
+    word in the vocabulary of another index.
+    """
+    terms = list(vocabulary)
+    for term in get_term_ids(targets, synonyms, vocabulary)[4]:
+        if isinstance(term, str):
+            term = term.decode(DEF_LOCALE)
+        terms.append(term)
+    return terms
+
+def write_summed_counts(db_file, keys, counts):
+    """Sum the counts of every key into a B-tree of counts, given lists
+    of aligned arrays of 64-bit keys and counts.
+    """
+    keys, key_nums = numpy.unique(numpy.concatenate(keys),
+            return_inverse=True)
+    counts = numpy.bincount(key_nums, numpy.concatenate(counts),
+            len(keys)).astype(numpy.int64)
+    packed_keys = keys.astype('>u8').tostring()
+    count_db.write_counts(db_file, ((packed_keys[8 * key_num:8 * key_num + 8],
+            (count,)) for key_num, count in enumerate(counts.tolist())))
+
+def merge_segment_counts(segment_index_files, target_file, synonym_file,
+        segment_word_counts_dbs, segment_cooccurrence_counts_dbs,
+        word_counts_db, cooccurrence_counts_db, target_ids_file):
+    """Sum the word and cooccurrence counts of several index segments,
+    counted by get_window_cooccurrences with the same targets, synonyms
+    and window, into the counts of the segments together.
+
+    The words of the segments are numbered in the order of their first
+    appearance, segment after segment, which is how a single index
+    holding every segment would have numbered them, so the merged dbs
+    are the ones counting such an index would have written.
+    """
+    targets = get_targets_from_file(target_file)
+    synonyms = get_synonyms_from_file(synonym_file)
+    vocabularies = [jar.read_vocabulary(index_file)
+            for index_file in segment_index_files]
+
+    vocabulary = []
+    seen_words = {}
+    for segment_vocabulary in vocabularies:
+        for word in segment_vocabulary:
+            if word not in seen_words:
+                seen_words[word] = None
+                vocabulary.append(word)
+    term_ids = dict((term, term_id) for term_id, term
+            in enumerate(get_segment_terms(vocabulary, targets, synonyms)))
+    write_target_ids(target_ids_file,
+            get_term_ids(targets, synonyms, vocabulary)[3])
+
+    word_ids = []
+    word_counts = []
+    pairs = []
+    cooccurrence_counts = []
+    id_bits = numpy.uint64(ID_BITS)
+    for segment_vocabulary, segment_word_db, segment_cooccurrence_db in zip(
+            vocabularies, segment_word_counts_dbs,
+            segment_cooccurrence_counts_dbs):
+        ## the global id of each term id of the segment
+        global_ids = numpy.array([term_ids[term] for term in
+            get_segment_terms(segment_vocabulary, targets, synonyms)],
+            numpy.uint64)
+
+        ids, counts = count_db.read_counts(segment_word_db)
+        word_ids.append(global_ids[ids.astype(numpy.intp)])
+        word_counts.append(counts)
+
+        ## renumbering can swap which id of a pair is the smaller one
+        segment_pairs, counts = count_db.read_counts(segment_cooccurrence_db)
+        ids_1 = global_ids[(segment_pairs >> id_bits).astype(numpy.intp)]
+        ids_2 = global_ids[(segment_pairs & numpy.uint64(ID_MASK)).astype(
+            numpy.intp)]
+        pairs.append((numpy.minimum(ids_1, ids_2) << id_bits) |
+                numpy.maximum(ids_1, ids_2))
+        cooccurrence_counts.append(counts)
 
-    for index, (source, title, meta_info, text) in enumerate(jar.iter_docs(index_file)):
-        if title:
-            get_counts(title, synonyms, targets, word_counts, cooccurrence_counts)
-        if meta_info:
-            get_counts(meta_info, synonyms, targets, word_counts, cooccurrence_counts)
-        if text:
-            get_counts(text, synonyms, targets, word_counts, cooccurrence_counts)
-        if index % SYNCH_FREQ == 0:
-            synchronize(word_counts, cooccurrence_counts, word_counts_db,
-                    cooccurrence_counts_db)
-
-    synchronize(word_counts, cooccurrence_counts, word_counts_db,
-            cooccurrence_counts_db)
+    write_summed_counts(word_counts_db, word_ids, word_counts)
+    write_summed_counts(cooccurrence_counts_db, pairs, cooccurrence_counts)
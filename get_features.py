@@ -1,5 +1,49 @@
-import arff
 from bsddb import db
+from column_index import WRITING_SUFFIX
+import count_db
+import locale
+import numpy
+import os
+import stage_stats
+import struct
+import zipfile
+from vocabulary import read_target_ids, unpack_key, unpack_pair
+
+DEF_LOCALE = locale.getdefaultlocale()[1]
+# bytes of arff rows buffered before they are written to the feature file
+WRITE_BUFFER_SIZE = 1 << 20
+# feature files ending in this are written as arrays instead of arff
+ARRAY_EXTENSION = '.npz'
+# the arrays of the features of each relation, in the order of the
+# attributes of an arff file
+FEATURE_ARRAYS = [('context_similarity', numpy.float64),
+        ('normal_similarity', numpy.float64),
+        ('pmi', numpy.float64),
+        ('cooccurrences', numpy.int64),
+        ('target_1', numpy.int64),
+        ('target_2', numpy.int64),
+        ]
+# array of the index of the truth value of each relation in its truth
+# nominals, or MISSING_TRUTH
+TRUTH_ARRAY = ('truth', numpy.int8)
+MISSING_TRUTH = -1
+# rows of features buffered before they are appended to the arrays
+ARRAY_CHUNK_SIZE = 1 << 16
+# bytes of the header of each array, which is written before the length
+# of the array is known and rewritten in place once it is
+NPY_HEADER_SIZE = 128
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+# the length of the name and extra field of a zip file member, at the
+# end of its fixed size local header
+ZIP_NAME_LENGTHS = struct.Struct('<HH')
+ZIP_LOCAL_HEADER_SIZE = 30
+# the (name, is numeric, nominal values) attributes of every feature file
+FEATURE_ATTRIBUTES = [("context similarity", 1, []),
+        ("normal similarity", 1, []),
+        ("pmi between diseases", 1, []),
+        ("times diseases cooccurred", 1, []),
+        ("disease names", 0, []),
+        ]
 
 def five_way(pearson):
     if pearson > .3: # high correlation
@@ -72,64 +116,385 @@ def get_truth_nominals(function_name):
     except KeyError:
         raise AttributeError ("invalid function name %s" % function_name)
 
+def read_truth_values(truth_file, target_words):
+    """Read the pearson correlations of pairs of targets out of a truth
+    DB in one sweep of a cursor, returning a {(target id, target id):
+    pearson} dictionary.  The truth DB is keyed by 'target,target', and
+    pairs of words which are not both targets are left out.
+    """
+    target_ids = {}
+    for target_id, word in target_words.iteritems():
+        target_ids.setdefault(word.encode(DEF_LOCALE), []).append(target_id)
+
+    truth_values = {}
+    truth_DB = db.DB()
+    truth_DB.open(truth_file, None, db.DB_HASH, db.DB_RDONLY)
+    cursor = truth_DB.cursor()
+    record = cursor.first()
+    while record:
+        key, pearson = record
+        ## target names may have commas in them, so try every split
+        comma = key.find(',')
+        while comma != -1:
+            for id_1 in target_ids.get(key[:comma], ()):
+                for id_2 in target_ids.get(key[comma + 1:], ()):
+                    truth_values[(id_1, id_2)] = pearson
+            comma = key.find(',', comma + 1)
+        record = cursor.next()
+        stage_stats.count('db_reads')
+    cursor.close()
+    truth_DB.close()
+    return truth_values
+
+def quote_arff_string(value):
+    """Return a string as a quoted arff value.
+    """
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+def write_arff_header(arff_file, attribute_list, name):
+    """Write the relation name and the (name, is numeric, nominal values)
+    attributes of an arff file, up to the start of its data.  String
+    attributes are the ones which are neither numeric nor nominal.
+    """
+    arff_file.write('@relation %s\n\n' % quote_arff_string(name))
+    for attribute_name, is_numeric, nominals in attribute_list:
+        if is_numeric:
+            attribute_type = 'numeric'
+        elif nominals:
+            attribute_type = '{%s}' % ','.join(nominals)
+        else:
+            attribute_type = 'string'
+        arff_file.write('@attribute %s %s\n' %
+                (quote_arff_string(attribute_name), attribute_type))
+    arff_file.write('\n@data\n')
+
+def write_npy_header(npy_file, dtype, length):
+    """Write the header of a .npy file of a one dimensional array, padded
+    to NPY_HEADER_SIZE bytes whatever the length of the array is.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+            numpy.dtype(dtype).str, length)
+    header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 3) + '\n'
+    npy_file.write(NPY_MAGIC + struct.pack('<H', len(header)) + header)
+
+class ArffWriter:
+    """Writes the rows of features into an arff file, followed by their
+    truth value if the file has a truth function.  The rows go into a
+    temporary file which only replaces the arff file once every row has
+    been written.
+    """
+    def __init__(self, feature_file, attribute_list, truth_function=None):
+        self.truth_function = None
+        if truth_function:
+            attribute_list = attribute_list + [("truth value", 0,
+                get_truth_nominals(truth_function))]
+            self.truth_function = get_truth_function(truth_function)
+        self.feature_file = feature_file
+        self.temp_file_name = feature_file + WRITING_SUFFIX
+        self.arff_file = open(self.temp_file_name, 'w', WRITE_BUFFER_SIZE)
+        write_arff_header(self.arff_file, attribute_list, 'comorbidity')
+
+    def write(self, row, features, pearson):
+        """Write the arff @row of a relation, given its @features and
+        the pearson correlation of its targets or None.
+        """
+        if not self.truth_function:
+            self.arff_file.write(row + '\n')
+        elif pearson:
+            self.arff_file.write('%s,%s\n' % (row,
+                self.truth_function(float(pearson))))
+        else:
+            self.arff_file.write(row + ',?\n')
+
+    def finish(self):
+        """Move the finished arff file into place.
+        """
+        self.arff_file.close()
+        os.rename(self.temp_file_name, self.feature_file)
+
+    def close(self):
+        """Remove the temporary file of an arff file which wasn't
+        finished.
+        """
+        self.arff_file.close()
+        if os.path.exists(self.temp_file_name):
+            os.remove(self.temp_file_name)
+
+class FeatureArrayWriter:
+    """Writes the features of relations as typed arrays into a single
+    uncompressed .npz file, which load_feature_arrays maps into memory
+    without copying.  Alongside the FEATURE_ARRAYS are the target ids
+    and their words, and the truth values as indices into the truth
+    nominals if the file has a truth function.  A missing PMI is a NaN.
+    Each array is appended to its own .npy file as the relations are
+    read, and the .npy files are only gathered into the .npz file once
+    every relation has been written.
+    """
+    def __init__(self, feature_file, target_words, truth_function=None):
+        self.feature_file = feature_file
+        self.target_words = target_words
+        self.arrays = list(FEATURE_ARRAYS)
+        self.truth_function = None
+        if truth_function:
+            self.truth_nominals = get_truth_nominals(truth_function)
+            self.truth_indices = dict((nominal, index) for index, nominal
+                    in enumerate(self.truth_nominals))
+            self.truth_function = get_truth_function(truth_function)
+            self.arrays.append(TRUTH_ARRAY)
+
+        self.length = 0
+        self.buffers = [[] for _ in self.arrays]
+        self.npy_files = []
+        for name, dtype in self.arrays:
+            npy_file = open(self.get_npy_file_name(name), 'w+b')
+            self.npy_files.append(npy_file)
+            write_npy_header(npy_file, dtype, 0)
+
+    def get_npy_file_name(self, name):
+        return "%s.%s.npy" % (self.feature_file, name)
+
+    def write(self, row, features, pearson):
+        """Buffer the @features of a relation, given the pearson
+        correlation of its targets or None.
+        """
+        context_sim, norm, pmi, count, id_1, id_2 = features
+        values = [float(context_sim), float(norm),
+                float(pmi) if pmi is not None else numpy.nan,
+                count, id_1, id_2]
+        if self.truth_function:
+            if pearson:
+                values.append(self.truth_indices[
+                    self.truth_function(float(pearson))])
+            else:
+                values.append(MISSING_TRUTH)
+        for buffer, value in zip(self.buffers, values):
+            buffer.append(value)
+        if len(self.buffers[0]) >= ARRAY_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered features onto the arrays.
+        """
+        for buffer, npy_file, (_, dtype) in zip(self.buffers,
+                self.npy_files, self.arrays):
+            numpy.array(buffer, dtype).tofile(npy_file)
+        self.length += len(self.buffers[0])
+        self.buffers = [[] for _ in self.arrays]
+
+    def finish(self):
+        """Gather the arrays into the .npz file, along with the target
+        words and the truth nominals.
+        """
+        self.flush()
+        target_ids = sorted(self.target_words)
+        words = [self.target_words[target_id].encode('utf-8')
+                for target_id in target_ids]
+        small_arrays = [('target_ids', numpy.array(target_ids, numpy.int64)),
+                ('target_words', numpy.array(words, 'S%d'
+                    % max([1] + [len(word) for word in words])))]
+        if self.truth_function:
+            small_arrays.append(('truth_nominals',
+                numpy.array(self.truth_nominals)))
+
+        npz_file = zipfile.ZipFile(self.feature_file + WRITING_SUFFIX, 'w',
+                zipfile.ZIP_STORED, True)
+        try:
+            for npy_file, (name, dtype) in zip(self.npy_files, self.arrays):
+                npy_file.seek(0)
+                write_npy_header(npy_file, dtype, self.length)
+                npy_file.close()
+                npz_file.write(self.get_npy_file_name(name), name + '.npy')
+            for name, array in small_arrays:
+                npy_file_name = self.get_npy_file_name(name)
+                with open(npy_file_name, 'wb') as npy_file:
+                    write_npy_header(npy_file, array.dtype, len(array))
+                    array.tofile(npy_file)
+                npz_file.write(npy_file_name, name + '.npy')
+                os.remove(npy_file_name)
+        finally:
+            npz_file.close()
+        os.rename(self.feature_file + WRITING_SUFFIX, self.feature_file)
+
+    def close(self):
+        """Remove the .npy files of the arrays, and the .npz file if it
+        wasn't finished.
+        """
+        for npy_file, (name, _) in zip(self.npy_files, self.arrays):
+            npy_file.close()
+            if os.path.exists(self.get_npy_file_name(name)):
+                os.remove(self.get_npy_file_name(name))
+        if os.path.exists(self.feature_file + WRITING_SUFFIX):
+            os.remove(self.feature_file + WRITING_SUFFIX)
+
+def load_feature_arrays(feature_file):
+    """Return a {name: array} dictionary of the arrays in a .npz file
+    written by FeatureArrayWriter.  The arrays are read only memory maps
+    of the file rather than copies of it.
+    """
+    arrays = {}
+    npz_file = zipfile.ZipFile(feature_file, 'r')
+    try:
+        members = npz_file.infolist()
+    finally:
+        npz_file.close()
+    with open(feature_file, 'rb') as file:
+        for member in members:
+            ## the .npy file of a stored member starts after its local
+            ## header, which is followed by the member name and extra field
+            file.seek(member.header_offset + ZIP_LOCAL_HEADER_SIZE -
+                    ZIP_NAME_LENGTHS.size)
+            name_length, extra_length = ZIP_NAME_LENGTHS.unpack(
+                    file.read(ZIP_NAME_LENGTHS.size))
+            file.seek(name_length + extra_length, os.SEEK_CUR)
+            numpy.lib.format.read_magic(file)
+            shape, _, dtype = numpy.lib.format.read_array_header_1_0(file)
+            name = member.filename[:-len('.npy')]
+            if shape[0]:
+                arrays[name] = numpy.memmap(feature_file, dtype, 'r',
+                        file.tell(), shape)
+            else:
+                arrays[name] = numpy.zeros(shape, dtype)
+    return arrays
+
+def export_arff(feature_file, arff_file_name):
+    """Write the arff file holding the same features as a .npz file
+    written by FeatureArrayWriter.
+    """
+    arrays = load_feature_arrays(feature_file)
+    target_words = dict((target_id, word.decode('utf-8').encode(DEF_LOCALE))
+            for target_id, word in zip(arrays['target_ids'].tolist(),
+                arrays['target_words'].tolist()))
+
+    attribute_list = list(FEATURE_ATTRIBUTES)
+    truth_nominals = None
+    if 'truth' in arrays:
+        truth_nominals = arrays['truth_nominals'].tolist()
+        attribute_list.append(("truth value", 0, truth_nominals))
+
+    with open(arff_file_name, 'w', WRITE_BUFFER_SIZE) as arff_file:
+        write_arff_header(arff_file, attribute_list, 'comorbidity')
+        for start in xrange(0, len(arrays['target_1']), ARRAY_CHUNK_SIZE):
+            chunk = [arrays[name][start:start + ARRAY_CHUNK_SIZE].tolist()
+                    for name, _ in FEATURE_ARRAYS]
+            if truth_nominals is not None:
+                chunk.append(
+                    arrays['truth'][start:start + ARRAY_CHUNK_SIZE].tolist())
+            for values in zip(*chunk):
+                context_sim, norm, pmi, count, id_1, id_2 = values[:6]
+                row = '%s,%s,%s,%d,%s' % (context_sim, norm,
+                        pmi if pmi == pmi else '?', count,
+                        quote_arff_string("%s-%s" % (target_words[id_1],
+                            target_words[id_2])))
+                if truth_nominals is None:
+                    arff_file.write(row + '\n')
+                elif values[6] == MISSING_TRUTH:
+                    arff_file.write(row + ',?\n')
+                else:
+                    arff_file.write('%s,%s\n' % (row,
+                        truth_nominals[values[6]]))
+
 def get_features(relations_file, pmi_file, cooccurrence_counts_file, feature_file,
-        truth_file=None, truth_function=None):
+        target_ids_file, truth_file=None, truth_function=None):
     """Write an arff file with the correct features from past experiments.
+    If @feature_file ends in ARRAY_EXTENSION the features are written as
+    arrays by FeatureArrayWriter instead.  @truth_function may also be a
+    list, in which case @feature_file is a list of the same length and a
+    feature file is written for each truth function from a single pass
+    over the relations, since only their truth values differ.
+
+    The rows are written as the relations are read, and the PMIs and
+    cooccurrence counts are found by sweeping through their B-trees in
+    the same key order as the relations, so only the truth values of
+    target pairs are held in memory.
     """
+    if isinstance(truth_function, (list, tuple)):
+        feature_files = list(feature_file)
+        truth_functions = list(truth_function)
+        if len(feature_files) != len(truth_functions):
+            raise ValueError ("%d feature files given for %d truth functions"
+                    % (len(feature_files), len(truth_functions)))
+    else:
+        feature_files = [feature_file]
+        truth_functions = [truth_function]
+    if not truth_file:
+        truth_functions = [None] * len(truth_functions)
+    ## look the truth functions up before any file is written, in case
+    ## a function name is invalid
+    for truth_function in truth_functions:
+        if truth_function:
+            get_truth_function(truth_function)
+
+    target_words = read_target_ids(target_ids_file)
+    truth_values = None
+    if any(truth_functions):
+        truth_values = read_truth_values(truth_file, target_words)
+
+    writers = []
+    try:
+        for feature_file, truth_function in zip(feature_files,
+                truth_functions):
+            if feature_file.endswith(ARRAY_EXTENSION):
+                writers.append(FeatureArrayWriter(feature_file, target_words,
+                    truth_function))
+            else:
+                writers.append(ArffWriter(feature_file, FEATURE_ATTRIBUTES,
+                    truth_function))
+        write_feature_rows(relations_file, pmi_file, cooccurrence_counts_file,
+                target_words, truth_values, writers)
+        for writer in writers:
+            writer.finish()
+    finally:
+        for writer in writers:
+            writer.close()
 
+def write_feature_rows(relations_file, pmi_file, cooccurrence_counts_file,
+        target_words, truth_values, writers):
+    """Hand the arff row and the (context similarity, normal similarity,
+    PMI or None, cooccurrence count, target id, target id) features of
+    each relation to every writer in @writers, along with the pearson
+    correlation of its targets or None.
+    """
     relations_DB = db.DB()
-    relations_DB.open(relations_file, None, db.DB_HASH, 
-            db.DB_RDONLY)
-    pmi_DB = db.DB()
-    pmi_DB.open(pmi_file, None, db.DB_HASH, db.DB_RDONLY)
-    cooccurrence_counts_DB = db.DB()
-    cooccurrence_counts_DB.open(cooccurrence_counts_file, None, db.DB_HASH, 
+    relations_DB.open(relations_file, None, db.DB_BTREE, 
             db.DB_RDONLY)
+    pmi_lookup = count_db.SortedLookup(pmi_file)
+    cooccurrence_counts_lookup = count_db.SortedLookup(
+            cooccurrence_counts_file)
 
-    attribute_list = [("context similarity", 1, []),
-            ("normal similarity", 1, []),
-            ("pmi between diseases", 1, []),
-            ("times diseases cooccurred", 1, []),
-            ("disease names", 0, []),
-            ]
-    if truth_file and truth_function:
-        truth_DB = db.DB()
-        truth_DB.open(truth_file, None, db.DB_HASH, db.DB_RDONLY)
-        attribute_list.append(("truth value", 0, get_truth_nominals(truth_function)))
-        truth_function = get_truth_function(truth_function)
-
-    instances = []
+    relations = 0
     cursor = relations_DB.cursor()
     record = cursor.first()
     while record:
-        instance = []
         key, value = record
-        target_1, target_2 = key.split(',')
+        id_1, id_2 = unpack_pair(unpack_key(key))
+        target_1 = target_words[id_1].encode(DEF_LOCALE)
+        target_2 = target_words[id_2].encode(DEF_LOCALE)
         context_sim, norm = value.split(',')
+        pmi = pmi_lookup.get(key)
+        count = cooccurrence_counts_lookup.get_count(key, 0)
 
-        instance.append(context_sim)
-        instance.append(norm)
-
-        key_1 = "%s,%s" % (target_1, target_2)
-        key_2 = "%s,%s" % (target_2, target_1)
-        ## it's possible the two diseases never cooccurr with each
-        ## other, so the cooccurrence count is 0 and the PMI is
-        ## uncalculatable (can't divide by infinity) so we'll
-        ## mark it as a missing feature (a '?')
-        instance.append(pmi_DB.get(key_1) or pmi_DB.get(key_2) or '?')
-        instance.append(cooccurrence_counts_DB.get(key_1) or 
-                cooccurrence_counts_DB.get(key_2) or 0)
-        instance.append("%s-%s" % (target_1, target_2))
-
-        if truth_file and truth_function:
-            pearson = truth_DB.get(key_1) or truth_DB.get(key_2)
-            if pearson:
-                instance.append(truth_function(float(pearson)))
-            else:
-                instance.append('?')
+        ## the relation value is already the two similarities, comma
+        ## separated.  it's possible the two diseases never cooccurr
+        ## with each other, so the cooccurrence count is 0 and the PMI
+        ## is uncalculatable (can't divide by infinity) so we'll mark it
+        ## as a missing feature (a '?')
+        row = '%s,%s,%d,%s' % (value, pmi or '?', count,
+                quote_arff_string("%s-%s" % (target_1, target_2)))
+        features = (context_sim, norm, pmi or None, count, id_1, id_2)
+
+        pearson = None
+        if truth_values is not None:
+            pearson = truth_values.get((id_1, id_2)) or \
+                    truth_values.get((id_2, id_1))
 
-        instances.append(instance)
+        for writer in writers:
+            writer.write(row, features, pearson)
         record = cursor.next()
+        relations += 1
+    cursor.close()
+    stage_stats.count('relations', relations)
+    stage_stats.count('db_reads', relations)
 
-    with open(feature_file, 'w') as arff_file:
-        arff.arffwrite(arff_file, attribute_list, instances, name='comorbidity')
+    relations_DB.close()
+    pmi_lookup.close()
+    cooccurrence_counts_lookup.close()
@@ -1,6 +1,26 @@
 from bsddb import db
 import math
+import numpy
+import struct
+from itertools import groupby
+import count_db
 from normalize import normalize
+from sorted_runs import RunSet
+import stage_stats
+from vocabulary import (ID_BITS, ID_MASK, pack_key, pack_pair,
+        read_target_ids, unpack_key, unpack_pair)
+
+## the number of target pairs aggregated in one vectorized step by the
+## sparse engine, which bounds the size of its temporary arrays
+BATCH_PAIRS = 1 << 20
+
+## rough in-memory cost, in bytes, of a buffered PMI row and of a target
+## pair's metrics, used by the streaming engine to honour its budget
+PMI_ROW_BYTES = 120
+PAIR_METRICS_BYTES = 250
+DEFAULT_MEMORY_BUDGET = 1 << 30
+PMI_VALUE = struct.Struct('>d')
+PAIR_METRICS = struct.Struct('>dddq')
 
 class RelationFinder:
     """Holds data structures needed for computing relations
@@ -27,74 +47,265 @@ class RelationFinder:
         multiple targets.
         """
         for word, cooccurrences in self.shared_cooccurrences.iteritems():
-            length = len(cooccurrences)
-            for i in range(length - 1):
-                target_1, pmi_1 = cooccurrences[i]
-                for j in range(i + 1, length):
-                    target_2, pmi_2 = cooccurrences[j]
-                    context_sim = (min(pmi_1, pmi_2)) / (max(pmi_1, pmi_2))
-                    norm = abs(pmi_1 - pmi_2)
-                    weight = max(pmi_1, pmi_2)
-                    self.add_relation_metrics(target_1, target_2, context_sim,
-                            norm, weight)
+            self.add_shared_cooccurrences(cooccurrences)
+
+    def add_shared_cooccurrences(self, cooccurrences):
+        """Add the relation metrics of every pair of targets among the
+        (target, pmi) cooccurrences of a single word.
+        """
+        length = len(cooccurrences)
+        for i in range(length - 1):
+            target_1, pmi_1 = cooccurrences[i]
+            for j in range(i + 1, length):
+                target_2, pmi_2 = cooccurrences[j]
+                context_sim = (min(pmi_1, pmi_2)) / (max(pmi_1, pmi_2))
+                norm = abs(pmi_1 - pmi_2)
+                weight = max(pmi_1, pmi_2)
+                self.add_relation_metrics(target_1, target_2, context_sim,
+                        norm, weight)
 
     def add_relation_metrics(self, target_1, target_2, context_sim, norm, weight):
         """Hold the weighted average of relation metrics between two targets.
         """
-        def calculate_vals(contex_sim, norm, weight, total_context_sim,
+        def calculate_vals(context_sim, norm, weight, total_context_sim,
                 total_norm, total_weight, count):
             return (total_context_sim + (context_sim * weight), 
                     total_norm + (norm * weight),
                     total_weight + weight,
                     count + 1)
 
+        key = pack_pair(target_1, target_2)
         try:
-            key_1 = "%s,%s" % (target_1, target_2)
             total_context_sim, total_norm, total_weight, count =\
-                    self.relation_metrics[key_1]
-            self.relation_metrics[key_1] = calculate_vals(context_sim, norm, weight,
-                    total_context_sim, total_norm, total_weight, count)
+                    self.relation_metrics[key]
         except KeyError:
-            try:
-                key_2 = "%s,%s" % (target_2, target_1)
-                total_context_sim, total_norm, total_weight, count =\
-                        self.relation_metrics[key_2]
-                self.relation_metrics[key_2] = calculate_vals(context_sim, norm, weight,
-                    total_context_sim, total_norm, total_weight, count)
-            except KeyError:
-                self.relation_metrics[key_1] = (context_sim, norm, weight, 1)
+            total_context_sim, total_norm, total_weight, count = 0, 0, 0, 0
+        self.relation_metrics[key] = calculate_vals(context_sim, norm, weight,
+                total_context_sim, total_norm, total_weight, count)
 
     def write_output(self):
         """Write a Berkely DB which contains calculated relation metrics.
         """
-        outDB = db.DB()
-        outDB.open(self.out_file, None, db.DB_HASH, 
-                db.DB_CREATE | db.DB_TRUNCATE)
-        for key, (context_sim, norm, weight, count) in self.relation_metrics.iteritems():
-            if count > self.min_threshold:
-                context_sim /= weight
-                norm /= weight
-                outDB.put(key, "%s,%s" % (context_sim, norm))
-        outDB.close()
-
-def get_relations(pmi_file, min_threshold, out_file):
+        self.write_relations((pack_key(key), metrics) for key, metrics
+                in sorted(self.relation_metrics.iteritems()))
+
+    def write_relations(self, relation_metrics):
+        """Write (key, (total_context_sim, total_norm, total_weight, count))
+        records, sorted by key, as the weighted averages of the metrics.
+        """
+        def iter_relations():
+            for key, (context_sim, norm, weight, count) in relation_metrics:
+                if count > self.min_threshold:
+                    context_sim /= weight
+                    norm /= weight
+                    yield key, "%s,%s" % (context_sim, norm)
+        count_db.write_sorted(self.out_file, iter_relations())
+
+class SparseRelationFinder(RelationFinder):
+    """Computes the same relation metrics as RelationFinder, but treats the
+    PMIs as a sparse targets x words matrix and aggregates the metrics of
+    every pair of targets sharing a word with numpy operations, instead of
+    a python loop over each pair.
+    """
+    def __init__(self, out_file, min_threshold = 0):
+        RelationFinder.__init__(self, out_file, min_threshold)
+        self.targets = []
+        self.words = []
+        self.pmis = []
+
+        ## partially aggregated (pair, context_sim, norm, weight, count)
+        ## arrays, compacted whenever they grow past a few batches
+        self.aggregates = []
+        self.aggregated_pairs = 0
+
+    def add_cooccurrence(self, target, word, pmi):
+        """Add an entry of the targets x words PMI matrix.
+        """
+        self.targets.append(target)
+        self.words.append(word)
+        self.pmis.append(pmi)
+
+    def compute_relations(self):
+        """Compute relation metrics using cooccurrence words shared by
+        multiple targets, one batch of words sharing the same number of
+        targets at a time.
+        """
+        self.target_ids, target_index = numpy.unique(
+                numpy.array(self.targets, numpy.int64), return_inverse=True)
+        words = numpy.array(self.words, numpy.int64)
+        pmis = numpy.array(self.pmis, numpy.float64)
+        self.targets = self.words = self.pmis = None
+
+        ## order the matrix by column, so the targets of each word are
+        ## next to each other
+        order = numpy.argsort(words, kind='mergesort')
+        words, target_index, pmis = \
+                words[order], target_index[order], pmis[order]
+        starts = numpy.flatnonzero(numpy.r_[True, words[1:] != words[:-1]])
+        lengths = numpy.diff(numpy.r_[starts, len(words)])
+
+        target_count = len(self.target_ids)
+        for length in numpy.unique(lengths[lengths > 1]).tolist():
+            columns = starts[lengths == length][:, numpy.newaxis] + \
+                    numpy.arange(length)
+            first, second = numpy.triu_indices(length, 1)
+            batch_words = max(1, BATCH_PAIRS // len(first))
+            for batch_start in xrange(0, len(columns), batch_words):
+                batch = columns[batch_start: batch_start + batch_words]
+                pmi_1, pmi_2 = pmis[batch[:, first]], pmis[batch[:, second]]
+                target_1 = target_index[batch[:, first]]
+                target_2 = target_index[batch[:, second]]
+
+                weight = numpy.maximum(pmi_1, pmi_2)
+                context_sim = numpy.minimum(pmi_1, pmi_2) / weight
+                norm = numpy.abs(pmi_1 - pmi_2)
+                pair = numpy.minimum(target_1, target_2) * target_count + \
+                        numpy.maximum(target_1, target_2)
+                self.add_aggregates(pair.ravel(),
+                        (context_sim * weight).ravel(),
+                        (norm * weight).ravel(), weight.ravel(),
+                        numpy.ones(pair.size))
+        self.compact_aggregates()
+
+    def add_aggregates(self, *aggregates):
+        self.aggregates.append(aggregates)
+        self.aggregated_pairs += len(aggregates[0])
+        if self.aggregated_pairs > 4 * BATCH_PAIRS:
+            self.compact_aggregates()
+
+    def compact_aggregates(self):
+        """Sum the aggregates of each pair of targets together.
+        """
+        if not self.aggregates:
+            self.aggregates = [tuple(numpy.zeros(0) for _ in range(5))]
+        columns = [numpy.concatenate(column) for column
+                in zip(*self.aggregates)]
+        pairs, pair_index = numpy.unique(columns[0], return_inverse=True)
+        self.aggregates = [(pairs,) + tuple(
+                numpy.bincount(pair_index, column, len(pairs))
+                for column in columns[1:])]
+        self.aggregated_pairs = len(pairs)
+
+    def write_output(self):
+        """Write a Berkely DB which contains calculated relation metrics.
+        """
+        pairs, context_sim, norm, weight, count = self.aggregates[0]
+        above_threshold = count > self.min_threshold
+        pairs = pairs[above_threshold].astype(numpy.int64)
+        context_sim = (context_sim / weight)[above_threshold]
+        norm = (norm / weight)[above_threshold]
+
+        target_count = len(self.target_ids)
+        keys = (self.target_ids[pairs // target_count] << ID_BITS) | \
+                self.target_ids[pairs % target_count]
+        keys = keys.astype('>u8').tostring()
+        count_db.write_sorted(self.out_file,
+                ((keys[8 * pair_num: 8 * pair_num + 8],
+                  "%s,%s" % (pair_context_sim, pair_norm))
+                 for pair_num, (pair_context_sim, pair_norm)
+                 in enumerate(zip(context_sim.tolist(), norm.tolist()))))
+
+class StreamingRelationFinder(RelationFinder):
+    """Computes the same relation metrics as RelationFinder within a
+    memory budget of roughly @memory_budget bytes.  The PMI rows are
+    sorted by word into sorted runs on disk and then streamed one word
+    at a time, while the partial metrics of target pairs are spilled to
+    sorted runs whenever they outgrow the budget, and merged at the end.
+    """
+    def __init__(self, out_file, min_threshold = 0,
+            memory_budget = DEFAULT_MEMORY_BUDGET):
+        RelationFinder.__init__(self, out_file, min_threshold)
+        self.max_rows = max(1, memory_budget // PMI_ROW_BYTES)
+        self.max_pairs = max(1, memory_budget // PAIR_METRICS_BYTES)
+
+        self.rows = []
+        self.row_runs = RunSet(out_file + '.pmi_runs', PMI_VALUE)
+        self.pair_runs = RunSet(out_file + '.pair_runs', PAIR_METRICS)
+
+    def add_cooccurrence(self, target, word, pmi):
+        """Buffer a PMI row under a key which sorts it by word.
+        """
+        self.rows.append((pack_key((word << ID_BITS) | target), (pmi,)))
+        if len(self.rows) >= self.max_rows:
+            self.spill_rows()
+
+    def spill_rows(self):
+        if self.rows:
+            self.rows.sort()
+            self.row_runs.add_run(self.rows)
+            self.rows = []
+
+    def spill_pairs(self):
+        if self.relation_metrics:
+            self.pair_runs.add_run((pack_key(key), metrics) for key, metrics
+                    in sorted(self.relation_metrics.iteritems()))
+            self.relation_metrics = {}
+
+    def compute_relations(self):
+        """Compute relation metrics from the PMI rows of one word at a
+        time.
+        """
+        self.spill_rows()
+        ## the word is in the high 32 bits of the key
+        for _, rows in groupby(self.row_runs.merge(),
+                lambda record: record[0][:ID_BITS // 8]):
+            self.add_shared_cooccurrences([(unpack_key(key) & ID_MASK, pmi)
+                    for key, (pmi,) in rows])
+            if len(self.relation_metrics) >= self.max_pairs:
+                self.spill_pairs()
+        self.spill_pairs()
+        self.row_runs.remove()
+
+    def write_output(self):
+        """Write a Berkely DB which contains calculated relation metrics,
+        merged from the spilled runs.
+        """
+        self.write_relations(self.pair_runs.merge())
+        self.pair_runs.remove()
+
+RELATION_ENGINES = {
+        'python': RelationFinder,
+        'sparse': SparseRelationFinder,
+        'streaming': StreamingRelationFinder,
+        }
+
+def get_relations(pmi_file, min_threshold, out_file, target_ids_file,
+        engine='sparse', memory_budget=None):
     """Use calculated PMI's to compute relationship metrics
-    between a list of targets.
+    between a list of targets.  @engine picks the RelationFinder used,
+    one of 'python', 'sparse' or 'streaming'.  Giving a @memory_budget,
+    in bytes, selects the streaming engine with that budget.
     """
+    targets = read_target_ids(target_ids_file)
+
     pmi_DB = db.DB()
-    pmi_DB.open(pmi_file, None, db.DB_HASH, db.DB_RDONLY)
+    pmi_DB.open(pmi_file, None, db.DB_BTREE, db.DB_RDONLY)
     cursor = pmi_DB.cursor()
     record = cursor.first()
 
-    relationFinder = RelationFinder(out_file, min_threshold)
+    if memory_budget is not None:
+        relationFinder = StreamingRelationFinder(out_file, min_threshold,
+                memory_budget)
+    else:
+        try:
+            relationFinder = RELATION_ENGINES[engine](out_file, min_threshold)
+        except KeyError:
+            raise AttributeError ("invalid relation engine %s" % engine)
 
+    reads = 0
     while record:
+        reads += 1
         key, pmi = record
         pmi = float(pmi)
-        target, word = key.split(',')
+        target, word = unpack_pair(unpack_key(key))
+        ## the smaller id is taken as the target when both words of
+        ## the pair are targets
+        if target not in targets:
+            target, word = word, target
         relationFinder.add_cooccurrence(target, word, pmi)
         record = cursor.next()
     pmi_DB.close()
+    stage_stats.count('db_reads', reads)
 
     relationFinder.compute_relations()
     relationFinder.write_output()
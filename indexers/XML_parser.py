@@ -6,9 +6,10 @@ class TextGetter:
         self.clear_fields()
 
     def clear_fields(self):
-        self.title = ''
-        self.heading = ''
-        self.text = ''
+        ## chunks of text, only joined once a group is complete
+        self.title = []
+        self.heading = []
+        self.text = []
 
         self.text_list = []
         self.in_tag = None
@@ -20,32 +21,41 @@ class TextGetter:
     def end(self, tag):
         if tag == self.tag_list.title:
             self.in_tag = None
-            self.title += ' '
+            self.title.append(' ')
         if tag == self.tag_list.heading:
             self.in_tag = None
-            self.heading += ' '
+            self.heading.append(' ')
         elif tag == self.tag_list.delimiator:
             self.in_tag = None
-            group = (self.title.strip(), self.heading.strip(), self.text.strip())
+            group = (''.join(self.title).strip(),
+                    ''.join(self.heading).strip(), ''.join(self.text).strip())
             self.text_list.append(group)
-            self.text = ''
-            self.title = ''
-            self.heading = ''
+            self.text = []
+            self.title = []
+            self.heading = []
         elif tag in self.tag_list.tags:
             self.in_tag = None
-            self.text += ' '
+            self.text.append(' ')
 
     def data(self, text):
         if self.in_tag == self.tag_list.title:
-            self.title += text
+            self.title.append(text)
         elif self.in_tag == self.tag_list.heading:
-            self.heading += text
+            self.heading.append(text)
         elif self.in_tag:
-            self.text += text
+            self.text.append(text)
 
     def comment(self, text):
         return
 
+    def pop_groups(self):
+        """Return the groups completed since the last call, so they can be
+        handed on while the rest of a file is still being parsed.
+        """
+        text_list = self.text_list
+        self.text_list = []
+        return text_list
+
     def close(self):
         text_list = self.text_list
         self.clear_fields()
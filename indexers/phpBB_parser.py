@@ -23,11 +23,11 @@ class PostGetter:
     def clear_fields(self):
         """clean up the class instance for repeated use by the parser
         """
-        self.title = ''
+        self.title = [] # chunks of the title, joined once it ends
         self.in_title = False
 
         self.span_count = 0 # for keeping track of nested div tags in the post
-        self.post = '' # the post we are in right now
+        self.post = [] # chunks of the post we are in right now
         self.all_posts = [] # all of the posts on the page
         self.in_post = False
 
@@ -53,20 +53,20 @@ class PostGetter:
             if self.span_count <= 0:
                 ## append the post we just found into a list and get
                 ## ready for the next post on the page
-                self.all_posts.append(self.post.strip())
-                self.post = ''
+                self.all_posts.append(''.join(self.post).strip())
+                self.post = []
                 self.in_post = False
         elif self.in_title and tag == 'a':
-            self.title = self.title.strip()
+            self.title = [''.join(self.title).strip()]
             self.in_title = False
 
     def data(self, data):
         """accumulate the post and title text
         """
         if self.in_post:
-            self.post += data
+            self.post.append(data)
         elif self.in_title:
-            self.title += data
+            self.title.append(data)
 
     def comment(self, text):
         """do nothing on comments
@@ -78,6 +78,6 @@ class PostGetter:
         Return the tile and the posts from the file we just finished parsing.
         """
         all_posts = self.all_posts
-        title = self.title
+        title = ''.join(self.title)
         self.clear_fields()
         return title, all_posts
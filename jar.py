@@ -1,20 +1,40 @@
 import cPickle
 import os
 from normalize import normalize
+from column_index import IndexReader, IndexWriter, truncate_index, \
+        write_atomically, write_postings
+import stage_stats
+from tokenizer import tokenize
 
-def iter_docs(index_file):
+CHECKPOINT_FILE = 'checkpoint.pickle'
+
+def iter_docs(index_file, start=0, stop=None):
     """Reads through documents which have been synchronized
     """
-    with open(index_file, 'rb') as index_file:
-        while True:
-            try:
-                yield cPickle.load(index_file)
-            except EOFError:
-                return
+    reader = IndexReader(index_file)
+    try:
+        for doc in reader.iter_docs(start, stop):
+            yield doc
+    finally:
+        reader.close()
+
+def read_vocabulary(index_file):
+    """Returns the list of indexed words, in term id order
+    """
+    reader = IndexReader(index_file)
+    try:
+        return reader.vocabulary
+    finally:
+        reader.close()
 
 class Jar:
     """Holds statistics which can be synchronized and dumped into a
     file.  Also allows old statistic runs to be restarted.
+
+    Every synchronize writes a checkpoint into the index holding the
+    lengths of the index files, the total word count and how far the
+    corpus being indexed got, so an interrupted run can be resumed from
+    the last checkpoint.
     """
     def __init__(self, index_file, word_count_file,
                  synch_freq, stop_file):
@@ -31,33 +51,107 @@ class Jar:
         
         self.index_file = index_file
         self.total_words_file = word_count_file
-        self.doc_map = []
+        self.checkpoint_file = os.path.join(index_file, CHECKPOINT_FILE)
 
-        # if we are restarting an old run, start the
-        # total word count at the right number
-        if os.path.isfile(self.total_words_file):
-            with open(self.total_words_file, 'r') as total_words_file:
-                self.total_word_count = int(total_words_file.readline()[:-1])
+        if os.path.isfile(self.checkpoint_file):
+            ## drop whatever an interrupted run wrote after its last
+            ## checkpoint, the index and the word count go back together
+            with open(self.checkpoint_file, 'rb') as checkpoint_file:
+                checkpoint = cPickle.load(checkpoint_file)
+            truncate_index(index_file, checkpoint['lengths'])
+            self.total_word_count = checkpoint['total_word_count']
+            self.finished_corpora = checkpoint['finished_corpora']
+            self.progress = checkpoint['progress']
         else:
-            self.total_word_count = 0
+            # if we are restarting an old run, start the
+            # total word count at the right number
+            if os.path.isfile(self.total_words_file):
+                with open(self.total_words_file, 'r') as total_words_file:
+                    self.total_word_count = int(
+                            total_words_file.readline()[:-1])
+            else:
+                self.total_word_count = 0
+            self.finished_corpora = []
+            self.progress = None
+        self.index_writer = IndexWriter(index_file)
+
+    def start_corpus(self, corpus):
+        """Start indexing @corpus, or resume indexing it after an
+        interrupted run.  Returns the sources of the corpus which were
+        completely committed and the number of documents committed from
+        the source after them, which should be skipped, or None if the
+        corpus has already been indexed.
+        """
+        if corpus in self.finished_corpora:
+            return None
+        if self.progress is not None and self.progress['corpus'] != corpus:
+            ## another corpus was interrupted, take what it left out of
+            ## the index
+            truncate_index(self.index_file, self.progress['lengths'])
+            self.total_word_count = self.progress['total_word_count']
+            self.index_writer = IndexWriter(self.index_file)
+            self.progress = None
+        if self.progress is None:
+            self.progress = {
+                    'corpus': corpus,
+                    'lengths': self.index_writer.get_lengths(),
+                    'total_word_count': self.total_word_count,
+                    'sources': [],
+                    'source': None,
+                    'source_docs': 0,
+                    }
+            self.write_checkpoint()
+        return set(self.progress['sources']), self.progress['source_docs']
+
+    def finish_corpus(self):
+        """Synchronize the last documents of the corpus being indexed,
+        write the postings of the index and mark the corpus as indexed.
+        The checkpoint marking it is written last, so a run interrupted
+        before then resumes the corpus and writes the word count and the
+        postings again.
+        """
+        self.synchronize()
+        write_postings(self.index_file)
+        self.finished_corpora.append(self.progress['corpus'])
+        self.progress = None
+        self.write_checkpoint()
 
     def index_and_count_text(self, text):
         """Increments word count by the number of words in text and returns
         a word index of the text, in (word, word_position) pairs with
         stop words removed.
         """
-        text = normalize(text).split()
-        self.total_word_count += len(text)
-        return [(word, word_pos) for word_pos, word in enumerate(text)
-            if word not in self.stop_words]
+        with stage_stats.PhaseTimer('tokenize'):
+            indexed_words, word_count = tokenize(text, self.stop_words)
+        self.total_word_count += word_count
+        stage_stats.count('tokens', word_count)
+        return indexed_words
+
+    def index_text(self, text):
+        """Returns a word index of text without counting its words, for
+        text which was already counted before a checkpoint.
+        """
+        with stage_stats.PhaseTimer('tokenize'):
+            return tokenize(text, self.stop_words)[0]
         
     def add_doc(self, source=None, title=None, 
             meta_info=None, text=None):
         """Add a document into the jar, synching to disk if nescessary.
         """
-        doc = (source, title, meta_info, text)
-        self.doc_map.append(doc)
+        self.index_writer.add_doc(source, title, meta_info, text)
         self.docs_added += 1
+        stage_stats.count('docs')
+
+        progress = self.progress
+        if progress is not None:
+            ## the documents of a source are added together, so once
+            ## another source starts the previous one is complete
+            if source != progress['source']:
+                if progress['source'] is not None:
+                    progress['sources'].append(progress['source'])
+                progress['source'] = source
+                progress['source_docs'] = 0
+            progress['source_docs'] += 1
         
         if self.docs_added % self.synch_freq == 0:
             self.synchronize()
@@ -65,15 +159,29 @@ class Jar:
     def synchronize(self):
         """Synchs the data structures onto disk and wipes them from memory.
         """
-        with open(self.total_words_file, 'w') as total_words_file:
-            total_words_file.write('%s\n' % self.total_word_count)
+        with stage_stats.PhaseTimer('flush'):
+            self.index_writer.flush()
+            ## the word count goes first, a checkpoint holds the count
+            ## to resume from if it is left ahead of the index
+            write_atomically(self.total_words_file, lambda total_words_file:
+                    total_words_file.write('%s\n' % self.total_word_count))
+            self.write_checkpoint()
+        stage_stats.count('flushes')
 
-        with open(self.index_file, 'ab') as index_file:
-            for doc in self.doc_map:
-                cPickle.dump(doc, index_file)
-        self.doc_map = []
+    def write_checkpoint(self):
+        """Atomically record the index as of the last flush.  Nothing is
+        committed until the checkpoint is written.
+        """
+        checkpoint = {
+                'lengths': self.index_writer.get_lengths(),
+                'total_word_count': self.total_word_count,
+                'finished_corpora': self.finished_corpora,
+                'progress': self.progress,
+                }
+        write_atomically(self.checkpoint_file, lambda checkpoint_file:
+                cPickle.dump(checkpoint, checkpoint_file, 2))
 
     def iter_synched_docs(self):
         """Reads through documents which have been synchronized
         """
-        iter_docs(self.index_file)
+        return iter_docs(self.index_file)
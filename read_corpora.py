@@ -1,39 +1,26 @@
 import locale
+import multiprocessing
 import os
-import re
-from bsddb import db
+import struct
+from itertools import groupby
 from lxml import etree
 
+from sorted_runs import RunSet
+import stage_stats
+
 # locale for unicode encoding
 DEF_LOCALE = locale.getdefaultlocale()[1]
-# random string to delimit posts in the DB
-POST_DELIMITER = '^$~'
-
-def strip_delimiter(text):
-    """ make sure that the delimiter isn't in the post
-    """
-    return re.sub(POST_DELIMITER, ' ', text)
-
-def write_posts(title, posts, out_DB):
-    """write the posts into a given DB, using the title as the key in the DB
-    """
-    ## make sure we parsed a page with posts (could have been some other 
-    ## forum page)
-    if title and posts:
-        # make sure the delimter doesn't occur in the post
-        posts = [strip_delimiter(post) for post in posts]
-        # turn the list of posts into a delimiated string of posts
-        posts = reduce(lambda post1, post2: post1 + POST_DELIMITER + post2, posts)
-        # watch out for unicode
-        title, posts = title.encode(DEF_LOCALE), posts.encode(DEF_LOCALE)
-        ## Either append the posts to those already gathered under the tile
-        ## or create a new entry.  If two threads have the same title, they
-        ## will be collapsed into one thread
-        old_posts = out_DB.get(title)
-        if old_posts == None:
-            out_DB.put(title, posts)
-        else:
-            out_DB.put(title, old_posts + POST_DELIMITER + posts)
+# characters of posts grouped into threads in memory before they are
+# spilled to sorted runs on disk, a unicode character taking 2 or 4
+# bytes depending on how python was built
+THREAD_CHARACTERS = 1 << 26
+# ends the title in the key of a spilled post, followed by the post number
+TITLE_END = '\0'
+POST_NUMBER = struct.Struct('>Q')
+# number of files handed to a parsing worker process at a time
+PARSE_CHUNK_SIZE = 16
+# bytes of an xml file fed to the parser at a time
+XML_CHUNK_SIZE = 1 << 16
 
 def iter_dir(dir):
     """recursively iterate through a directory, 
@@ -50,35 +37,178 @@ def iter_dir(dir):
             elif os.path.isdir(file):
                 dir_stack.append(file)
 
-def get_phpBB_posts(corpus_dir, post_DB):
-    """write posts from a corpus of phpBB html files into a berkely DB,
-    indexed by post title.
-    """
+def is_phpBB_file(file_name):
+    return ".html" in file_name or ".php" in file_name or ".htm" in file_name
+
+def is_xml_file(file_name):
+    return '.xml' in file_name
+
+## the parser of a process, each parsing worker process owns its
+## own parser and parser target, filled in by _init_phpBB_parser or
+## _init_xml_parser when the worker starts
+_parser_state = {}
+
+def _init_phpBB_parser():
     from indexers import phpBB_parser
-    
-    out_DB = db.DB()
-    out_DB.open(post_DB, None, db.DB_HASH, db.DB_CREATE | db.DB_TRUNCATE)
-            
-    parser = etree.HTMLParser(target = phpBB_parser.PostGetter())
-    for file in iter_dir(corpus_dir):
-        if ".html" in file or ".php" in file or ".htm" in file:
-            with open(file, 'r') as file:
-                title, posts = etree.HTML(file.read(), parser)
-            write_posts(title, posts, out_DB)
-    out_DB.close()
-
-def iter_xml(corpus_dir, tag_file):
-    """iterate through a corpus of XML files, yielding information
-    specified by the supllied tag list.
-    """
+
+    _parser_state['parser'] = etree.HTMLParser(
+            target = phpBB_parser.PostGetter())
+
+def _init_xml_parser(tag_file):
     from indexers import XML_parser
     from tag_list import TagList
 
     tag_list = TagList(tag_file)
-    parser = etree.XMLParser(target = XML_parser.TextGetter(tag_list))
-    for file_name in iter_dir(corpus_dir):
-        if '.xml' in file_name:
-            with open(file_name, 'r') as file:
-                text_list = etree.XML(file.read(), parser)
+    _parser_state['target'] = XML_parser.TextGetter(tag_list)
+    _parser_state['parser'] = etree.XMLParser(
+            target = _parser_state['target'])
+
+def iter_counted_files(file_names):
+    """Count each file as it is handed out to be parsed.
+    """
+    for file_name in file_names:
+        stage_stats.count_file(file_name)
+        yield file_name
+
+def _parse_phpBB_file(file_name):
+    """Return the (title, posts) of a phpBB html file.
+    """
+    with open(file_name, 'r') as file:
+        return etree.HTML(file.read(), _parser_state['parser'])
+
+def iter_xml_groups(file_name):
+    """Feed an xml file to the parser a chunk at a time, yielding each
+    (title, heading, text) group as soon as its delimiter tag closes.
+    The parser target builds no tree, so only the chunk and the group
+    being parsed are ever held in memory.
+    """
+    parser = _parser_state['parser']
+    target = _parser_state['target']
+    with open(file_name, 'rb') as file:
+        while True:
+            chunk = file.read(XML_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            for group in target.pop_groups():
+                yield group
+    ## closing the parser hands back whatever groups were left
+    for group in parser.close():
+        yield group
+
+def _parse_xml_file(file_name):
+    """Return the (file name, list of (title, heading, text) groups) of
+    an xml file.
+    """
+    return file_name, list(iter_xml_groups(file_name))
+
+def iter_parsed_files(file_names, parse_file, init_parser, init_args=(),
+        workers=1):
+    """Yield the result of @parse_file for each file name, in order.  With
+    more than one worker the files are parsed by a pool of worker
+    processes, each set up by calling @init_parser with @init_args.
+    """
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_parser, init_args)
+        try:
+            ## imap hands the parsed files back in the order they were
+            ## listed, so the index is the same as a serial parse
+            for parsed_file in pool.imap(parse_file, file_names,
+                    PARSE_CHUNK_SIZE):
+                yield parsed_file
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        init_parser(*init_args)
+        for file_name in file_names:
+            yield parse_file(file_name)
+
+def spill_threads(threads, runs, post_number):
+    """Write a {title: posts} dictionary as a sorted run of posts keyed by
+    their title and post number, returning the next post number.
+    """
+    records = []
+    for title in sorted(threads):
+        for post in threads[title]:
+            records.append((title + TITLE_END + POST_NUMBER.pack(post_number),
+                    post.encode('utf-8')))
+            post_number += 1
+    runs.add_run(records)
+    return post_number
+
+def iter_threads(pages, run_dir, buffer_characters=THREAD_CHARACTERS):
+    """Group the (title, posts) of parsed pages into threads, yielding the
+    (title, posts) of each thread in title order with the posts in the
+    order they were parsed.  If two threads have the same title, they are
+    collapsed into one thread.  The pages are grouped in memory, and only
+    spilled to sorted runs in @run_dir once they outgrow
+    @buffer_characters characters.
+    """
+    threads = {}
+    buffered = 0
+    post_number = 0
+    runs = None
+    for title, posts in pages:
+        ## make sure we parsed a page with posts (could have been some
+        ## other forum page)
+        if not (title and posts):
+            continue
+        buffered += len(title) + sum([len(post) for post in posts])
+        title = title.encode('utf-8')
+        threads.setdefault(title, []).extend(posts)
+        if buffered > buffer_characters:
+            if runs is None:
+                runs = RunSet(run_dir, None)
+            post_number = spill_threads(threads, runs, post_number)
+            threads = {}
+            buffered = 0
+
+    if runs is None:
+        for title in sorted(threads):
+            yield title.decode('utf-8'), threads[title]
+        return
+
+    spill_threads(threads, runs, post_number)
+    suffix_length = len(TITLE_END) + POST_NUMBER.size
+    try:
+        for title, records in groupby(runs.merge(),
+                lambda record: record[0][:-suffix_length]):
+            yield title.decode('utf-8'), [post.decode('utf-8')
+                    for _, post in records]
+    finally:
+        runs.remove()
+
+def iter_phpBB_threads(corpus_dir, workers=1,
+        buffer_characters=THREAD_CHARACTERS):
+    """iterate through the threads of a corpus of phpBB html files,
+    yielding the title and posts of each thread.  The files are parsed by
+    @workers processes.
+    """
+    file_names = iter_counted_files(file_name for file_name
+            in iter_dir(corpus_dir) if is_phpBB_file(file_name))
+    pages = iter_parsed_files(file_names, _parse_phpBB_file,
+            _init_phpBB_parser, workers=workers)
+    return iter_threads(pages, os.path.normpath(corpus_dir) + '.runs',
+            buffer_characters)
+
+def iter_xml(corpus_dir, tag_file, workers=1, skip_files=()):
+    """iterate through a corpus of XML files, yielding information
+    specified by the supllied tag list.  The files are parsed by @workers
+    processes, and files in @skip_files are left out.
+    """
+    file_names = iter_counted_files(file_name for file_name
+            in iter_dir(corpus_dir)
+            if is_xml_file(file_name) and file_name not in skip_files)
+    if workers > 1:
+        for file_name, text_list in iter_parsed_files(file_names,
+                _parse_xml_file, _init_xml_parser, (tag_file,), workers):
             for title, heading, text in text_list:
                 yield file_name, title, heading, text
+    else:
+        ## stream the groups of each file as they are parsed
+        _init_xml_parser(tag_file)
+        for file_name in file_names:
+            for title, heading, text in iter_xml_groups(file_name):
+                yield file_name, title, heading, text
@@ -0,0 +1,93 @@
+"""Sorted run files, for sorting and merging more records than fit in
+memory.  A run holds (key, values) records in key order, where the key is
+a byte string and the values are packed with a fixed-width struct, or
+are a single byte string when the run has no value struct.
+"""
+
+import heapq
+import os
+import shutil
+import struct
+from itertools import groupby
+
+COUNT = struct.Struct('>q')
+KEY_LENGTH = struct.Struct('>I')
+BUFFER_SIZE = 1 << 20
+
+def add_values(values_1, values_2):
+    """Combine two records by summing their values field by field.
+    """
+    return tuple([value_1 + value_2 for value_1, value_2
+            in zip(values_1, values_2)])
+
+def write_run(run_file, records, value_struct=COUNT):
+    """Write (key, values) records, which must already be sorted by key,
+    into a run file.
+    """
+    with open(run_file, 'wb', BUFFER_SIZE) as file:
+        for key, values in records:
+            file.write(KEY_LENGTH.pack(len(key)))
+            file.write(key)
+            if value_struct is None:
+                file.write(KEY_LENGTH.pack(len(values)))
+                file.write(values)
+            else:
+                file.write(value_struct.pack(*values))
+
+def iter_run(run_file, value_struct=COUNT):
+    """Yield the (key, values) records of a run file in order.
+    """
+    with open(run_file, 'rb', BUFFER_SIZE) as file:
+        while True:
+            header = file.read(KEY_LENGTH.size)
+            if not header:
+                return
+            key = file.read(KEY_LENGTH.unpack(header)[0])
+            if value_struct is None:
+                value_length = KEY_LENGTH.unpack(file.read(KEY_LENGTH.size))[0]
+                yield key, file.read(value_length)
+            else:
+                yield key, value_struct.unpack(file.read(value_struct.size))
+
+def merge_sorted(record_iters, combine=add_values):
+    """Merge several iterators of sorted (key, values) records into one
+    sorted stream, combining records which share a key.
+    """
+    merged = heapq.merge(*record_iters)
+    for key, records in groupby(merged, lambda record: record[0]):
+        records = [values for _, values in records]
+        values = records[0]
+        for other_values in records[1:]:
+            values = combine(values, other_values)
+        yield key, values
+
+class RunSet:
+    """A directory of run files which are merged into a single sorted
+    stream once all of them have been written.
+    """
+    def __init__(self, run_dir, value_struct=COUNT):
+        self.run_dir = run_dir
+        self.value_struct = value_struct
+        ## runs left over from an interrupted job would be merged in twice
+        if os.path.exists(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir)
+        self.run_files = []
+
+    def add_run(self, records):
+        """Write sorted (key, values) records as a new run.
+        """
+        run_file = os.path.join(self.run_dir, '%08d.run' % len(self.run_files))
+        write_run(run_file, records, self.value_struct)
+        self.run_files.append(run_file)
+
+    def merge(self, combine=add_values):
+        """Yield the records of every run in key order, combining records
+        which share a key.
+        """
+        return merge_sorted([iter_run(run_file, self.value_struct)
+                for run_file in self.run_files], combine)
+
+    def remove(self):
+        shutil.rmtree(self.run_dir)
+        self.run_files = []
@@ -0,0 +1,147 @@
+"""Wall and CPU time, throughput counters and peak memory of the stages
+of the pipeline, with an optional profile of each stage.
+
+The peak memory the system reports is that of the process so far, so a
+stage records both that and how far the peak rose while it ran.  A stage
+which stays below the peak of an earlier stage shows no growth.
+
+The stages record whatever the code they run counts with count(), such
+as documents and tokens read, DB records read and written, bytes read
+and flushes of buffered counts, and the seconds spent in phases timed
+with PhaseTimer.  Only work done in the process recording a stage is
+counted, although the CPU time of worker processes which have finished
+is included.
+"""
+
+import cProfile
+import json
+import os
+import resource
+import time
+from collections import defaultdict
+
+## the stages being recorded in this process, innermost last
+_recording = []
+
+def count(counter, amount=1):
+    """Add @amount to @counter of every stage being recorded.
+    """
+    for stats in _recording:
+        stats.counters[counter] += amount
+
+def count_file(file_name):
+    """Count a file which is read whole, and its bytes.
+    """
+    if _recording:
+        count('files')
+        count('bytes_read', os.path.getsize(file_name))
+
+def get_cpu_time():
+    """Return the user and system time of this process and its finished
+    children, in seconds.
+    """
+    times = os.times()
+    return sum(times[:4])
+
+def get_peak_memory():
+    """Return the peak resident memory of this process since it started,
+    or of its largest finished child if that was larger, in KB.
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+class PhaseTimer:
+    """Times a phase of a stage, adding the seconds it takes to the
+    '<name>_seconds' counter of every stage being recorded.
+
+    with PhaseTimer('flush'):
+        ...
+    """
+    def __init__(self, name):
+        self.counter = name + '_seconds'
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        count(self.counter, time.time() - self.start)
+
+class StageStats:
+    """Records a stage while it is used as a context manager, profiling
+    it into @profile_file if one is given.
+
+    with StageStats('features') as stats:
+        ...
+    stats.get_record()
+    """
+    def __init__(self, name, profile_file=None):
+        self.name = name
+        self.profile_file = profile_file
+        self.counters = defaultdict(int)
+        self.profile = None
+
+    def __enter__(self):
+        self.started = time.time()
+        self.start_cpu_time = get_cpu_time()
+        self.start_peak_memory = get_peak_memory()
+        _recording.append(self)
+        if self.profile_file:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_file)
+        self.wall_time = time.time() - self.started
+        self.cpu_time = get_cpu_time() - self.start_cpu_time
+        self.process_peak_memory = get_peak_memory()
+        self.peak_memory_growth = \
+                self.process_peak_memory - self.start_peak_memory
+        _recording.remove(self)
+
+    def get_record(self):
+        """Return the stage as a dictionary which can be written as JSON,
+        with the rate per second of its documents, tokens and bytes read.
+        """
+        record = {
+                'stage': self.name,
+                'started': self.started,
+                'wall_seconds': self.wall_time,
+                'cpu_seconds': self.cpu_time,
+                'process_peak_rss_kb': self.process_peak_memory,
+                'peak_rss_growth_kb': self.peak_memory_growth,
+                'counters': dict(self.counters),
+                'profile_file': self.profile_file,
+                }
+        for counter in ('docs', 'tokens', 'bytes_read'):
+            if counter in self.counters and self.wall_time > 0:
+                record[counter + '_per_second'] = \
+                        self.counters[counter] / self.wall_time
+        return record
+
+def run_stage(name, function, args, profile_file=None):
+    """Call @function with @args as the stage @name, returning the record
+    of the stage.
+    """
+    with StageStats(name, profile_file) as stats:
+        function(*args)
+    return stats.get_record()
+
+def append_log(log_file, record, **info):
+    """Append a stage record, along with the items of @info, to a log
+    holding a JSON object per line.
+    """
+    record = dict(record)
+    record.update(info)
+    with open(log_file, 'a') as log:
+        log.write(json.dumps(record, sort_keys=True) + '\n')
+
+def read_log(log_file):
+    """Return the stage records of a log written by append_log.
+    """
+    if not os.path.isfile(log_file):
+        return []
+    with open(log_file, 'r') as log:
+        return [json.loads(line) for line in log if line.strip()]
@@ -0,0 +1,49 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import column_index
+
+class GetVersionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_index(self, name, words):
+        index_dir = os.path.join(self.directory, name)
+        writer = column_index.IndexWriter(index_dir)
+        writer.add_doc('source', None, None,
+                [(word, position) for position, word in enumerate(words)])
+        writer.flush()
+        column_index.write_postings(index_dir)
+        return index_dir
+
+    def test_same_index(self):
+        index_dir = self.write_index('forum', [u'ab', u'cd'])
+        self.assertEqual(column_index.get_version(index_dir, 'forum'),
+                column_index.get_version(index_dir, 'forum'))
+
+    def test_same_index_other_name(self):
+        self.assertNotEqual(
+                column_index.get_version(
+                    self.write_index('forum', [u'ab', u'cd']), 'forum'),
+                column_index.get_version(
+                    self.write_index('medline', [u'ab', u'cd']), 'medline'))
+
+    def test_same_sizes_other_words(self):
+        ## the files of the two indexes have the same lengths and the
+        ## same term counts
+        self.assertNotEqual(
+                column_index.get_version(
+                    self.write_index('forum', [u'ab', u'cd']), 'forum'),
+                column_index.get_version(
+                    self.write_index('forum_2', [u'ef', u'gh']), 'forum'))
+
+if __name__ == '__main__':
+    unittest.main()
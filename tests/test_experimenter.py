@@ -0,0 +1,130 @@
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import experimenter
+
+def kill_worker():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def write_file(directory, file_name, contents):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    file_name = os.path.join(directory, file_name)
+    with open(file_name, 'w') as file:
+        file.write(contents)
+    return file_name
+
+class CorporaTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.experiment = experimenter.Experimenter(
+                os.path.join(self.directory, 'experiment'))
+        ## the segments are only looked up, so they don't need indexing
+        for corpus in ('phpBB', 'medline'):
+            self.experiment.index_contents[corpus] = (corpus, None, None)
+            self.experiment.segments.append(corpus)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_single_corpus(self):
+        self.assertEqual(self.experiment.get_segments('phpBB'),
+                self.experiment.get_segments(['phpBB']))
+        self.assertEqual(self.experiment.get_selection('phpBB'), ('phpBB',))
+
+    def test_single_corpus_directory(self):
+        self.assertEqual(self.experiment.get_selection('/data/medline/'),
+                ('medline',))
+
+    def test_single_corpus_feature_file(self):
+        target_file = write_file(self.directory, 'targets.txt', 'heart\n')
+        self.assertEqual(
+                self.experiment.get_feature_file(target_file, None, 50, 0,
+                    0, None, None, 'phpBB'),
+                self.experiment.get_feature_file(target_file, None, 50, 0,
+                    0, None, None, ['phpBB']))
+
+    def test_unindexed_corpus(self):
+        self.assertRaises(ValueError, self.experiment.get_segments, 'forum')
+
+class FeatureFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.experiment = experimenter.Experimenter(
+                os.path.join(self.directory, 'experiment'))
+        self.experiment.index_contents['phpBB'] = ('phpBB', None, None)
+        self.experiment.segments.append('phpBB')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_feature_file(self, target_file, truth_db=None):
+        return self.experiment.get_feature_file(target_file, None, 50, 0, 0,
+                truth_db, '5_way')
+
+    def test_same_name_other_directory(self):
+        self.assertNotEqual(
+                self.get_feature_file(write_file(os.path.join(self.directory,
+                    'forum'), 'targets.txt', 'heart\n')),
+                self.get_feature_file(write_file(os.path.join(self.directory,
+                    'medline'), 'targets.txt', 'stroke\n')))
+
+    def test_same_contents_other_directory(self):
+        self.assertEqual(
+                self.get_feature_file(write_file(os.path.join(self.directory,
+                    'forum'), 'targets.txt', 'heart\n')),
+                self.get_feature_file(write_file(os.path.join(self.directory,
+                    'medline'), 'targets.txt', 'heart\n')))
+
+    def test_other_truth_db(self):
+        target_file = write_file(self.directory, 'targets.txt', 'heart\n')
+        self.assertNotEqual(
+                self.get_feature_file(target_file, write_file(self.directory,
+                    'truth_1.db', 'a')),
+                self.get_feature_file(target_file, write_file(self.directory,
+                    'truth_2.db', 'b')))
+
+class ExpandGridTest(unittest.TestCase):
+    def get_corpora(self, corpora):
+        return [experiment['corpora'] for experiment in
+                experimenter._expand_grid({'target_file': 'targets.txt',
+                    'corpora': corpora})]
+
+    def test_corpora_left_out(self):
+        self.assertEqual(experimenter._expand_grid(
+            {'target_file': 'targets.txt'})[0]['corpora'], None)
+
+    def test_single_corpus(self):
+        self.assertEqual(self.get_corpora('phpBB'), [['phpBB']])
+
+    def test_corpus_per_selection(self):
+        self.assertEqual(self.get_corpora(['phpBB', 'medline']),
+                [['phpBB'], ['medline']])
+
+    def test_corpora_together(self):
+        self.assertEqual(self.get_corpora([['phpBB', 'medline'], 'phpBB']),
+                [['phpBB', 'medline'], ['phpBB']])
+
+class RunSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.experiment = experimenter.Experimenter(
+                os.path.join(self.directory, 'experiment'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_killed_worker(self):
+        task = experimenter.SweepTask(kill_worker, (),
+                [experimenter.Experiment(experimenter.RELATION_TASK, (0,))])
+        self.assertRaises(ValueError, self.experiment.run_sweep, [task], 2)
+        self.assertEqual(self.experiment.completed_tasks, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import column_index
+import count_db
+import get_cooccurrences
+from vocabulary import pack_pair
+
+TARGET = 1
+WORD_1 = 2
+WORD_2 = 3
+WORD_3 = 4
+
+def count(text, windows):
+    """Return the word counts and cooccurrence histograms of a text of
+    (term id, word_position) pairs, with TARGET as the only target.
+    """
+    get_cooccurrences.set_window(windows[-1])
+    word_counts = {}
+    cooccurrence_counts = {}
+    get_cooccurrences.get_counts(text, {}, {TARGET: None}, {}, word_counts,
+            cooccurrence_counts, windows)
+    return word_counts, cooccurrence_counts
+
+class GetCountsTest(unittest.TestCase):
+    def test_counts_words_within_window(self):
+        _, cooccurrences = count([(WORD_1, 0), (TARGET, 1), (WORD_2, 2),
+            (WORD_3, 3)], [2])
+        self.assertEqual(cooccurrences, {
+            pack_pair(TARGET, WORD_1): [1],
+            pack_pair(TARGET, WORD_2): [1],
+            })
+
+    def test_stop_word_gap_before_target(self):
+        ## positions 2 through 5 held stop words, so the words before
+        ## them are 5 and 6 words from the target, past the window of 3
+        word_counts, cooccurrences = count([(WORD_1, 0), (WORD_2, 1),
+            (TARGET, 6), (WORD_3, 7)], [3])
+        self.assertEqual(cooccurrences, {pack_pair(TARGET, WORD_3): [1]})
+        self.assertEqual(word_counts,
+                {WORD_1: 1, WORD_2: 1, TARGET: 1, WORD_3: 1})
+
+    def test_stop_word_gap_after_target(self):
+        _, cooccurrences = count([(TARGET, 0), (WORD_1, 1), (WORD_2, 5)],
+                [3])
+        self.assertEqual(cooccurrences, {pack_pair(TARGET, WORD_1): [1]})
+
+    def test_windows_bucket_distances(self):
+        ## WORD_1 is 4 words before the target and WORD_2 1 word after
+        _, cooccurrences = count([(WORD_1, 0), (TARGET, 4), (WORD_2, 5)],
+                [2, 5])
+        self.assertEqual(cooccurrences, {
+            pack_pair(TARGET, WORD_1): [0, 1],
+            pack_pair(TARGET, WORD_2): [1, 0],
+            })
+
+FILLERS = [u'w%d' % word_num for word_num in range(12)]
+TARGETS = [u'heart', u'stroke', u'myocardial infarction']
+SYNONYMS = [(u'cva', u'stroke'), (u'mi', u'myocardial infarction')]
+## single words of the targets, synonyms and phrases, and the phrase
+## itself, or just its first or last word
+TERMS = [[u'heart'], [u'stroke'], [u'cva'], [u'mi'],
+        [u'myocardial', u'infarction'], [u'myocardial'], [u'infarction']]
+WINDOWS = [2, 3, 6]
+## a region reaches the largest window plus the longest phrase
+MARGIN = WINDOWS[-1] + 2
+
+def make_field(words):
+    """Place @words at consecutive word positions.
+    """
+    field = []
+    word_pos = 0
+    for word in words:
+        field.append((word, word_pos))
+        word_pos += 1
+    return field
+
+def make_random_field(generator, length):
+    words = []
+    while len(words) < length:
+        if generator.random() < 0.1:
+            words.extend(generator.choice(TERMS))
+        else:
+            words.append(generator.choice(FILLERS))
+    field = []
+    word_pos = 0
+    for word in words:
+        field.append((word, word_pos))
+        ## a gap left by stop words, which can also split a phrase
+        word_pos += generator.choice([1, 1, 1, 1, 2, 3, 8])
+    return field
+
+class RegionCountsTest(unittest.TestCase):
+    """Counting the regions around the postings of the targets, synonyms
+    and phrases counts the same as counting every field of the index.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.directory, 'index')
+        self.target_file = os.path.join(self.directory, 'targets.txt')
+        with open(self.target_file, 'w') as file:
+            file.writelines(['%s\n' % target for target in TARGETS])
+        self.synonym_file = os.path.join(self.directory, 'synonyms.txt')
+        with open(self.synonym_file, 'w') as file:
+            file.writelines(['%s:%s\n' % synonym for synonym in SYNONYMS])
+
+        writer = column_index.IndexWriter(self.index_dir)
+        fillers = [FILLERS[word_num % len(FILLERS)]
+                for word_num in range(3 * MARGIN)]
+        ## phrases and synonyms at the edges of the regions around a
+        ## target, just inside, on and just past the margin
+        for offset in range(MARGIN - 2, MARGIN + 3):
+            for term in TERMS[2:5]:
+                writer.add_doc('edges', None, None, make_field(fillers[:5] +
+                    [u'heart'] + fillers[:offset - 1] + term + fillers))
+                writer.add_doc('edges', None, None, make_field(fillers +
+                    term + fillers[:offset - len(term)] + [u'stroke'] +
+                    fillers[:5]))
+        generator = random.Random(1)
+        for doc_num in range(60):
+            fields = [None, None, None]
+            for field in range(3):
+                if generator.random() < 0.7:
+                    fields[field] = make_random_field(generator,
+                            generator.randint(1, 80))
+            writer.add_doc('random', *fields)
+        writer.flush()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def scan(self):
+        """Count every field of the index with get_counts, returning the
+        word counts and the cooccurrence counts of each window.
+        """
+        reader = column_index.IndexReader(self.index_dir)
+        try:
+            targets, phrase_trie, synonyms, _, _ = \
+                    get_cooccurrences.get_term_ids(
+                        get_cooccurrences.get_targets_from_file(
+                            self.target_file),
+                        get_cooccurrences.get_synonyms_from_file(
+                            self.synonym_file), reader.vocabulary)
+            get_cooccurrences.set_window(WINDOWS[-1])
+            word_counts = {}
+            cooccurrence_counts = {}
+            for doc_id in range(len(reader)):
+                for field in range(column_index.DOC_FIELDS):
+                    field = reader.get_field(doc_id, field)
+                    if field is None or not len(field[0]):
+                        continue
+                    get_cooccurrences.get_counts(
+                            zip(field[0].tolist(), field[1].tolist()),
+                            synonyms, targets, phrase_trie, word_counts,
+                            cooccurrence_counts, WINDOWS)
+        finally:
+            reader.close()
+        return word_counts, [dict([(pair, sum(histogram[:window_num + 1]))
+            for pair, histogram in cooccurrence_counts.iteritems()
+            if sum(histogram[:window_num + 1])])
+            for window_num in range(len(WINDOWS))]
+
+    def count_regions(self, workers):
+        """Count the regions of the index with get_window_cooccurrences,
+        returning the counts the way scan does.
+        """
+        def db_file(name):
+            return os.path.join(self.directory, '%s_%d.db' % (name, workers))
+        get_cooccurrences.get_window_cooccurrences(self.index_dir,
+                self.target_file, self.synonym_file, WINDOWS,
+                [db_file('words_%d' % window) for window in WINDOWS],
+                [db_file('cooccurrences_%d' % window) for window in WINDOWS],
+                [db_file('target_ids_%d' % window) for window in WINDOWS],
+                workers)
+        def read(db_file):
+            keys, counts = count_db.read_counts(db_file)
+            return dict(zip([int(key) for key in keys], counts.tolist()))
+        return read(db_file('words_%d' % WINDOWS[0])), \
+                [read(db_file('cooccurrences_%d' % window))
+                    for window in WINDOWS]
+
+    def test_regions_count_like_a_scan(self):
+        word_counts, cooccurrence_counts = self.scan()
+        self.assertTrue(all(cooccurrence_counts))
+        self.assertEqual(self.count_regions(1),
+                (word_counts, cooccurrence_counts))
+
+    def test_regions_count_like_a_scan_in_workers(self):
+        self.assertEqual(self.count_regions(2), self.scan())
+
+if __name__ == '__main__':
+    unittest.main()
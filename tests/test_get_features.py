@@ -0,0 +1,132 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import get_features
+import numpy
+
+TARGET_WORDS = {3: u'heart attack', 5: u"crohn's, disease",
+        8: u'm\xe9ni\xe8re'}
+## the (context similarity, normal similarity, PMI or None, cooccurrence
+## count, target id, target id) features of relations, with the pearson
+## correlation of their targets or None
+RELATIONS = [
+        (('0.5', '0.25', '1.75', 4, 3, 5), 0.35),
+        (('0.125', '0.0', None, 0, 3, 8), None),
+        (('1.0', '0.75', '-2.5', 12, 5, 8), -0.2),
+        (('0.015625', '0.5', '3.0', 1, 3, 8), 0.05),
+        (('0.0', '0.0', None, 0, 5, 3), -0.5),
+        ]
+
+def write_relations(writer, relations):
+    """Hand @relations to @writer the way write_feature_rows does.
+    """
+    for features, pearson in relations:
+        context_sim, norm, pmi, count, id_1, id_2 = features
+        row = '%s,%s,%s,%d,%s' % (context_sim, norm, pmi or '?', count,
+                get_features.quote_arff_string("%s-%s" % (
+                    TARGET_WORDS[id_1].encode(get_features.DEF_LOCALE),
+                    TARGET_WORDS[id_2].encode(get_features.DEF_LOCALE))))
+        writer.write(row, features, pearson)
+
+class ArffWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.feature_file = os.path.join(self.directory, 'features.arff')
+        self.writer = get_features.ArffWriter(self.feature_file,
+                get_features.FEATURE_ATTRIBUTES)
+        self.writer.write("1,2,3,4,'a-b'", None, '0.5')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_finished(self):
+        self.assertFalse(os.path.exists(self.feature_file))
+        self.writer.finish()
+        self.writer.close()
+        self.assertEqual(open(self.feature_file).read().splitlines()[-1],
+                "1,2,3,4,'a-b'")
+        self.assertEqual(os.listdir(self.directory), ['features.arff'])
+
+    def test_not_finished(self):
+        self.writer.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+class FeatureArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        ## export the arrays a few rows at a time
+        self.chunk_size = get_features.ARRAY_CHUNK_SIZE
+        get_features.ARRAY_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        get_features.ARRAY_CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.directory)
+
+    def write(self, writer, relations):
+        try:
+            write_relations(writer, relations)
+            writer.finish()
+        finally:
+            writer.close()
+
+    def round_trip(self, relations, truth_function):
+        """Return the arff file ArffWriter writes for @relations, and the
+        one exported from the .npz file FeatureArrayWriter writes.
+        """
+        arff_file = os.path.join(self.directory, 'features.arff')
+        npz_file = os.path.join(self.directory, 'features.npz')
+        exported_file = os.path.join(self.directory, 'exported.arff')
+        self.write(get_features.ArffWriter(arff_file,
+            get_features.FEATURE_ATTRIBUTES, truth_function), relations)
+        self.write(get_features.FeatureArrayWriter(npz_file, TARGET_WORDS,
+            truth_function), relations)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                ['features.arff', 'features.npz'])
+        get_features.export_arff(npz_file, exported_file)
+        with open(arff_file) as file:
+            arff = file.read()
+        with open(exported_file) as file:
+            return arff, file.read()
+
+    def test_load(self):
+        npz_file = os.path.join(self.directory, 'features.npz')
+        self.write(get_features.FeatureArrayWriter(npz_file, TARGET_WORDS,
+            '5_way'), RELATIONS)
+        arrays = get_features.load_feature_arrays(npz_file)
+        self.assertTrue(isinstance(arrays['pmi'], numpy.memmap))
+        self.assertEqual(arrays['context_similarity'].tolist(),
+                [float(features[0]) for features, _ in RELATIONS])
+        self.assertEqual(numpy.isnan(arrays['pmi']).tolist(),
+                [features[2] is None for features, _ in RELATIONS])
+        self.assertEqual(arrays['cooccurrences'].tolist(),
+                [features[3] for features, _ in RELATIONS])
+        self.assertEqual(zip(arrays['target_1'].tolist(),
+            arrays['target_2'].tolist()),
+            [features[4:] for features, _ in RELATIONS])
+        self.assertEqual(arrays['target_ids'].tolist(), sorted(TARGET_WORDS))
+        self.assertEqual([word.decode('utf-8') for word
+            in arrays['target_words'].tolist()],
+            [TARGET_WORDS[target_id] for target_id in sorted(TARGET_WORDS)])
+        self.assertEqual([arrays['truth_nominals'][truth] if truth != -1
+            else None for truth in arrays['truth'].tolist()],
+            ['STRONG_POS', None, 'MILD_NEG', 'NONE', 'STRONG_NEG'])
+
+    def test_export(self):
+        arff, exported = self.round_trip(RELATIONS, None)
+        self.assertEqual(exported, arff)
+
+    def test_export_truth(self):
+        arff, exported = self.round_trip(RELATIONS, '5_way')
+        self.assertEqual(exported, arff)
+
+    def test_export_no_relations(self):
+        arff, exported = self.round_trip([], '2_way_mild')
+        self.assertEqual(exported, arff)
+
+if __name__ == '__main__':
+    unittest.main()
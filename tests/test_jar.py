@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import column_index
+import jar
+
+CORPUS = 'corpus'
+DOCS = [('a.xml', u'the heart attack'), ('a.xml', u'a stroke'),
+        ('b.xml', u'heart failure and stroke'), ('c.xml', u'no words here')]
+
+class Killed(Exception):
+    pass
+
+def index_corpus(index_dir, total_words_file):
+    """Index DOCS the way build_index indexes an xml corpus, resuming from
+    the checkpoint of an interrupted run.
+    """
+    index_jar = jar.Jar(index_dir, total_words_file, 100, None)
+    resume = index_jar.start_corpus(CORPUS)
+    if resume is None:
+        return
+    skip_sources, skip_docs = resume
+    for source, text in DOCS:
+        if source in skip_sources:
+            continue
+        if skip_docs:
+            skip_docs -= 1
+            continue
+        index_jar.add_doc(source, None, None,
+                index_jar.index_and_count_text(text))
+    index_jar.finish_corpus()
+
+class FinishCorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write_atomically = column_index.write_atomically
+
+    def tearDown(self):
+        jar.write_atomically = column_index.write_atomically = \
+                self.write_atomically
+        shutil.rmtree(self.directory)
+
+    def index(self, name, kill_after=None):
+        """Index DOCS into the index @name, killing the run after the
+        @kill_after'th file written once the documents were added.
+        Returns whether the run was killed.
+        """
+        writes = []
+        def write_atomically(file_name, write):
+            self.write_atomically(file_name, write)
+            writes.append(file_name)
+            if len(writes) == kill_after:
+                raise Killed()
+        def finish_corpus(index_jar):
+            jar.write_atomically = column_index.write_atomically = \
+                    write_atomically
+            try:
+                finish(index_jar)
+            finally:
+                jar.write_atomically = column_index.write_atomically = \
+                        self.write_atomically
+        finish = jar.Jar.finish_corpus
+        jar.Jar.finish_corpus = finish_corpus
+        try:
+            index_corpus(os.path.join(self.directory, name),
+                    os.path.join(self.directory, name + '_words.txt'))
+        except Killed:
+            return True
+        finally:
+            jar.Jar.finish_corpus = finish
+        return False
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name + '_words.txt')) as file:
+            total_words = file.read()
+        reader = column_index.IndexReader(os.path.join(self.directory, name))
+        try:
+            return (total_words, len(reader), list(reader.term_counts),
+                    list(reader.postings))
+        finally:
+            reader.close()
+
+    def test_killed_while_finishing(self):
+        self.index('clean')
+        kill_after = 1
+        while self.index('killed_%d' % kill_after, kill_after):
+            self.index('killed_%d' % kill_after)
+            self.assertEqual(self.read('killed_%d' % kill_after),
+                    self.read('clean'))
+            kill_after += 1
+        ## the word count, the postings, the term counts and both
+        ## checkpoints were each written
+        self.assertTrue(kill_after > 5)
+
+if __name__ == '__main__':
+    unittest.main()
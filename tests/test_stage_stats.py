@@ -0,0 +1,25 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import stage_stats
+
+MB = 1 << 20
+
+def allocate(size):
+    return len(bytearray(size))
+
+class PeakMemoryTest(unittest.TestCase):
+    def test_growth_per_stage(self):
+        first = stage_stats.run_stage('first', allocate, (64 * MB,))
+        ## the second stage stays below the peak of the first
+        second = stage_stats.run_stage('second', allocate, (8 * MB,))
+        self.assertTrue(first['peak_rss_growth_kb'] >= 32 * 1024)
+        self.assertEqual(second['peak_rss_growth_kb'], 0)
+        self.assertTrue(second['process_peak_rss_kb'] >=
+                first['process_peak_rss_kb'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Single pass tokenizing of text into indexed words, giving exactly the
+words of normalize followed by split, without copying the text once for
+every normalization step.
+"""
+
+import re
+import string
+
+from normalize import TAG_RE
+
+## the characters normalize.PUNCTUATION_RE matches, where the backslash
+## only escapes the closing bracket
+PUNCTUATION = '!"#$%&\'()*+,./:;<=>?@[]^_`{|}~'
+
+## lowers ascii letters and turns punctuation into spaces in one pass over
+## a byte string, the formatting characters are already split on
+STR_TABLE = string.maketrans(string.ascii_uppercase + PUNCTUATION,
+        string.ascii_lowercase + ' ' * len(PUNCTUATION))
+## a word of unicode text is a run of characters which are neither
+## whitespace, as unicode.split sees it, nor punctuation
+UNICODE_WORD_RE = re.compile(u'[^\\s%s]+' % re.escape(PUNCTUATION),
+        re.UNICODE)
+
+def split_words(text):
+    """Return the words of text, the same as normalize(text).split().
+    """
+    if '<' in text:
+        text = TAG_RE.sub('', text)
+    if isinstance(text, unicode):
+        return UNICODE_WORD_RE.findall(text.lower())
+    return text.translate(STR_TABLE).split()
+
+def tokenize(text, stop_words):
+    """Return the (word, word_position) pairs of text with stop words
+    removed, along with the number of words in text, stop words included.
+    """
+    words = split_words(text)
+    return ([(word, word_pos) for word_pos, word in enumerate(words)
+             if word not in stop_words], len(words))
@@ -0,0 +1,56 @@
+"""Integer word ids, and the canonical 64-bit keys of pairs of them.
+
+Word ids come from the vocabulary of the index.  Targets which are not a
+single indexed word (multi-word targets, synonyms of unseen words) are
+given ids past the end of the index vocabulary, and every stage after
+cooccurrence counting finds the words behind target ids in a target id
+file written next to the counts.
+"""
+
+import struct
+
+KEY = struct.Struct('>Q')
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+def pack_pair(id_1, id_2):
+    """Return the canonical key of an unordered pair of word ids, with
+    the smaller id in the high 32 bits.
+    """
+    if id_2 < id_1:
+        id_1, id_2 = id_2, id_1
+    return (id_1 << ID_BITS) | id_2
+
+def unpack_pair(pair):
+    """Return the (smaller, larger) word ids of a pair key.
+    """
+    return pair >> ID_BITS, pair & ID_MASK
+
+def pack_key(key):
+    """Return a word id or pair key as a db key.  Big-endian keys sort in
+    numeric order in a B-tree.
+    """
+    return KEY.pack(key)
+
+def unpack_key(key):
+    return KEY.unpack(key)[0]
+
+def write_target_ids(target_ids_file, target_words):
+    """Write a {target id: target word} dictionary to a file.
+    """
+    with open(target_ids_file, 'w') as file:
+        for target_id, word in sorted(target_words.iteritems()):
+            if isinstance(word, unicode):
+                word = word.encode('utf-8')
+            file.write('%d\t%s\n' % (target_id, word))
+
+def read_target_ids(target_ids_file):
+    """Return the {target id: target word} dictionary written by
+    write_target_ids.
+    """
+    target_words = {}
+    with open(target_ids_file, 'r') as file:
+        for line in file:
+            target_id, word = line[:-1].split('\t', 1)
+            target_words[int(target_id)] = word.decode('utf-8')
+    return target_words